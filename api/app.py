@@ -1,6 +1,6 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_file
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 import os
 import json
 import base64
@@ -8,7 +8,6 @@ import logging
 from http import HTTPStatus
 from urllib.parse import urlparse, unquote
 from pathlib import PurePosixPath
-import requests
 import tempfile
 import uuid
 from dashscope import ImageSynthesis
@@ -16,7 +15,16 @@ import hashlib
 from datetime import datetime, timedelta
 import secrets
 from database_migration import DatabaseMigration
-from email_verification import email_service
+from db_pool import ConnectionPool, PoolExhaustedError
+from usage_recorder import UsageRecorder
+from user_cache import UserCache, LocalCacheBackend, RedisCacheBackend
+from generation_queue import GenerationJobQueue, QueueFullError
+from image_store import ImageStore, DiskImageStore
+from result_cache import ResultCache, make_cache_key
+from single_flight import AsyncSingleFlight
+from async_generation import AsyncGenerationPipeline
+from rate_limiter import RateLimiter, LocalBucketBackend, RedisBucketBackend, parse_rate
+from email_verification import EmailVerificationService
 
 # 加载环境变量
 try:
@@ -87,10 +95,89 @@ MYSQL_CONFIG = {
     'port': int(os.getenv('MYSQL_PORT', 3306))
 }
 
+# 全局邮箱验证服务实例（VERIFICATION_CODE_STORE=mysql 时与应用共用 MYSQL_CONFIG）
+email_service = EmailVerificationService(mysql_config=MYSQL_CONFIG)
+
+# 连接池配置
+MYSQL_POOL_CONFIG = {
+    'pool_size': int(os.getenv('MYSQL_POOL_SIZE', 10)),
+    'checkout_timeout': float(os.getenv('MYSQL_POOL_TIMEOUT', 10)),
+    'idle_timeout': float(os.getenv('MYSQL_POOL_IDLE_SECONDS', 300)),
+    'ping_interval': float(os.getenv('MYSQL_POOL_PING_SECONDS', 30)),
+    'max_lifetime': float(os.getenv('MYSQL_POOL_MAX_LIFETIME', 3600))
+}
+
+# 使用记录写入配置：异步批量写入，或与试用次数扣减在同一事务中同步写入
+USAGE_LOG_ASYNC = os.getenv('USAGE_LOG_ASYNC', 'True').lower() in ('true', '1', 'yes')
+USAGE_LOG_CONFIG = {
+    'batch_size': int(os.getenv('USAGE_LOG_BATCH_SIZE', 200)),
+    'flush_interval': float(os.getenv('USAGE_LOG_FLUSH_SECONDS', 1.0)),
+    'max_buffer': int(os.getenv('USAGE_LOG_MAX_BUFFER', 10000)),
+    'max_attempts': int(os.getenv('USAGE_LOG_MAX_ATTEMPTS', 3))
+}
+# usage_logs.demo_type 列长度
+DEMO_TYPE_MAX_LENGTH = 50
+
+# 用户信息缓存配置：local 为进程内缓存（仅单个工作进程，API_WORKERS>1 时自动禁用），redis 为多进程共享缓存
+USER_CACHE_BACKEND = os.getenv('USER_CACHE_BACKEND', 'local').lower()
+USER_CACHE_REDIS_URL = os.getenv('USER_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+USER_CACHE_MAX_ITEMS = int(os.getenv('USER_CACHE_MAX_ITEMS', 10000))
+
+def create_user_cache():
+    """根据配置创建用户信息缓存"""
+    if USER_CACHE_BACKEND == 'redis':
+        backend = RedisCacheBackend(USER_CACHE_REDIS_URL)
+    elif int(os.getenv('API_WORKERS', 1)) > 1:
+        # 进程内缓存的失效不会通知其他 gunicorn 工作进程，多进程时禁用（容量为 0，始终未命中）
+        logger.warning("进程内用户缓存只在单个工作进程内有效，API_WORKERS>1 时已禁用，请设置 USER_CACHE_BACKEND=redis")
+        backend = LocalCacheBackend(max_items=0)
+    else:
+        backend = LocalCacheBackend(max_items=USER_CACHE_MAX_ITEMS)
+    return UserCache(backend, ttl_seconds=USER_CACHE_TTL)
+
+# 认证接口限流配置，格式为 "次数/秒数"（令牌桶容量/补满时间），留空表示不限流
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() in ('true', '1', 'yes')
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'local').lower()
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+# 信任反向代理（web/nginx.conf）传入的 X-Real-IP / X-Forwarded-For 作为客户端IP；部署在代理之后时必须开启（docker-compose 默认开启）
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', 'False').lower() in ('true', '1', 'yes')
+RATE_LIMIT_RULES = {
+    'send_code_ip': os.getenv('RATE_LIMIT_SEND_CODE_IP', '5/60'),
+    'send_code_domain': os.getenv('RATE_LIMIT_SEND_CODE_DOMAIN', '60/60'),
+    'send_code_global': os.getenv('RATE_LIMIT_SEND_CODE_GLOBAL', '300/60'),
+    'login_ip': os.getenv('RATE_LIMIT_LOGIN_IP', '20/60'),
+    'login_domain': os.getenv('RATE_LIMIT_LOGIN_DOMAIN', '300/60'),
+    'login_global': os.getenv('RATE_LIMIT_LOGIN_GLOBAL', ''),
+    'register_ip': os.getenv('RATE_LIMIT_REGISTER_IP', '10/60'),
+    'register_domain': os.getenv('RATE_LIMIT_REGISTER_DOMAIN', '60/60'),
+    'register_global': os.getenv('RATE_LIMIT_REGISTER_GLOBAL', '300/60')
+}
+
+def create_rate_limiter():
+    """根据配置创建限流器，未启用时返回 None"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    if RATE_LIMIT_BACKEND == 'redis':
+        backend = RedisBucketBackend(RATE_LIMIT_REDIS_URL)
+    else:
+        backend = LocalBucketBackend(max_keys=RATE_LIMIT_MAX_KEYS)
+    return RateLimiter(backend, {name: parse_rate(spec) for name, spec in RATE_LIMIT_RULES.items()})
+
+# 全局限流器
+rate_limiter = create_rate_limiter()
+
 class UserDatabase:
     def __init__(self):
         # 运行数据库迁移
         self.run_migrations()
+        # 连接池，所有查询复用已建立的连接
+        self.pool = ConnectionPool(MYSQL_CONFIG, **MYSQL_POOL_CONFIG)
+        # 使用记录异步写入器
+        self.usage_recorder = UsageRecorder(self.get_connection, **USAGE_LOG_CONFIG) if USAGE_LOG_ASYNC else None
+        # 用户信息缓存
+        self.user_cache = create_user_cache()
     
     def run_migrations(self):
         """运行数据库迁移"""
@@ -108,14 +195,17 @@ class UserDatabase:
             raise e
     
     def get_connection(self):
-        """获取MySQL连接"""
+        """从连接池借出MySQL连接，close() 时归还"""
         try:
-            connection = mysql.connector.connect(**MYSQL_CONFIG)
-            return connection
-        except Error as e:
+            return self.pool.acquire()
+        except (Error, PoolExhaustedError) as e:
             logger.error(f"MySQL连接失败: {e}")
             raise e
     
+    def get_pool_stats(self):
+        """获取连接池指标"""
+        return self.pool.get_stats()
+    
     def hash_password(self, password):
         """哈希密码"""
         return hashlib.sha256(password.encode()).hexdigest()
@@ -123,20 +213,22 @@ class UserDatabase:
     def create_user(self, email, password, role='user'):
         """创建用户"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            password_hash = self.hash_password(password)
-            
-            cursor.execute(
-                'INSERT INTO users (email, password_hash, role, demo_count, created_at, updated_at) VALUES (%s, %s, %s, %s, NOW(), NOW())',
-                (email, password_hash, role, 5 if role == 'user' else 999999)
-            )
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                password_hash = self.hash_password(password)
+                
+                cursor.execute(
+                    'INSERT INTO users (email, password_hash, role, demo_count, created_at, updated_at) VALUES (%s, %s, %s, %s, NOW(), NOW())',
+                    (email, password_hash, role, 5 if role == 'user' else 999999)
+                )
+                
+                user_id = cursor.lastrowid
+                conn.commit()
+                cursor.close()
             
-            user_id = cursor.lastrowid
-            conn.commit()
-            cursor.close()
-            conn.close()
+            # 清除可能残留的同ID缓存（如用户被删除后ID复用）
+            self.user_cache.invalidate(user_id)
             
             logger.info(f"用户创建成功: {email}, 角色: {role}")
             return user_id
@@ -150,54 +242,62 @@ class UserDatabase:
     def verify_user(self, email, password):
         """验证用户"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            password_hash = self.hash_password(password)
-            
-            cursor.execute(
-                'SELECT id, email, role, demo_count FROM users WHERE email = %s AND password_hash = %s',
-                (email, password_hash)
-            )
-            
-            user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                password_hash = self.hash_password(password)
+                
+                cursor.execute(
+                    'SELECT id, email, role, demo_count FROM users WHERE email = %s AND password_hash = %s',
+                    (email, password_hash)
+                )
+                
+                user = cursor.fetchone()
+                cursor.close()
             
             if user:
-                return {
+                user_info = {
                     'id': user[0],
                     'email': user[1],
                     'is_admin': user[2] == 'admin',
                     'trial_count': user[3]
                 }
+                # 登录时按邮箱读库，无法在读库前取得缓存版本号，因此不回填缓存
+                return user_info
             return None
         except Exception as e:
             logger.error(f"验证用户失败: {e}")
             return None
     
     def get_user_by_id(self, user_id):
-        """通过ID获取用户信息"""
+        """通过ID获取用户信息（优先读取缓存）"""
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
+        # 读库前取得版本号，读库期间用户被修改（缓存失效）时不回填旧数据
+        cache_version = self.user_cache.version(user_id)
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT id, email, role, demo_count FROM users WHERE id = %s',
-                (user_id,)
-            )
-            
-            user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(
+                    'SELECT id, email, role, demo_count FROM users WHERE id = %s',
+                    (user_id,)
+                )
+                
+                user = cursor.fetchone()
+                cursor.close()
             
             if user:
-                return {
+                user_info = {
                     'id': user[0],
                     'email': user[1],
                     'is_admin': user[2] == 'admin',
                     'trial_count': user[3]
                 }
+                self.user_cache.set(user_info, cache_version)
+                return user_info
             return None
         except Exception as e:
             logger.error(f"获取用户信息失败: {e}")
@@ -206,17 +306,16 @@ class UserDatabase:
     def get_user_by_email(self, email):
         """通过邮箱获取用户信息"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT id, email, role, demo_count FROM users WHERE email = %s',
-                (email,)
-            )
-            
-            user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(
+                    'SELECT id, email, role, demo_count FROM users WHERE email = %s',
+                    (email,)
+                )
+                
+                user = cursor.fetchone()
+                cursor.close()
             
             if user:
                 return {
@@ -231,63 +330,76 @@ class UserDatabase:
             return None
     
     def use_trial(self, user_id, demo_type='image_generation'):
-        """使用试用次数"""
+        """使用试用次数
+
+        单条条件 UPDATE 原子扣减；usage_logs 由异步写入器批量写入，
+        未启用异步写入时在同一事务中写入。
+        剩余次数通过 LAST_INSERT_ID(expr) 随 UPDATE 的 OK 包返回，无需再次查询。
+        """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # 获取当前试用次数
-            cursor.execute('SELECT demo_count, role FROM users WHERE id = %s', (user_id,))
-            result = cursor.fetchone()
-            
-            if not result:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                # 原子扣减试用次数，管理员不扣减
+                cursor.execute(
+                    """UPDATE users
+                       SET demo_count = LAST_INSERT_ID(demo_count - 1), updated_at = NOW()
+                       WHERE id = %s AND demo_count > 0 AND role <> 'admin'""",
+                    (user_id,)
+                )
+                
+                if cursor.rowcount == 1:
+                    new_trial_count = cursor.lastrowid
+                    is_admin = False
+                else:
+                    # 未扣减：区分用户不存在、管理员和次数已用完
+                    cursor.execute('SELECT role FROM users WHERE id = %s', (user_id,))
+                    result = cursor.fetchone()
+                    
+                    if not result:
+                        cursor.close()
+                        conn.rollback()
+                        raise ValueError("用户不存在")
+                    
+                    if result[0] != 'admin':
+                        cursor.close()
+                        conn.rollback()
+                        raise ValueError("试用次数已用完")
+                    
+                    new_trial_count = 999999
+                    is_admin = True
+                
+                if not self.usage_recorder:
+                    # 同步模式：使用日志与扣减在同一事务中提交
+                    cursor.execute(
+                        'INSERT INTO usage_logs (user_id, demo_type, used_at) VALUES (%s, %s, NOW())',
+                        (user_id, demo_type)
+                    )
+                
+                conn.commit()
                 cursor.close()
-                conn.close()
-                raise ValueError("用户不存在")
             
-            current_trials, role = result
-            is_admin = role == 'admin'
+            self.user_cache.invalidate(user_id)
+            self.record_usage(user_id, demo_type)
             
-            # 管理员无限制，直接返回成功
             if is_admin:
-                cursor.close()
-                conn.close()
                 logger.info(f"管理员用户 {user_id} 使用AI功能（无限制）")
-                return {
-                    'success': True,
-                    'remaining_trials': 999999,
-                    'is_admin': True
-                }
-            
-            # 检查试用次数
-            if current_trials <= 0:
-                cursor.close()
-                conn.close()
-                raise ValueError("试用次数已用完")
-            
-            # 减少试用次数
-            new_trial_count = current_trials - 1
-            cursor.execute(
-                'UPDATE users SET demo_count = %s, updated_at = NOW() WHERE id = %s',
-                (new_trial_count, user_id)
-            )
-            
-            # 提交用户试用次数更新
-            conn.commit()
-            
-            cursor.close()
-            conn.close()
-            
-            logger.info(f"用户 {user_id} 使用试用次数，剩余: {new_trial_count}")
+            else:
+                logger.info(f"用户 {user_id} 使用试用次数，剩余: {new_trial_count}")
             return {
                 'success': True,
                 'remaining_trials': new_trial_count,
-                'is_admin': False
+                'is_admin': is_admin
             }
         except Exception as e:
             logger.error(f"使用试用次数失败: {e}")
             raise e
     
+    def record_usage(self, user_id, demo_type):
+        """异步记录一次AI使用（未启用异步写入时不做处理）"""
+        if self.usage_recorder:
+            self.usage_recorder.record(user_id, demo_type)
+    
     def check_trial_status(self, user_id):
         """检查试用状态"""
         try:
@@ -311,147 +423,192 @@ class UserDatabase:
 # 初始化数据库
 user_db = UserDatabase()
 
+# 图片下载配置
+IMAGE_DOWNLOAD_TIMEOUT = float(os.getenv('IMAGE_DOWNLOAD_TIMEOUT', 30))  # 单张图片下载时限（秒）
+IMAGE_DOWNLOAD_TASK_TIMEOUT = float(os.getenv('IMAGE_DOWNLOAD_TASK_TIMEOUT', 60))  # 单个任务全部图片下载时限（秒）
+
+# 异步生成流水线配置：创建任务/轮询/下载在事件循环中以协程执行（需安装 httpx）
+DASHSCOPE_BASE_URL = os.getenv('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/api/v1')
+GENERATION_HTTP_CONNECTIONS = int(os.getenv('GENERATION_HTTP_CONNECTIONS', 100))
+GENERATION_POLL_INTERVAL = float(os.getenv('GENERATION_POLL_INTERVAL', 1.0))  # 首次轮询间隔（秒）
+GENERATION_MAX_POLL_INTERVAL = float(os.getenv('GENERATION_MAX_POLL_INTERVAL', 5.0))  # 轮询间隔上限（秒）
+GENERATION_TASK_TIMEOUT = float(os.getenv('GENERATION_TASK_TIMEOUT', 600))  # 等待上游任务完成的时限（秒）
+
+# 图片返回格式: url 返回图片ID，由 /api/images/<id> 读取原始字节；base64 为兼容旧客户端内联 data URL
+IMAGE_RESPONSE_FORMATS = ('url', 'base64')
+IMAGE_RESPONSE_FORMAT = os.getenv('IMAGE_RESPONSE_FORMAT', 'url')
+IMAGE_STORE_MAX_BYTES = int(os.getenv('IMAGE_STORE_MAX_MB', 1024)) * 1024 * 1024
+# 图片存储目录，设置为空时只保存在进程内存中
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_images'))
+IMAGE_STORE_TTL_SECONDS = int(os.getenv('IMAGE_STORE_TTL_HOURS', 72)) * 3600
+
+# 全局生成图片存储
+if IMAGE_STORE_DIR:
+    image_store = DiskImageStore(IMAGE_STORE_DIR, max_bytes=IMAGE_STORE_MAX_BYTES, ttl_seconds=IMAGE_STORE_TTL_SECONDS)
+else:
+    image_store = ImageStore(max_bytes=IMAGE_STORE_MAX_BYTES)
+
+# 生成结果缓存配置（默认关闭）
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'False').lower() in ('true', '1', 'yes')
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 86400))
+RESULT_CACHE_MEMORY_ITEMS = int(os.getenv('RESULT_CACHE_MEMORY_ITEMS', 1000))
+# 持久层 SQLite 文件，设置为空时只使用内存层
+RESULT_CACHE_DB = os.getenv('RESULT_CACHE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result_cache.db'))
+
+def load_image_base64(image_id):
+    """从图片存储读取图片并转换为 data URL，图片已被淘汰时返回 None"""
+    entry = image_store.get(image_id)
+    if entry is None:
+        return None
+    content = entry['data']
+    if content is None:
+        with open(entry['path'], 'rb') as f:
+            content = f.read()
+    img_base64 = base64.b64encode(content).decode('utf-8')
+    return f"data:{entry['content_type']};base64,{img_base64}"
+
 class ImageGenerator:
     def __init__(self):
         self.api_key = os.getenv("DASHSCOPE_API_KEY", "sk-bd2c58cc05844168bcf96bc07c2e81da")
         logger.info(f"初始化ImageGenerator，API密钥: {self.api_key[:20]}...")
         if not self.api_key:
             raise ValueError("请设置环境变量 DASHSCOPE_API_KEY")
-    
-    def create_async_task(self, prompt, size="1024*1024", n=1):
-        """创建异步图片生成任务"""
-        logger.info(f"=== 开始创建异步任务 ===")
-        logger.info(f"提示词: {prompt}")
-        logger.info(f"尺寸: {size}")
-        logger.info(f"数量: {n}")
-        logger.info(f"API密钥: {self.api_key[:20]}...")
         
-        try:
-            logger.info("调用 ImageSynthesis.async_call")
-            rsp = ImageSynthesis.async_call(
-                api_key=self.api_key,
-                model="wanx2.1-t2i-turbo",
-                prompt=prompt,
-                n=n,
-                size=size
+        self.model = "wanx2.1-t2i-turbo"
+        
+        # 合并相同的并发生成请求
+        self.async_inflight = AsyncSingleFlight()
+        
+        # 生成结果缓存
+        self.result_cache = None
+        if RESULT_CACHE_ENABLED:
+            self.result_cache = ResultCache(
+                ttl_seconds=RESULT_CACHE_TTL,
+                max_memory_items=RESULT_CACHE_MEMORY_ITEMS,
+                db_path=RESULT_CACHE_DB or None
             )
-            
-            logger.info(f"API响应状态码: {rsp.status_code}")
-            logger.info(f"API响应完整内容: {rsp}")
-            
-            if hasattr(rsp, 'output'):
-                logger.info(f"响应输出: {rsp.output}")
-            if hasattr(rsp, 'message'):
-                logger.info(f"响应消息: {rsp.message}")
-            if hasattr(rsp, 'code'):
-                logger.info(f"响应代码: {rsp.code}")
-            
-            if rsp.status_code == HTTPStatus.OK:
-                task_id = rsp.output.task_id if hasattr(rsp.output, 'task_id') else None
-                task_status = rsp.output.task_status if hasattr(rsp.output, 'task_status') else None
-                
-                logger.info(f"任务创建成功 - 任务ID: {task_id}, 状态: {task_status}")
-                
-                return {
-                    "success": True,
-                    "task_id": task_id,
-                    "task_status": task_status,
-                    "task_object": rsp,  # 返回完整的响应对象
-                    "message": "任务创建成功"
-                }
-            else:
-                error_msg = f"创建任务失败: {rsp.message if hasattr(rsp, 'message') else '未知错误'}"
-                logger.error(error_msg)
-                return {
-                    "success": False,
-                    "error": error_msg,
-                    "status_code": rsp.status_code,
-                    "response_detail": str(rsp)
-                }
-        except Exception as e:
-            error_msg = f"创建任务异常: {str(e)}"
-            logger.error(error_msg)
-            logger.exception("详细异常信息:")
-            return {
-                "success": False,
-                "error": error_msg,
-                "exception_type": type(e).__name__
-            }
+            logger.info(f"生成结果缓存已启用，有效期: {RESULT_CACHE_TTL} 秒")
+        
+        # 异步生成流水线（唯一的生成路径），事件循环线程在首次生成时才创建；未安装 httpx 时抛出 ValueError
+        self.async_pipeline = AsyncGenerationPipeline(
+            api_key=self.api_key,
+            model=self.model,
+            save_image=self.save_image,
+            base_url=DASHSCOPE_BASE_URL,
+            max_connections=GENERATION_HTTP_CONNECTIONS,
+            download_timeout=IMAGE_DOWNLOAD_TIMEOUT,
+            download_task_timeout=IMAGE_DOWNLOAD_TASK_TIMEOUT,
+            task_timeout=GENERATION_TASK_TIMEOUT,
+            poll_interval=GENERATION_POLL_INTERVAL,
+            max_poll_interval=GENERATION_MAX_POLL_INTERVAL
+        )
+    
+    def save_image(self, url, content):
+        """保存图片到本地图片存储，之后读取不再访问上游，返回图片信息"""
+        image_id = image_store.put(content, 'image/png')
+        return {
+            "url": url,
+            "image_id": image_id,
+            "image_url": f"/api/images/{image_id}",
+            "size": len(content)
+        }
     
-    def wait_and_get_result(self, task_result):
-        """等待任务完成并获取结果"""
-        logger.info(f"=== 开始等待任务完成 ===")
+    def get_cached_result(self, prompt, size, n, response_format=IMAGE_RESPONSE_FORMAT):
+        """查询生成结果缓存，未启用、未命中或图片已被淘汰时返回 None"""
+        if not self.result_cache:
+            return None
         
-        try:
-            # 使用原始的task对象，而不是重新构造
-            task_object = task_result.get("task_object")
-            if not task_object:
-                logger.error("没有找到有效的task对象")
-                return {
-                    "success": False,
-                    "error": "没有找到有效的task对象"
-                }
-            
-            logger.info(f"使用task对象等待结果: {task_object}")
-            logger.info("调用 ImageSynthesis.wait")
-            logger.info(f"传递API密钥: {self.api_key[:20]}...")
-            
-            rsp = ImageSynthesis.wait(task_object, api_key=self.api_key)
-            
-            logger.info(f"等待结果响应状态码: {rsp.status_code}")
-            logger.info(f"等待结果响应完整内容: {rsp}")
-            
-            if rsp.status_code == HTTPStatus.OK:
-                logger.info("任务完成成功，开始处理结果")
-                images = []
-                
-                if hasattr(rsp.output, 'results'):
-                    logger.info(f"找到 {len(rsp.output.results)} 个结果")
-                    for i, result in enumerate(rsp.output.results):
-                        logger.info(f"处理第 {i+1} 个结果: {result.url}")
-                        
-                        # 下载图片数据
-                        try:
-                            img_response = requests.get(result.url, timeout=30)
-                            if img_response.status_code == 200:
-                                # 转换为base64
-                                img_base64 = base64.b64encode(img_response.content).decode('utf-8')
-                                images.append({
-                                    "url": result.url,
-                                    "base64": f"data:image/png;base64,{img_base64}"
-                                })
-                                logger.info(f"成功下载并转换图片 {i+1}")
-                            else:
-                                logger.error(f"下载图片失败: HTTP {img_response.status_code}")
-                        except Exception as download_error:
-                            logger.error(f"下载图片异常: {download_error}")
-                
-                task_status = rsp.output.task_status if hasattr(rsp.output, 'task_status') else 'UNKNOWN'
-                logger.info(f"最终任务状态: {task_status}")
-                
-                return {
-                    "success": True,
-                    "images": images,
-                    "task_status": task_status
-                }
-            else:
-                error_msg = f"获取结果失败: {rsp.message if hasattr(rsp, 'message') else '未知错误'}"
-                logger.error(error_msg)
-                return {
-                    "success": False,
-                    "error": error_msg,
-                    "status_code": rsp.status_code,
-                    "response_detail": str(rsp)
-                }
-        except Exception as e:
-            error_msg = f"获取结果异常: {str(e)}"
-            logger.error(error_msg)
-            logger.exception("详细异常信息:")
-            return {
-                "success": False,
-                "error": error_msg,
-                "exception_type": type(e).__name__
-            }
+        cache_key = make_cache_key(prompt, size, n, self.model)
+        cached = self.result_cache.get(cache_key)
+        if not cached:
+            return None
+        
+        images = []
+        for image in cached['images']:
+            image = dict(image)
+            if response_format == 'base64':
+                data_url = load_image_base64(image['image_id'])
+                if data_url is None:
+                    self.result_cache.delete(cache_key)
+                    return None
+                image['base64'] = data_url
+            elif image_store.get(image['image_id']) is None:
+                self.result_cache.delete(cache_key)
+                return None
+            images.append(image)
+        
+        logger.info(f"生成结果缓存命中: {cache_key[:16]}")
+        return {
+            "success": True,
+            "images": images,
+            "task_status": cached['task_status'],
+            "cached": True
+        }
+    
+    def cache_result(self, prompt, size, n, result):
+        """缓存完整的成功结果（只保存图片ID，不保存base64）"""
+        if not self.result_cache or not result.get('success'):
+            return
+        images = result.get('images', [])
+        if len(images) != n:
+            return
+        
+        cache_key = make_cache_key(prompt, size, n, self.model)
+        self.result_cache.set(cache_key, {
+            "images": [{k: v for k, v in image.items() if k != 'base64'} for image in images],
+            "task_status": result.get('task_status')
+        })
+    
+    def attach_base64(self, result):
+        """为结果中的图片补充base64数据（返回新字典，不修改共享结果）"""
+        images = []
+        for image in result.get('images', []):
+            image = dict(image)
+            if 'base64' not in image:
+                data_url = load_image_base64(image['image_id'])
+                if data_url is None:
+                    continue
+                image['base64'] = data_url
+            images.append(image)
+        return {**result, "images": images}
+    
+    def generate(self, prompt, size="1024*1024", n=1, response_format=IMAGE_RESPONSE_FORMAT, on_task_created=None):
+        """生成图片（同步等待）：在异步流水线中运行 generate_async 并阻塞等待结果"""
+        return self.async_pipeline.run_sync(
+            self.generate_async(prompt, size, n, response_format, on_task_created)
+        )
+    
+    def generate_future(self, prompt, size="1024*1024", n=1, response_format=IMAGE_RESPONSE_FORMAT, on_task_created=None):
+        """提交到异步流水线，立即返回 concurrent.futures.Future，等待上游期间不占用调用线程"""
+        return self.async_pipeline.submit(
+            self.generate_async(prompt, size, n, response_format, on_task_created)
+        )
+    
+    async def generate_async(self, prompt, size="1024*1024", n=1, response_format=IMAGE_RESPONSE_FORMAT, on_task_created=None):
+        """generate 的协程版本，在异步流水线的事件循环中运行"""
+        pipeline = self.async_pipeline
+        cached = await pipeline.to_thread(self.get_cached_result, prompt, size, n, response_format)
+        if cached:
+            return cached
+        
+        flight_key = make_cache_key(prompt, size, n, self.model)
+        result, shared = await self.async_inflight.do(
+            flight_key,
+            lambda: self._generate_uncached_async(prompt, size, n, on_task_created)
+        )
+        if shared:
+            logger.info(f"复用进行中的相同生成任务: {flight_key[:16]}")
+            result = {**result, "coalesced": True}
+        
+        if response_format == 'base64' and result.get('success'):
+            result = await pipeline.to_thread(self.attach_base64, result)
+        return result
+    
+    async def _generate_uncached_async(self, prompt, size, n, on_task_created=None):
+        """在异步流水线中创建上游任务并等待结果，结果只包含图片ID"""
+        result = await self.async_pipeline.generate(prompt, size, n, on_task_created)
+        await self.async_pipeline.to_thread(self.cache_result, prompt, size, n, result)
+        return result
     
     def fetch_task_status(self, task_id):
         """获取任务状态"""
@@ -510,6 +667,68 @@ except ValueError as e:
     logger.error(f"ImageGenerator 初始化失败: {e}")
     generator = None
 
+# 图片生成任务队列配置
+GENERATION_QUEUE_CONFIG = {
+    # 由一个调度线程提交到异步流水线，同时进行的上游生成任务数由 max_inflight 限制
+    'max_inflight': int(os.getenv('GENERATION_MAX_INFLIGHT', 200)),
+    'max_queue_size': int(os.getenv('GENERATION_QUEUE_SIZE', 100)),
+    'max_jobs_per_user': int(os.getenv('GENERATION_MAX_JOBS_PER_USER', 3)),
+    'job_ttl_seconds': int(os.getenv('GENERATION_JOB_TTL', 600))
+}
+
+# 全局图片生成任务队列
+generation_queue = GenerationJobQueue(generator, **GENERATION_QUEUE_CONFIG) if generator else None
+
+def is_generation_job_id(task_id):
+    """是否为生成队列的任务ID（32位十六进制），上游 DashScope 任务ID 为带连字符的 UUID"""
+    return len(task_id) == 32 and all(c in '0123456789abcdef' for c in task_id)
+
+def get_request_user_id():
+    """获取请求中的已登录用户ID（可选JWT），未登录时返回 None"""
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+        if identity:
+            return int(identity)
+    except Exception:
+        pass
+    return None
+
+def get_client_ip():
+    """获取客户端IP，开启 RATE_LIMIT_TRUST_PROXY 时使用反向代理传入的地址"""
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get('X-Real-IP') or request.headers.get('X-Forwarded-For', '').split(',')[0]
+        if forwarded.strip():
+            return forwarded.strip()
+    return request.remote_addr
+
+def get_request_user_key(user_id=None):
+    """获取用于公平调度的用户标识，已登录用户按ID，否则按客户端IP"""
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{get_client_ip()}"
+
+def check_rate_limit(action, email):
+    """按客户端IP、邮箱域名、全局三个维度检查认证接口限流，超限时返回 429 响应，否则返回 None"""
+    if rate_limiter is None:
+        return None
+    domain = email.rsplit('@', 1)[-1] if '@' in email else None
+    rejection = rate_limiter.check([
+        (f"{action}_ip", get_client_ip()),
+        (f"{action}_domain", domain),
+        (f"{action}_global", 'all')
+    ])
+    if rejection is None:
+        return None
+    logger.warning(f"请求被限流: {action}, 规则: {rejection.rule}, IP: {get_client_ip()}, 邮箱: {email}")
+    response = jsonify({
+        "success": False,
+        "message": "Too many requests, please try again later",
+        "retry_after": rejection.retry_after_seconds
+    })
+    response.headers['Retry-After'] = str(rejection.retry_after_seconds)
+    return response, 429
+
 # 用户认证API路由
 @app.route('/api/send-verification-code', methods=['POST'])
 def send_verification_code():
@@ -532,6 +751,11 @@ def send_verification_code():
                 "message": "Invalid email format"
             }), 400
         
+        # 限流检查在查库和发信之前，防止轮换邮箱地址耗尽发信配额
+        limited = check_rate_limit('send_code', email)
+        if limited:
+            return limited
+        
         # 检查邮箱是否已注册
         existing_user = user_db.get_user_by_email(email)
         if existing_user:
@@ -619,6 +843,10 @@ def register():
                 "message": "Invalid email format"
             }), 400
         
+        limited = check_rate_limit('register', email)
+        if limited:
+            return limited
+        
         # 密码长度检查
         if len(password) < 6:
             return jsonify({
@@ -680,6 +908,10 @@ def login():
         email = data.get('email').strip().lower()
         password = data.get('password')
         
+        limited = check_rate_limit('login', email)
+        if limited:
+            return limited
+        
         # 验证用户
         user = user_db.verify_user(email, password)
         
@@ -762,6 +994,8 @@ def use_trial():
         user_id = int(get_jwt_identity())  # 将字符串转换回整数
         data = request.get_json()
         demo_type = data.get('demo_type', 'image_generation') if data else 'image_generation'
+        if not isinstance(demo_type, str) or not demo_type or len(demo_type) > DEMO_TYPE_MAX_LENGTH:
+            raise ValueError(f"demo_type 必须是 1-{DEMO_TYPE_MAX_LENGTH} 个字符的字符串")
         
         result = user_db.use_trial(user_id, demo_type)
         
@@ -790,7 +1024,19 @@ def health_check():
     logger.info("收到健康检查请求")
     result = {
         "status": "healthy",
-        "api_key_configured": generator is not None
+        "api_key_configured": generator is not None,
+        "db_pool": user_db.get_pool_stats(),
+        "usage_recorder": user_db.usage_recorder.get_stats() if user_db.usage_recorder else None,
+        "user_cache": user_db.user_cache.get_stats(),
+        "verification_codes": email_service.code_expirer.get_stats(),
+        "email_queue": email_service.dispatch_queue.get_stats(),
+        "smtp_pool": email_service.smtp_pool.get_stats(),
+        "rate_limiter": rate_limiter.get_stats() if rate_limiter else None,
+        "generation_queue": generation_queue.get_stats() if generation_queue else None,
+        "image_store": image_store.get_stats(),
+        "result_cache": generator.result_cache.get_stats() if generator and generator.result_cache else None,
+        "async_inflight": generator.async_inflight.get_stats() if generator else None,
+        "generation_pipeline": generator.async_pipeline.get_stats() if generator else None
     }
     logger.info(f"健康检查响应: {result}")
     return jsonify(result)
@@ -851,19 +1097,36 @@ def generate_image():
         
         logger.info(f"转换后的参数 - 提示词: {prompt}, 比例: {ratio}, 尺寸: {size}, 数量: {count}")
         
-        # 创建异步任务
-        task_result = generator.create_async_task(prompt, size, count)
-        logger.info(f"任务创建结果: {task_result}")
+        # 图片返回格式，base64 仅供旧客户端显式选择
+        response_format = data.get('response_format', IMAGE_RESPONSE_FORMAT)
+        if response_format not in IMAGE_RESPONSE_FORMATS:
+            response_format = IMAGE_RESPONSE_FORMAT
         
-        if not task_result["success"]:
-            logger.error(f"任务创建失败: {task_result}")
-            return jsonify(task_result), 400
+        user_id = get_request_user_id()
         
-        # 等待任务完成并获取结果
-        result = generator.wait_and_get_result(task_result)
-        logger.info(f"最终结果: {result}")
+        # 结果缓存命中时直接返回，不占用队列与上游配额
+        cached = generator.get_cached_result(prompt, size, count, response_format)
+        if cached:
+            return jsonify(cached)
         
-        return jsonify(result)
+        # 提交到生成队列，立即返回任务ID，结果通过 /api/status/<job_id> 获取
+        try:
+            job = generation_queue.submit(get_request_user_key(user_id), prompt, size, count, response_format)
+        except QueueFullError as e:
+            logger.warning(f"生成队列拒绝请求: {e}")
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 429
+        
+        logger.info(f"生成任务已入队: {job['job_id']}, 排队位置: {job.get('queue_position')}")
+        
+        return jsonify({
+            "success": True,
+            "job_id": job['job_id'],
+            "status": job['status'],
+            "queue_position": job.get('queue_position', 0)
+        }), 202
         
     except Exception as e:
         error_msg = f"服务器内部错误: {str(e)}"
@@ -889,6 +1152,31 @@ def get_task_status(task_id):
         }), 500
     
     try:
+        # 优先查询本地生成队列中的任务
+        job = generation_queue.get_job(task_id)
+        if job:
+            result = {
+                "success": job['status'] != 'failed',
+                "job_id": job['job_id'],
+                "status": job['status'],
+                "task_id": job['task_id']
+            }
+            if job['status'] == 'queued':
+                result['queue_position'] = job['queue_position']
+            elif job['status'] == 'succeeded':
+                result.update(job['result'])
+            elif job['status'] == 'failed':
+                result['error'] = job['error']
+            return jsonify(result)
+        
+        # 队列任务ID（uuid4 hex）不在任务表中说明任务不存在或结果已过期，不能再交给上游查询
+        if is_generation_job_id(task_id):
+            return jsonify({
+                "success": False,
+                "error": "任务不存在或已过期",
+                "job_id": task_id
+            }), 404
+        
         result = generator.fetch_task_status(task_id)
         logger.info(f"状态查询结果: {result}")
         return jsonify(result)
@@ -902,6 +1190,40 @@ def get_task_status(task_id):
             "exception_type": type(e).__name__
         }), 500
 
+@app.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """读取生成的图片，支持 ETag 与 Range 请求"""
+    entry = image_store.get(image_id)
+    if entry is None:
+        return jsonify({
+            "success": False,
+            "error": "图片不存在或已过期"
+        }), 404
+    
+    as_attachment = bool(request.args.get('download'))
+    if entry['path']:
+        # 磁盘存储：由 send_file 处理 Range 与条件请求，生产服务器下走 sendfile
+        response = send_file(
+            entry['path'],
+            mimetype=entry['content_type'],
+            as_attachment=as_attachment,
+            download_name=f"{image_id[:16]}.png",
+            conditional=True,
+            etag=image_id
+        )
+    else:
+        response = Response(entry['data'], mimetype=entry['content_type'])
+        response.set_etag(image_id)
+        if as_attachment:
+            response.headers['Content-Disposition'] = f'attachment; filename="{image_id[:16]}.png"'
+        response = response.make_conditional(request, accept_ranges=True, complete_length=entry['size'])
+    
+    # 图片按内容寻址，ID即为强 ETag，内容永不变化
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/api/ratios', methods=['GET'])
 def get_supported_ratios():
     """获取支持的图片比例"""
@@ -954,8 +1276,9 @@ if __name__ == '__main__':
     logger.info("  GET  /api/user/info - 获取用户信息")
     logger.info("  GET  /api/user/check-trial - 检查试用状态")
     logger.info("  POST /api/user/use-trial - 使用试用次数")
-    logger.info("  POST /api/generate - 生成图片")
-    logger.info("  GET  /api/status/<task_id> - 获取任务状态")
+    logger.info("  POST /api/generate - 提交图片生成任务")
+    logger.info("  GET  /api/status/<task_id> - 获取任务状态与结果")
+    logger.info("  GET  /api/images/<image_id> - 读取生成的图片")
     logger.info("  GET  /api/ratios - 获取支持的比例")
     logger.info("  GET  /api/health - 健康检查")
     logger.info("日志文件: api_server.log")
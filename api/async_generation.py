@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+异步图片生成流水线模块
+在后台事件循环中以协程完成 创建任务 → 轮询状态 → 下载图片，所有请求共享一个异步 HTTP 客户端，
+等待上游时不占用线程；同步调用方通过 submit()/run_sync() 使用
+"""
+
+import time
+import atexit
+import asyncio
+import threading
+from functools import partial
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 上游任务的终止状态
+TERMINAL_STATUSES = ('SUCCEEDED', 'FAILED', 'CANCELED', 'UNKNOWN')
+
+
+class AsyncGenerationPipeline:
+    """DashScope 文生图异步流水线"""
+
+    def __init__(self, api_key, model, save_image,
+                 base_url='https://dashscope.aliyuncs.com/api/v1', max_connections=100,
+                 download_timeout=30, download_task_timeout=60, task_timeout=600,
+                 poll_interval=1.0, max_poll_interval=5.0):
+        try:
+            import httpx
+        except ImportError:
+            raise ValueError("使用异步生成流水线需要安装 httpx: pip install httpx")
+        self.httpx = httpx
+
+        self.api_key = api_key
+        self.model = model
+        self.save_image = save_image  # 保存图片的函数 save_image(url, content) -> 图片信息字典（在线程池中执行）
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections  # 共享 HTTP 客户端的最大连接数
+        self.download_timeout = download_timeout  # 单张图片下载时限（秒）
+        self.download_task_timeout = download_task_timeout  # 单个任务全部图片下载时限（秒）
+        self.task_timeout = task_timeout  # 等待上游任务完成的时限（秒）
+        self.poll_interval = poll_interval  # 首次轮询间隔（秒），之后逐步拉长
+        self.max_poll_interval = max_poll_interval  # 轮询间隔上限（秒）
+
+        self.loop = None
+        self.thread = None
+        self.client = None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+        # 指标
+        self.stats = {
+            'started': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'polls': 0,
+            'downloads': 0,
+            'download_failures': 0
+        }
+
+        atexit.register(self.stop)
+
+    def start(self):
+        """启动事件循环线程（首次提交时自动调用，避免在 fork 前创建线程）"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='generation-loop', daemon=True)
+            thread.start()
+            # HTTP 客户端创建完成后才公开事件循环，submit() 看到 thread 时 client 一定可用
+            try:
+                asyncio.run_coroutine_threadsafe(self._open_client(), loop).result()
+            except Exception:
+                # 创建失败时停止已启动的事件循环线程，避免泄漏；下次提交会重新尝试启动
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+                raise
+            self.loop = loop
+            self.thread = thread
+        logger.info(f"异步生成流水线已启动，最大连接数: {self.max_connections}")
+
+    async def _open_client(self):
+        limits = self.httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections
+        )
+        self.client = self.httpx.AsyncClient(limits=limits, timeout=self.download_timeout)
+
+    def stop(self, timeout=10):
+        """关闭 HTTP 客户端并停止事件循环"""
+        with self.lock:
+            loop, thread = self.loop, self.thread
+            self.loop = None
+            self.thread = None
+        if loop is None:
+            return
+        if self.client is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self.client.aclose(), loop).result(timeout)
+            except Exception as e:
+                logger.warning(f"关闭异步 HTTP 客户端失败: {e}")
+            self.client = None
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+    def submit(self, coro):
+        """在事件循环中运行协程，返回 concurrent.futures.Future（可在任意线程等待或添加回调）"""
+        if self.thread is None:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_sync(self, coro, timeout=None):
+        """在事件循环中运行协程并阻塞等待结果"""
+        return self.submit(coro).result(timeout)
+
+    async def to_thread(self, fn, *args, **kwargs):
+        """在线程池中执行阻塞函数（磁盘读写、SQLite 等），不阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, **kwargs))
+
+    def _headers(self, async_task=False):
+        headers = {
+            'Authorization': f"Bearer {self.api_key}",
+            'Content-Type': 'application/json'
+        }
+        if async_task:
+            headers['X-DashScope-Async'] = 'enable'
+        return headers
+
+    @staticmethod
+    def _error_message(response):
+        try:
+            data = response.json()
+            return f"{data.get('code', '')} {data.get('message', '')}".strip() or f"HTTP {response.status_code}"
+        except ValueError:
+            return f"HTTP {response.status_code}"
+
+    async def create_task(self, prompt, size="1024*1024", n=1):
+        """创建上游生成任务，返回 {success, task_id, task_status} 或 {success: False, error, status_code}"""
+        response = await self.client.post(
+            f"{self.base_url}/services/aigc/text2image/image-synthesis",
+            headers=self._headers(async_task=True),
+            json={
+                'model': self.model,
+                'input': {'prompt': prompt},
+                'parameters': {'size': size, 'n': n}
+            }
+        )
+        if response.status_code != 200:
+            error_msg = f"创建任务失败: {self._error_message(response)}"
+            logger.error(error_msg)
+            return {"success": False, "error": error_msg, "status_code": response.status_code}
+
+        output = response.json().get('output', {})
+        logger.info(f"任务创建成功 - 任务ID: {output.get('task_id')}, 状态: {output.get('task_status')}")
+        return {
+            "success": True,
+            "task_id": output.get('task_id'),
+            "task_status": output.get('task_status'),
+            "message": "任务创建成功"
+        }
+
+    async def wait_task(self, task_id):
+        """轮询任务直到终止状态，轮询间隔逐步拉长，返回任务 output"""
+        deadline = time.monotonic() + self.task_timeout
+        interval = self.poll_interval
+        while True:
+            response = await self.client.get(f"{self.base_url}/tasks/{task_id}", headers=self._headers())
+            self.stats['polls'] += 1
+            if response.status_code != 200:
+                raise ValueError(f"查询任务状态失败: {self._error_message(response)}")
+            output = response.json().get('output', {})
+            if output.get('task_status') in TERMINAL_STATUSES:
+                return output
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"等待任务完成超时（{self.task_timeout} 秒）: {task_id}")
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(self.max_poll_interval, interval * 1.5)
+
+    async def download_image(self, url):
+        """下载单张图片"""
+        async with self.client.stream('GET', url, timeout=self.download_timeout) as response:
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            chunks = []
+            async for chunk in response.aiter_bytes(64 * 1024):
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+    async def download_images(self, urls):
+        """并发下载同一任务的全部图片，按原顺序返回，失败项为 None"""
+        tasks = [asyncio.ensure_future(self.download_image(url)) for url in urls]
+        done, pending = await asyncio.wait(tasks, timeout=self.download_task_timeout)
+        for task in pending:
+            task.cancel()
+
+        contents = []
+        for i, task in enumerate(tasks):
+            self.stats['downloads'] += 1
+            if task in pending:
+                logger.error(f"下载图片 {i+1} 超过任务截止时间")
+                self.stats['download_failures'] += 1
+                contents.append(None)
+            elif task.exception() is not None:
+                logger.error(f"下载图片 {i+1} 失败: {task.exception()}")
+                self.stats['download_failures'] += 1
+                contents.append(None)
+            else:
+                contents.append(task.result())
+        return contents
+
+    async def generate(self, prompt, size="1024*1024", n=1, on_task_created=None):
+        """创建任务、等待完成并下载保存图片，返回 {success, images, task_status}，图片只包含图片ID"""
+        self.in_flight += 1
+        self.stats['started'] += 1
+        try:
+            task_result = await self.create_task(prompt, size, n)
+            if not task_result['success']:
+                self.stats['failed'] += 1
+                return task_result
+            task_id = task_result['task_id']
+            if on_task_created:
+                on_task_created(task_id)
+
+            output = await self.wait_task(task_id)
+            task_status = output.get('task_status', 'UNKNOWN')
+            if task_status != 'SUCCEEDED':
+                self.stats['failed'] += 1
+                error_msg = f"生成任务失败: {output.get('code', '')} {output.get('message', task_status)}".strip()
+                logger.error(f"{error_msg}, 任务ID: {task_id}")
+                return {"success": False, "error": error_msg, "task_status": task_status}
+
+            urls = [item['url'] for item in output.get('results', []) if item.get('url')]
+            contents = await self.download_images(urls)
+            images = []
+            for url, content in zip(urls, contents):
+                if content is not None:
+                    images.append(await self.to_thread(self.save_image, url, content))
+
+            self.stats['succeeded'] += 1
+            return {"success": True, "images": images, "task_status": task_status}
+        except Exception as e:
+            self.stats['failed'] += 1
+            error_msg = f"生成任务异常: {str(e)}"
+            logger.error(error_msg)
+            return {"success": False, "error": error_msg, "exception_type": type(e).__name__}
+        finally:
+            self.in_flight -= 1
+
+    def get_stats(self):
+        """获取流水线指标"""
+        return {
+            'running': self.thread is not None,
+            'in_flight': self.in_flight,
+            'max_connections': self.max_connections,
+            **self.stats
+        }
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+性能基准命令行工具
+用于对比热点路径在不同配置下的吞吐
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import threading
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from code_store import MemoryCodeStore
+from email_templates import VerificationEmailTemplate, SMTP_POLICY
+
+
+def run_threads(thread_count, target):
+    """启动 thread_count 个线程同时执行 target(index)，返回耗时（秒）"""
+    barrier = threading.Barrier(thread_count + 1)
+
+    def worker(index):
+        barrier.wait()
+        target(index)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def measure_code_store(shards, thread_count, emails, rounds):
+    """运行一次验证码存储负载，返回每秒校验次数"""
+    store = MemoryCodeStore(shards=shards)
+
+    def workload(index):
+        addresses = [f"user{index}-{i}@example.com" for i in range(emails)]
+        for _ in range(rounds):
+            for email in addresses:
+                store.put_code(email, '123456', 600, 0)
+                store.verify(email, '000000', 5)
+                store.verify(email, '123456', 5)
+
+    elapsed = run_threads(thread_count, workload)
+    return thread_count * emails * rounds * 2 / elapsed
+
+
+def bench_code_store(args):
+    """验证码存储校验吞吐：单锁（1 个分片）与分片锁对比，每组重复 repeat 次取中位数"""
+    thread_counts = [int(t) for t in args.threads.split(',')]
+    print(f"每线程 {args.emails} 个邮箱，每个邮箱 {args.rounds} 轮（保存 + 错误校验 + 正确校验），"
+          f"重复 {args.repeat} 次取中位数")
+    print(f"{'分片数':>6} {'线程数':>6} {'校验/秒':>12} {'相对单线程':>10} {'相对单锁':>8}")
+
+    single_lock = {}
+    for shards in (1, args.shards):
+        baseline = None
+        for thread_count in thread_counts:
+            rate = statistics.median(
+                measure_code_store(shards, thread_count, args.emails, args.rounds)
+                for _ in range(args.repeat)
+            )
+            baseline = baseline or rate
+            single_lock.setdefault(thread_count, rate)
+            print(f"{shards:>9} {thread_count:>9} {rate:>14.0f} {rate / baseline:>14.2f}x "
+                  f"{rate / single_lock[thread_count]:>11.2f}x")
+
+
+def bench_email_build(args):
+    """单封验证邮件构建耗时：每次构建 MIME 对象树与预编译模板拼接对比"""
+    template = VerificationEmailTemplate(
+        sender='Joyful System <system@joyful.cloud>',
+        subject='Joyful Registration Service - Verification Code',
+        expiry_minutes=10
+    )
+    codes = [f"{i:06d}" for i in range(args.messages)]
+    builders = [
+        ('MIMEMultipart', lambda code: template.build_mime('user@example.com', code).as_bytes(policy=SMTP_POLICY)),
+        ('预编译模板', lambda code: template.build_message('user@example.com', code))
+    ]
+    print(f"构建 {args.messages} 封邮件")
+    print(f"{'方式':<14} {'微秒/封':>10} {'封/秒':>10}")
+    for name, build in builders:
+        start = time.perf_counter()
+        for code in codes:
+            build(code)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<16} {elapsed * 1e6 / args.messages:>10.1f} {args.messages / elapsed:>12.0f}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='性能基准工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    code_store_parser = subparsers.add_parser('code-store', help='验证码存储并发校验吞吐')
+    code_store_parser.add_argument('--threads', default='1,2,4,8', help='逗号分隔的线程数')
+    code_store_parser.add_argument('--shards', type=int, default=16, help='分片锁的分片数')
+    code_store_parser.add_argument('--emails', type=int, default=200, help='每个线程使用的邮箱数')
+    code_store_parser.add_argument('--rounds', type=int, default=50, help='每个邮箱的校验轮数')
+    code_store_parser.add_argument('--repeat', type=int, default=5, help='每组重复次数（取中位数）')
+    code_store_parser.set_defaults(func=bench_code_store)
+
+    email_parser = subparsers.add_parser('email-build', help='验证邮件单封构建耗时')
+    email_parser.add_argument('--messages', type=int, default=5000, help='构建的邮件数')
+    email_parser.set_defaults(func=bench_email_build)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+验证码存储模块
+提供可替换的验证码存储后端：进程内存、SQLite/MySQL、Redis
+发送频率限制与尝试次数在存储内原子更新，多个工作进程可共享同一存储
+"""
+
+import time
+import heapq
+import sqlite3
+import threading
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# verify() 返回的状态
+VERIFY_OK = 'ok'
+VERIFY_NOT_FOUND = 'not_found'
+VERIFY_EXPIRED = 'expired'
+VERIFY_TOO_MANY_ATTEMPTS = 'too_many_attempts'
+VERIFY_INVALID = 'invalid'
+
+
+class MemoryCodeShard:
+    """内存验证码存储的一个分片，拥有独立的锁与过期堆"""
+
+    def __init__(self):
+        # {email: {code, expires_at, attempts, last_send_time}}，时间为 time.time() 时间戳
+        self.codes = {}
+        # 过期时间最小堆 [(expires_at, email)]；记录被替换或删除后旧项留在堆中，弹出时比对跳过
+        self.expiry_heap = []
+        self.lock = threading.Lock()
+
+    def put_code(self, email, code, expiry_seconds, send_interval_seconds):
+        """发送间隔已过时保存新验证码，返回 (是否保存, 需等待秒数)"""
+        now = time.time()
+        with self.lock:
+            info = self.codes.get(email)
+            if info and now < info['expires_at']:
+                elapsed = now - info['last_send_time']
+                if elapsed < send_interval_seconds:
+                    return False, send_interval_seconds - int(elapsed)
+            self.codes[email] = {
+                'code': code,
+                'expires_at': now + expiry_seconds,
+                'attempts': 0,
+                'last_send_time': now
+            }
+            heapq.heappush(self.expiry_heap, (now + expiry_seconds, email))
+            return True, 0
+
+    def get(self, email):
+        """获取未过期的验证码信息"""
+        now = time.time()
+        with self.lock:
+            info = self.codes.get(email)
+            if info is None:
+                return None
+            if now > info['expires_at']:
+                del self.codes[email]
+                return None
+            return dict(info)
+
+    def verify(self, email, input_code, max_attempts):
+        """校验验证码，返回 (状态, 剩余尝试次数)"""
+        now = time.time()
+        with self.lock:
+            info = self.codes.get(email)
+            if info is None:
+                return VERIFY_NOT_FOUND, 0
+            if now > info['expires_at']:
+                del self.codes[email]
+                return VERIFY_EXPIRED, 0
+            if info['attempts'] >= max_attempts:
+                del self.codes[email]
+                return VERIFY_TOO_MANY_ATTEMPTS, 0
+            if input_code == info['code']:
+                del self.codes[email]
+                return VERIFY_OK, max_attempts - info['attempts']
+            info['attempts'] += 1
+            return VERIFY_INVALID, max_attempts - info['attempts']
+
+    def delete(self, email, code=None):
+        """删除验证码，指定 code 时仅在验证码一致时删除"""
+        with self.lock:
+            info = self.codes.get(email)
+            if info and (code is None or info['code'] == code):
+                del self.codes[email]
+
+    def expire_batch(self, limit=100, max_pops=None):
+        """删除最多 limit 条已过期的验证码，每次弹出 O(log n)，返回删除数量
+
+        已被替换或删除的旧堆项不计入 limit；单次最多弹出 max_pops 项（默认 limit 的 4 倍），限制持锁时间。
+        """
+        if max_pops is None:
+            max_pops = limit * 4
+        now = time.time()
+        removed = 0
+        with self.lock:
+            for _ in range(max_pops):
+                if removed >= limit or not self.expiry_heap or self.expiry_heap[0][0] > now:
+                    break
+                expires_at, email = heapq.heappop(self.expiry_heap)
+                info = self.codes.get(email)
+                # 只删除与堆项对应的记录，已重新发送的验证码不受影响
+                if info is not None and info['expires_at'] == expires_at:
+                    del self.codes[email]
+                    removed += 1
+        return removed
+
+    def has_expired(self):
+        """过期堆中是否还有已到期的项"""
+        with self.lock:
+            return bool(self.expiry_heap) and self.expiry_heap[0][0] <= time.time()
+
+    def size(self):
+        with self.lock:
+            return len(self.codes)
+
+
+class MemoryCodeStore:
+    """进程内存验证码存储（单进程部署使用）
+
+    按邮箱哈希划分为多个分片，每个分片一把锁，不同邮箱的操作互不阻塞。
+    """
+
+    def __init__(self, shards=16):
+        self.shards = [MemoryCodeShard() for _ in range(shards)]
+        # 过期清理从上次停下的分片继续，避免总是优先清理前面的分片
+        self.next_shard = 0
+
+    def _shard(self, email):
+        return self.shards[hash(email) % len(self.shards)]
+
+    def put_code(self, email, code, expiry_seconds, send_interval_seconds):
+        """发送间隔已过时保存新验证码，返回 (是否保存, 需等待秒数)"""
+        return self._shard(email).put_code(email, code, expiry_seconds, send_interval_seconds)
+
+    def get(self, email):
+        """获取未过期的验证码信息"""
+        return self._shard(email).get(email)
+
+    def verify(self, email, input_code, max_attempts):
+        """校验验证码，返回 (状态, 剩余尝试次数)"""
+        return self._shard(email).verify(email, input_code, max_attempts)
+
+    def delete(self, email, code=None):
+        """删除验证码，指定 code 时仅在验证码一致时删除"""
+        self._shard(email).delete(email, code)
+
+    def expire_batch(self, limit=100):
+        """依次在各分片内清理，总共最多删除 limit 条，每次只持有一个分片的锁"""
+        removed = 0
+        count = len(self.shards)
+        start = self.next_shard
+        for offset in range(count):
+            if removed >= limit:
+                break
+            index = (start + offset) % count
+            removed += self.shards[index].expire_batch(limit - removed)
+            self.next_shard = (index + 1) % count
+        return removed
+
+    def cleanup_expired(self, batch_size=100):
+        """分批清理全部过期验证码，返回清理数量"""
+        total = 0
+        for shard in self.shards:
+            while True:
+                total += shard.expire_batch(batch_size)
+                if not shard.has_expired():
+                    break
+        return total
+
+    def size(self):
+        return sum(shard.size() for shard in self.shards)
+
+
+class SQLCodeStore:
+    """SQL验证码存储基类，子类实现 transaction() 上下文管理器（产出游标，正常退出提交、异常回滚）"""
+
+    placeholder = '?'
+    lock_clause = ''
+    expire_batch_sql = (
+        'DELETE FROM verification_codes WHERE email IN '
+        '(SELECT email FROM verification_codes WHERE expires_at < ? ORDER BY expires_at LIMIT ?)'
+    )
+
+    def _q(self, sql):
+        return sql.replace('?', self.placeholder)
+
+    def _select(self, cursor, email, for_update=False):
+        cursor.execute(self._q(
+            'SELECT code, expires_at, attempts, last_send_time FROM verification_codes WHERE email = ?'
+            + (self.lock_clause if for_update else '')
+        ), (email,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {'code': row[0], 'expires_at': row[1], 'attempts': row[2], 'last_send_time': row[3]}
+
+    def _delete(self, cursor, email):
+        cursor.execute(self._q('DELETE FROM verification_codes WHERE email = ?'), (email,))
+
+    def put_code(self, email, code, expiry_seconds, send_interval_seconds):
+        now = time.time()
+        with self.transaction() as cursor:
+            info = self._select(cursor, email, for_update=True)
+            if info and now < info['expires_at']:
+                elapsed = now - info['last_send_time']
+                if elapsed < send_interval_seconds:
+                    return False, send_interval_seconds - int(elapsed)
+            if info:
+                self._delete(cursor, email)
+            cursor.execute(self._q(
+                'INSERT INTO verification_codes (email, code, expires_at, attempts, last_send_time) VALUES (?, ?, ?, 0, ?)'
+            ), (email, code, now + expiry_seconds, now))
+            return True, 0
+
+    def get(self, email):
+        with self.transaction() as cursor:
+            info = self._select(cursor, email)
+        if info is None or time.time() > info['expires_at']:
+            return None
+        return info
+
+    def verify(self, email, input_code, max_attempts):
+        now = time.time()
+        with self.transaction() as cursor:
+            info = self._select(cursor, email, for_update=True)
+            if info is None:
+                return VERIFY_NOT_FOUND, 0
+            if now > info['expires_at']:
+                self._delete(cursor, email)
+                return VERIFY_EXPIRED, 0
+            if info['attempts'] >= max_attempts:
+                self._delete(cursor, email)
+                return VERIFY_TOO_MANY_ATTEMPTS, 0
+            if input_code == info['code']:
+                self._delete(cursor, email)
+                return VERIFY_OK, max_attempts - info['attempts']
+            cursor.execute(self._q(
+                'UPDATE verification_codes SET attempts = attempts + 1 WHERE email = ?'
+            ), (email,))
+            return VERIFY_INVALID, max_attempts - info['attempts'] - 1
+
+    def delete(self, email, code=None):
+        with self.transaction() as cursor:
+            if code is None:
+                self._delete(cursor, email)
+            else:
+                cursor.execute(self._q(
+                    'DELETE FROM verification_codes WHERE email = ? AND code = ?'
+                ), (email, code))
+
+    def expire_batch(self, limit=100):
+        """删除最多 limit 条过期验证码（走 expires_at 索引），返回删除数量"""
+        with self.transaction() as cursor:
+            cursor.execute(self._q(self.expire_batch_sql), (time.time(), limit))
+            return cursor.rowcount
+
+    def cleanup_expired(self, batch_size=100):
+        total = 0
+        while True:
+            removed = self.expire_batch(batch_size)
+            total += removed
+            if removed < batch_size:
+                return total
+
+    def size(self):
+        with self.transaction() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM verification_codes')
+            return cursor.fetchone()[0]
+
+
+class SQLiteCodeStore(SQLCodeStore):
+    """SQLite验证码存储，同一主机上的多个工作进程共享"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS verification_codes (
+                    email TEXT PRIMARY KEY,
+                    code TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_send_time REAL NOT NULL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_expires_at ON verification_codes (expires_at)')
+
+    def _get_db(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # isolation_level=None 由我们显式控制事务
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._get_db()
+        cursor = conn.cursor()
+        # BEGIN IMMEDIATE 立即获取写锁，保证读-改-写原子
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+            cursor.execute('COMMIT')
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            cursor.close()
+
+
+class MySQLCodeStore(SQLCodeStore):
+    """MySQL验证码存储，表结构由迁移 004_add_verification_codes 创建"""
+
+    placeholder = '%s'
+    lock_clause = ' FOR UPDATE'
+    expire_batch_sql = 'DELETE FROM verification_codes WHERE expires_at < ? ORDER BY expires_at LIMIT ?'
+
+    # 单条语句完成"不存在则插入、发送间隔已过或已过期则替换"，不对不存在的行加间隙锁，
+    # 避免同一邮箱首次并发发送时 SELECT ... FOR UPDATE + INSERT 互相死锁。
+    # ON DUPLICATE KEY UPDATE 按书写顺序赋值：前三列的保留条件只引用 expires_at 与 last_send_time 的旧值；
+    # expires_at 最后赋值，此时 last_send_time 等于本次时间即表示整行被替换。
+    # 参数：email, code, expires_at, now，以及三次 send_interval_seconds
+    PUT_CODE_KEEP = 'expires_at > VALUES(last_send_time) AND VALUES(last_send_time) - last_send_time < %s'
+    PUT_CODE_SQL = f'''
+        INSERT INTO verification_codes (email, code, expires_at, attempts, last_send_time)
+        VALUES (%s, %s, %s, 0, %s)
+        ON DUPLICATE KEY UPDATE
+            code = IF({PUT_CODE_KEEP}, code, VALUES(code)),
+            attempts = IF({PUT_CODE_KEEP}, attempts, 0),
+            last_send_time = IF({PUT_CODE_KEEP}, last_send_time, VALUES(last_send_time)),
+            expires_at = IF(last_send_time = VALUES(last_send_time), VALUES(expires_at), expires_at)
+    '''
+
+    def __init__(self, get_connection):
+        self.get_connection = get_connection  # 返回数据库连接的函数（连接 close() 时归还连接池）
+
+    def put_code(self, email, code, expiry_seconds, send_interval_seconds):
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute(self.PUT_CODE_SQL, (email, code, now + expiry_seconds, now) + (send_interval_seconds,) * 3)
+            # 行锁由上一条语句持有，读取结果判断是否写入了本次验证码
+            cursor.execute('SELECT last_send_time FROM verification_codes WHERE email = %s', (email,))
+            last_send_time = cursor.fetchone()[0]
+        if last_send_time == now:
+            return True, 0
+        return False, send_interval_seconds - int(now - last_send_time)
+
+    @contextmanager
+    def transaction(self):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+
+class RedisCodeStore:
+    """Redis验证码存储，依靠键的TTL自动过期，读-改-写通过 Lua 脚本原子执行"""
+
+    # KEYS: 验证码键, 发送间隔键；ARGV: code, 有效期毫秒, 发送间隔毫秒, 当前时间戳
+    PUT_SCRIPT = """
+        if redis.call('SET', KEYS[2], '1', 'PX', ARGV[3], 'NX') then
+            redis.call('DEL', KEYS[1])
+            redis.call('HSET', KEYS[1], 'code', ARGV[1], 'attempts', 0,
+                       'expires_at', ARGV[4] + ARGV[2] / 1000, 'last_send_time', ARGV[4])
+            redis.call('PEXPIRE', KEYS[1], ARGV[2])
+            return -1
+        end
+        return redis.call('PTTL', KEYS[2])
+    """
+
+    # KEYS: 验证码键, 发送间隔键；ARGV: 输入的验证码, 最大尝试次数
+    VERIFY_SCRIPT = """
+        local info = redis.call('HMGET', KEYS[1], 'code', 'attempts')
+        if not info[1] then
+            return {'not_found', 0}
+        end
+        local attempts = tonumber(info[2])
+        local max_attempts = tonumber(ARGV[2])
+        if attempts >= max_attempts then
+            redis.call('DEL', KEYS[1])
+            return {'too_many_attempts', 0}
+        end
+        if info[1] == ARGV[1] then
+            redis.call('DEL', KEYS[1], KEYS[2])
+            return {'ok', max_attempts - attempts}
+        end
+        attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+        return {'invalid', max_attempts - attempts}
+    """
+
+    # KEYS: 验证码键；ARGV: code
+    DELETE_IF_SCRIPT = """
+        if redis.call('HGET', KEYS[1], 'code') == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, redis_url, key_prefix='joyful:verify:'):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError("使用 Redis 验证码存储需要安装 redis: pip install redis")
+        self.client = redis.Redis.from_url(redis_url, decode_responses=True)
+        self.key_prefix = key_prefix
+        self.put_script = self.client.register_script(self.PUT_SCRIPT)
+        self.verify_script = self.client.register_script(self.VERIFY_SCRIPT)
+        self.delete_if_script = self.client.register_script(self.DELETE_IF_SCRIPT)
+
+    def _keys(self, email):
+        return [f"{self.key_prefix}code:{email}", f"{self.key_prefix}sent:{email}"]
+
+    def put_code(self, email, code, expiry_seconds, send_interval_seconds):
+        remaining_ms = self.put_script(
+            keys=self._keys(email),
+            args=[code, int(expiry_seconds * 1000), int(send_interval_seconds * 1000), time.time()]
+        )
+        if remaining_ms == -1:
+            return True, 0
+        return False, max(1, int(remaining_ms) // 1000)
+
+    def get(self, email):
+        info = self.client.hgetall(self._keys(email)[0])
+        if not info:
+            return None
+        return {
+            'code': info['code'],
+            'expires_at': float(info['expires_at']),
+            'attempts': int(info['attempts']),
+            'last_send_time': float(info['last_send_time'])
+        }
+
+    def verify(self, email, input_code, max_attempts):
+        # 已过期的键由 Redis 自动删除，表现为 not_found
+        status, remaining = self.verify_script(keys=self._keys(email), args=[input_code, max_attempts])
+        return status, int(remaining)
+
+    def delete(self, email, code=None):
+        if code is None:
+            self.client.delete(*self._keys(email))
+        elif self.delete_if_script(keys=self._keys(email)[:1], args=[code]):
+            # 与内存存储一致：验证码被删除后允许立即重新发送
+            self.client.delete(self._keys(email)[1])
+
+    def expire_batch(self, limit=100):
+        # 过期由 Redis TTL 处理
+        return 0
+
+    def cleanup_expired(self, batch_size=100):
+        return 0
+
+    def size(self):
+        return None
+
+
+class CodeExpirer:
+    """后台过期清理线程：小批量地从存储中删除过期验证码，每批只短暂持有锁"""
+
+    def __init__(self, store, interval_seconds=5.0, batch_size=100):
+        self.store = store
+        self.interval_seconds = interval_seconds  # 没有待清理项时的检查间隔（秒）
+        self.batch_size = batch_size  # 每批最多删除的条数
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.expired_total = 0
+        self.runs = 0
+
+    def start(self):
+        """启动清理线程（重复调用无副作用，并发的首次调用只会启动一个线程）"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name='code-expirer', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+            self.stop_event.set()
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                removed = self.store.expire_batch(self.batch_size)
+            except Exception as e:
+                logger.warning(f"清理过期验证码失败: {e}")
+                removed = 0
+            self.expired_total += removed
+            self.runs += 1
+            if removed >= self.batch_size:
+                # 还有积压，短暂让出后继续下一批
+                self.stop_event.wait(0.01)
+            else:
+                self.stop_event.wait(self.interval_seconds)
+
+    def get_stats(self):
+        """获取清理指标与当前存储大小"""
+        try:
+            size = self.store.size()
+        except Exception:
+            size = None
+        return {
+            'store': type(self.store).__name__,
+            'size': size,
+            'expired_total': self.expired_total,
+            'runs': self.runs,
+            'running': self.thread is not None
+        }
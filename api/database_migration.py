@@ -5,21 +5,40 @@
 """
 
 import os
+import re
 import json
+import time
+import hashlib
+import tempfile
 import mysql.connector
 from mysql.connector import Error
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+# DDL 语句（MySQL 中会隐式提交，不能与断点在同一事务中提交）
+DDL_STATEMENT = re.compile(r'\s*(CREATE|ALTER|DROP|RENAME|TRUNCATE)\b', re.IGNORECASE)
+# 重新执行已生效的 DDL 时的错误码：表已存在、表不存在、列重复、索引重复、删除的列或索引不存在
+DDL_ALREADY_APPLIED_ERRORS = (1050, 1051, 1060, 1061, 1091)
+
 class DatabaseMigration:
     """数据库迁移管理器"""
     
     def __init__(self, mysql_config):
         self.mysql_config = mysql_config
         self.migrations_table = 'schema_migrations'
+        # 记录最近一次完整迁移后的迁移目录校验和，启动时一次查询即可判断是否需要迁移
+        self.head_table = 'schema_migrations_head'
+        # 多个副本同时启动时只有一个进程执行迁移，其余进程等待该锁；
+        # 持锁进程的迁移进度（断点）超过该时间（秒）没有变化时才放弃等待
+        self.lock_timeout = int(os.getenv('MIGRATION_LOCK_TIMEOUT', 300))
+        self.lock_poll_seconds = 10
         self.migrations_dir = os.path.join(os.path.dirname(__file__), 'migrations')
+        # 编译后的迁移清单：各文件的版本、校验和与解析后的SQL，文件修改时间或大小变化时才重建
+        self.manifest_path = os.path.join(self.migrations_dir, '.manifest')
+        self._manifest = None
         
         # 确保migrations目录存在
         os.makedirs(self.migrations_dir, exist_ok=True)
@@ -42,6 +61,18 @@ class DatabaseMigration:
                 logger.error(f"数据库连接失败: {e}")
                 raise e
     
+    @contextmanager
+    def connection(self, conn=None):
+        """使用调用方传入的连接；未传入时打开新连接并在结束时关闭"""
+        if conn is not None:
+            yield conn
+            return
+        conn = self.get_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
     def create_database(self):
         """创建数据库"""
         try:
@@ -69,26 +100,39 @@ class DatabaseMigration:
             logger.error(f"创建数据库失败: {e}")
             raise e
     
-    def init_migrations_table(self):
+    def init_migrations_table(self, conn=None):
         """初始化迁移记录表"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # 创建迁移记录表
-            cursor.execute(f"""
-                CREATE TABLE IF NOT EXISTS {self.migrations_table} (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    version VARCHAR(50) UNIQUE NOT NULL,
-                    migration_name VARCHAR(255) NOT NULL,
-                    executed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_version (version)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with self.connection(conn) as conn:
+                cursor = conn.cursor()
+                
+                # 创建迁移记录表
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.migrations_table} (
+                        id INT AUTO_INCREMENT PRIMARY KEY,
+                        version VARCHAR(50) UNIQUE NOT NULL,
+                        migration_name VARCHAR(255) NOT NULL,
+                        executed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        status VARCHAR(20) NOT NULL DEFAULT 'completed',
+                        checkpoint TEXT NULL,
+                        INDEX idx_version (version)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                # 旧版本创建的迁移表没有断点列，补充 status / checkpoint 列
+                cursor.execute("""
+                    SELECT COUNT(*) FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'checkpoint'
+                """, (self.migrations_table,))
+                if cursor.fetchone()[0] == 0:
+                    cursor.execute(f"""
+                        ALTER TABLE {self.migrations_table}
+                        ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'completed',
+                        ADD COLUMN checkpoint TEXT NULL
+                    """)
+                
+                conn.commit()
+                cursor.close()
             
             logger.info("迁移记录表初始化成功")
             
@@ -96,17 +140,24 @@ class DatabaseMigration:
             logger.error(f"初始化迁移记录表失败: {e}")
             raise e
     
-    def get_executed_migrations(self):
+    def get_executed_migrations(self, conn=None):
         """获取已执行的迁移版本"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(f"SELECT version FROM {self.migrations_table} ORDER BY version")
-            executed = [row[0] for row in cursor.fetchall()]
-            
-            cursor.close()
-            conn.close()
+            with self.connection(conn) as conn:
+                cursor = conn.cursor()
+                
+                try:
+                    cursor.execute(
+                        f"SELECT version FROM {self.migrations_table} WHERE status = 'completed' ORDER BY version"
+                    )
+                except mysql.connector.Error as e:
+                    if "Unknown column" not in str(e):
+                        raise
+                    # 迁移表尚未补充 status 列，其中的记录都是已完成的迁移
+                    cursor.execute(f"SELECT version FROM {self.migrations_table} ORDER BY version")
+                executed = [row[0] for row in cursor.fetchall()]
+                
+                cursor.close()
             
             return executed
             
@@ -116,20 +167,42 @@ class DatabaseMigration:
                 return []
             raise e
     
-    def record_migration(self, version, migration_name):
-        """记录已执行的迁移"""
-        try:
-            conn = self.get_connection()
+    def get_checkpoint(self, version, conn=None):
+        """读取未完成迁移的断点，没有断点时返回 None"""
+        with self.connection(conn) as conn:
             cursor = conn.cursor()
-            
-            cursor.execute(f"""
-                INSERT INTO {self.migrations_table} (version, migration_name) 
-                VALUES (%s, %s)
-            """, (version, migration_name))
-            
-            conn.commit()
+            cursor.execute(
+                f"SELECT checkpoint FROM {self.migrations_table} WHERE version = %s AND status = 'running'",
+                (version,)
+            )
+            row = cursor.fetchone()
             cursor.close()
-            conn.close()
+        return json.loads(row[0]) if row and row[0] else None
+    
+    def save_checkpoint(self, migration, checkpoint, cursor):
+        """在调用方的事务中保存迁移断点（与对应批次的数据变更一起提交）"""
+        cursor.execute(f"""
+            INSERT INTO {self.migrations_table} (version, migration_name, status, checkpoint)
+            VALUES (%s, %s, 'running', %s)
+            ON DUPLICATE KEY UPDATE checkpoint = VALUES(checkpoint)
+        """, (migration['version'], migration['name'], json.dumps(checkpoint)))
+    
+    def record_migration(self, version, migration_name, conn=None, commit=True):
+        """记录已执行的迁移；commit=False 时由调用方与迁移语句一起提交"""
+        try:
+            with self.connection(conn) as conn:
+                cursor = conn.cursor()
+                
+                # 分批迁移执行过程中已有 running 状态的断点记录，完成时改为 completed
+                cursor.execute(f"""
+                    INSERT INTO {self.migrations_table} (version, migration_name, status, checkpoint) 
+                    VALUES (%s, %s, 'completed', NULL)
+                    ON DUPLICATE KEY UPDATE status = 'completed', checkpoint = NULL, executed_at = NOW()
+                """, (version, migration_name))
+                
+                if commit:
+                    conn.commit()
+                cursor.close()
             
             logger.info(f"迁移记录已保存: {version} - {migration_name}")
             
@@ -137,53 +210,185 @@ class DatabaseMigration:
             logger.error(f"记录迁移失败: {e}")
             raise e
     
-    def get_available_migrations(self):
-        """获取可用的迁移文件"""
-        migrations = []
+    def compute_migrations_checksum(self):
+        """迁移目录的校验和（由清单中各文件校验和合成）"""
+        return self.load_manifest()['checksum']
+    
+    def get_head_checksum(self, conn=None):
+        """读取已记录的迁移目录校验和，未记录时返回 None"""
+        try:
+            with self.connection(conn) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT checksum FROM {self.head_table} WHERE id = 1")
+                row = cursor.fetchone()
+                cursor.close()
+            return row[0] if row else None
+        except mysql.connector.Error as e:
+            if "doesn't exist" in str(e):
+                return None
+            raise e
+    
+    def save_head(self, checksum, head_version, conn=None):
+        """记录当前迁移目录校验和与最新版本"""
+        with self.connection(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.head_table} (
+                    id TINYINT PRIMARY KEY,
+                    head_version VARCHAR(50),
+                    checksum CHAR(64) NOT NULL,
+                    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """)
+            cursor.execute(f"""
+                INSERT INTO {self.head_table} (id, head_version, checksum) VALUES (1, %s, %s)
+                ON DUPLICATE KEY UPDATE head_version = VALUES(head_version), checksum = VALUES(checksum)
+            """, (head_version, checksum))
+            conn.commit()
+            cursor.close()
+    
+    def _scan_migration_files(self):
+        """列出迁移文件及其修改时间与大小，只做 stat，不读取内容"""
+        files = {}
+        with os.scandir(self.migrations_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = [stat.st_mtime_ns, stat.st_size]
+        return files
+    
+    def _read_manifest(self):
+        """读取清单文件，不存在或损坏时返回 None"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('format') == 1:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return None
+    
+    def _compile_migration_file(self, filename):
+        """读取并解析单个迁移文件，返回清单条目"""
+        migration_path = os.path.join(self.migrations_dir, filename)
+        with open(migration_path, 'rb') as f:
+            raw = f.read()
+        entry = {'checksum': hashlib.sha256(raw).hexdigest(), 'migration': None}
+        try:
+            migration_data = json.loads(raw.decode('utf-8'))
+            entry['migration'] = {
+                'version': filename.replace('.json', ''),
+                'name': migration_data.get('name', filename),
+                'description': migration_data.get('description', ''),
+                'sql': migration_data.get('sql', [])
+            }
+        except Exception as e:
+            logger.warning(f"读取迁移文件失败 {filename}: {e}")
+        return entry
+    
+    def _write_manifest(self, manifest):
+        """原子写入清单文件；目录只读时跳过（下次启动重新编译）"""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.migrations_dir, prefix='.manifest-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logger.debug(f"写入迁移清单失败: {e}")
+    
+    def load_manifest(self):
+        """获取迁移清单；文件未变化时直接使用清单，只重新解析新增或修改的文件"""
+        files = self._scan_migration_files()
+        manifest = self._manifest or self._read_manifest()
+        if manifest and manifest['stats'] == files:
+            self._manifest = manifest
+            return manifest
         
-        for filename in os.listdir(self.migrations_dir):
-            if filename.endswith('.json'):
-                version = filename.replace('.json', '')
-                migration_path = os.path.join(self.migrations_dir, filename)
-                
-                try:
-                    with open(migration_path, 'r', encoding='utf-8') as f:
-                        migration_data = json.load(f)
-                        migrations.append({
-                            'version': version,
-                            'name': migration_data.get('name', filename),
-                            'description': migration_data.get('description', ''),
-                            'sql': migration_data.get('sql', []),
-                            'path': migration_path
-                        })
-                except Exception as e:
-                    logger.warning(f"读取迁移文件失败 {filename}: {e}")
-                    continue
+        previous = manifest or {'stats': {}, 'entries': {}}
+        entries = {}
+        for filename, stat in files.items():
+            if previous['stats'].get(filename) == stat and filename in previous['entries']:
+                entries[filename] = previous['entries'][filename]
+            else:
+                entries[filename] = self._compile_migration_file(filename)
         
-        # 按版本排序
-        migrations.sort(key=lambda x: x['version'])
+        # 清单中按版本排好序，读取方无需再次排序
+        order = sorted(filename.replace('.json', '') for filename in entries)
+        digest = hashlib.sha256()
+        for filename in sorted(entries):
+            digest.update(f"{filename}\0{entries[filename]['checksum']}\n".encode('utf-8'))
+        
+        manifest = {
+            'format': 1,
+            'stats': files,
+            'entries': entries,
+            'versions': order,
+            'checksum': digest.hexdigest()
+        }
+        self._write_manifest(manifest)
+        self._manifest = manifest
+        logger.info(f"迁移清单已重建: {len(entries)} 个迁移文件")
+        return manifest
+    
+    def get_available_migrations(self):
+        """获取可用的迁移（按版本排序）"""
+        manifest = self.load_manifest()
+        migrations = []
+        for version in manifest['versions']:
+            filename = f"{version}.json"
+            migration = manifest['entries'][filename]['migration']
+            if migration is None:
+                continue
+            migrations.append({**migration, 'path': os.path.join(self.migrations_dir, filename)})
         return migrations
     
-    def execute_migration(self, migration):
-        """执行单个迁移"""
+    def get_pending_migrations(self, executed_migrations):
+        """根据已执行版本集合找出待执行的迁移"""
+        executed = set(executed_migrations)
+        return [m for m in self.get_available_migrations() if m['version'] not in executed]
+    
+    def execute_migration(self, migration, conn=None):
+        """执行单个迁移
+        
+        迁移语句与版本记录在同一事务中提交：只含数据变更的迁移要么全部生效并记录，
+        要么整体回滚。MySQL 的 DDL 会隐式提交，含 DDL 的迁移无法整体回滚，
+        版本记录紧随最后一条语句提交。
+        
+        sql 列表中的每一项可以是SQL字符串，也可以是带 type 的步骤对象：
+          {"type": "ddl", "sql": "ALTER TABLE ...", "online": true}
+              online 为 true 时追加 ALGORITHM=INPLACE, LOCK=NONE，执行期间不阻塞读写；
+              只支持 ALTER TABLE 与 CREATE [UNIQUE] INDEX / DROP INDEX，其他语句在执行前报错
+          {"type": "backfill", "table": "users", "key": "id", "set": "demo_count = 5",
+           "where": "demo_count IS NULL", "batch_size": 1000, "sleep_ms": 50}
+              按主键区间分批更新，每批单独提交并记录断点，中断后从断点继续
+        """
         logger.info(f"执行迁移: {migration['version']} - {migration['name']}")
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            # 执行任何语句前先检查 online 步骤，避免迁移执行到一半才出现语法错误
+            for step in migration['sql']:
+                if isinstance(step, dict) and step.get('online'):
+                    self._online_statement(step['sql'])
             
-            # 执行SQL语句
-            for sql_statement in migration['sql']:
-                if sql_statement.strip():
-                    logger.debug(f"执行SQL: {sql_statement[:100]}...")
-                    cursor.execute(sql_statement)
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            # 记录迁移
-            self.record_migration(migration['version'], migration['name'])
+            with self.connection(conn) as conn:
+                if any(self._step_type(step) == 'backfill' for step in migration['sql']):
+                    self._execute_resumable_migration(migration, conn)
+                else:
+                    cursor = conn.cursor()
+                    try:
+                        # 执行SQL语句
+                        for step in migration['sql']:
+                            self._execute_step(cursor, step)
+                        
+                        # 记录迁移
+                        self.record_migration(migration['version'], migration['name'], conn, commit=False)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    finally:
+                        cursor.close()
             
             logger.info(f"迁移 {migration['version']} 执行成功")
             
@@ -191,33 +396,203 @@ class DatabaseMigration:
             logger.error(f"执行迁移失败 {migration['version']}: {e}")
             raise e
     
-    def run_migrations(self):
-        """运行所有待执行的迁移"""
-        logger.info("开始数据库迁移...")
+    @staticmethod
+    def _step_type(step):
+        return step.get('type', 'sql') if isinstance(step, dict) else 'sql'
+    
+    def _execute_step(self, cursor, step):
+        """执行一条SQL语句或 ddl 步骤"""
+        sql_statement = step['sql'] if isinstance(step, dict) else step
+        if not sql_statement.strip():
+            return
+        if isinstance(step, dict) and step.get('online'):
+            sql_statement = self._online_statement(sql_statement)
+        logger.debug(f"执行SQL: {sql_statement[:100]}...")
+        cursor.execute(sql_statement)
+    
+    @staticmethod
+    def _online_statement(sql_statement):
+        """追加在线执行子句：ALTER TABLE 使用逗号分隔的表选项，CREATE/DROP INDEX 使用空格分隔的子句"""
+        statement = sql_statement.strip().rstrip(';')
+        if re.match(r'ALTER\s+TABLE\b', statement, re.IGNORECASE):
+            return f"{statement}, ALGORITHM=INPLACE, LOCK=NONE"
+        if re.match(r'(CREATE\s+(UNIQUE\s+)?INDEX|DROP\s+INDEX)\b', statement, re.IGNORECASE):
+            return f"{statement} ALGORITHM=INPLACE LOCK=NONE"
+        raise ValueError(f"online 只支持 ALTER TABLE 与 CREATE [UNIQUE] INDEX / DROP INDEX: {statement[:80]}")
+    
+    def _execute_resumable_migration(self, migration, conn):
+        """执行含分批回填步骤的迁移：每个步骤与每个批次完成后保存断点，重新运行时从断点继续
         
+        DDL 步骤执行前额外保存"已开始"断点，见 _run_ddl
+        """
+        checkpoint = self.get_checkpoint(migration['version'], conn) or {'step': 0}
+        if checkpoint['step'] or checkpoint.get('last_key') is not None:
+            logger.info(f"迁移 {migration['version']} 从断点继续: {checkpoint}")
+        
+        cursor = conn.cursor()
         try:
-            # 初始化迁移表
-            self.init_migrations_table()
-            
-            # 获取已执行和可用的迁移
-            executed_migrations = self.get_executed_migrations()
-            available_migrations = self.get_available_migrations()
-            
-            # 找出需要执行的迁移
-            pending_migrations = [
-                m for m in available_migrations 
-                if m['version'] not in executed_migrations
-            ]
-            
-            if not pending_migrations:
-                logger.info("没有待执行的迁移")
-                return True
+            for index, step in enumerate(migration['sql']):
+                if index < checkpoint['step']:
+                    continue
+                if self._step_type(step) == 'backfill':
+                    last_key = checkpoint.get('last_key') if index == checkpoint['step'] else None
+                    self._run_backfill(migration, index, step, last_key, conn, cursor)
+                elif self._is_ddl(step):
+                    resumed = index == checkpoint['step'] and checkpoint.get('ddl_started', False)
+                    self._run_ddl(migration, index, step, resumed, conn, cursor)
+                else:
+                    self._execute_step(cursor, step)
+                self.save_checkpoint(migration, {'step': index + 1}, cursor)
+                conn.commit()
             
-            logger.info(f"发现 {len(pending_migrations)} 个待执行的迁移")
+            self.record_migration(migration['version'], migration['name'], conn, commit=False)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    
+    def _is_ddl(self, step):
+        sql_statement = step['sql'] if isinstance(step, dict) else step
+        return self._step_type(step) == 'ddl' or bool(DDL_STATEMENT.match(sql_statement))
+    
+    def _run_ddl(self, migration, index, step, resumed, conn, cursor):
+        """执行 DDL 步骤
+        
+        DDL 隐式提交，无法与断点同事务：执行前先提交"已开始"断点。若进程在 DDL 提交后、
+        断点推进前中断，重新运行时该步骤带有"已开始"标记，再次执行报对象已存在/不存在
+        说明 DDL 已生效，跳过而不是失败。
+        """
+        if not resumed:
+            self.save_checkpoint(migration, {'step': index, 'ddl_started': True}, cursor)
+            conn.commit()
+        try:
+            self._execute_step(cursor, step)
+        except Error as e:
+            if not resumed or e.errno not in DDL_ALREADY_APPLIED_ERRORS:
+                raise
+            logger.info(f"迁移 {migration['version']} 第 {index + 1} 步 DDL 已在中断前生效，跳过: {e}")
+    
+    def _run_backfill(self, migration, index, step, last_key, conn, cursor):
+        """按主键区间分批执行 UPDATE，每批与断点同事务提交，批次之间休眠以限制对线上负载的影响
+        
+        区间上界取开始时的最大主键，之后新插入的行应由应用写入或列默认值负责。
+        """
+        table = step['table']
+        key = step.get('key', 'id')
+        batch_size = int(step.get('batch_size', 1000))
+        sleep_seconds = float(step.get('sleep_ms', 50)) / 1000
+        condition = f" AND ({step['where']})" if step.get('where') else ''
+        
+        cursor.execute(f"SELECT MIN(`{key}`), MAX(`{key}`) FROM `{table}`")
+        min_key, max_key = cursor.fetchone()
+        if max_key is None:
+            return
+        start = last_key + 1 if last_key is not None else min_key
+        
+        batches = 0
+        updated = 0
+        while start <= max_key:
+            end = start + batch_size - 1
+            cursor.execute(
+                f"UPDATE `{table}` SET {step['set']} WHERE `{key}` BETWEEN %s AND %s{condition}",
+                (start, end)
+            )
+            updated += max(cursor.rowcount, 0)
+            self.save_checkpoint(migration, {'step': index, 'last_key': end}, cursor)
+            conn.commit()
             
-            # 执行迁移
-            for migration in pending_migrations:
-                self.execute_migration(migration)
+            batches += 1
+            if batches % 100 == 0:
+                logger.info(f"回填 {table}: {end}/{max_key}，已更新 {updated} 行")
+            start = end + 1
+            if sleep_seconds > 0 and start <= max_key:
+                time.sleep(sleep_seconds)
+        
+        logger.info(f"回填 {table} 完成: {batches} 批，更新 {updated} 行")
+    
+    def _migration_progress(self, conn):
+        """读取迁移进度（已记录的版本数与进行中迁移的断点），用于判断持锁进程是否仍在推进"""
+        try:
+            # 结束当前读事务，读取其他进程最新提交的断点
+            conn.rollback()
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT COUNT(*), MAX(CASE WHEN status = 'running' THEN checkpoint END)
+                FROM {self.migrations_table}
+            """)
+            progress = cursor.fetchone()
+            cursor.close()
+            return tuple(progress) if progress else None
+        except Error:
+            # 迁移表尚未创建或为旧结构
+            return None
+    
+    @contextmanager
+    def migration_lock(self, conn):
+        """持有 MySQL 会话级命名锁（GET_LOCK），跨进程、跨主机互斥执行迁移
+        
+        分批回填可能持锁远超 lock_timeout：等待期间持锁进程的断点仍在推进时继续等待，
+        进度超过 lock_timeout 秒没有变化才放弃。
+        """
+        lock_name = f"{self.mysql_config.get('database', '')}.{self.migrations_table}"[:64]
+        cursor = conn.cursor()
+        start = time.monotonic()
+        deadline = start + self.lock_timeout
+        progress = self._migration_progress(conn)
+        while True:
+            wait_seconds = max(1, min(self.lock_poll_seconds, int(deadline - time.monotonic())))
+            cursor.execute("SELECT GET_LOCK(%s, %s)", (lock_name, wait_seconds))
+            if cursor.fetchone()[0] == 1:
+                break
+            current = self._migration_progress(conn)
+            if current != progress:
+                progress = current
+                deadline = time.monotonic() + self.lock_timeout
+                logger.info(f"其他进程正在执行迁移，进度: {current}")
+            elif time.monotonic() >= deadline:
+                cursor.close()
+                raise TimeoutError(f"等待迁移锁超时（迁移进度 {self.lock_timeout} 秒无变化）: {lock_name}")
+        waited = time.monotonic() - start
+        if waited > 1:
+            logger.info(f"等待其他进程完成迁移 {waited:.1f} 秒")
+        # 结束加锁前的读事务：REPEATABLE READ 下同一事务会继续读取旧快照，
+        # 看不到等锁期间其他进程提交的迁移记录与校验和
+        conn.rollback()
+        try:
+            yield
+        finally:
+            try:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                cursor.fetchone()
+            except Exception as e:
+                # 连接断开时锁会被服务器自动释放
+                logger.warning(f"释放迁移锁失败: {e}")
+            cursor.close()
+    
+    def run_migrations(self, force=False):
+        """运行所有待执行的迁移，整个过程只使用一个数据库连接
+        
+        迁移目录校验和与上次完整迁移时记录的一致时直接返回（一次查询），
+        force=True 时忽略校验和，重新比对每个版本。
+        """
+        logger.info("开始数据库迁移...")
+        
+        try:
+            checksum = self.compute_migrations_checksum()
+            with self.connection() as conn:
+                if not force and self.get_head_checksum(conn) == checksum:
+                    logger.info("迁移目录未变化，跳过迁移检查")
+                    return True
+                
+                with self.migration_lock(conn):
+                    # 等锁期间其他进程可能已完成迁移，再次检查校验和
+                    if not force and self.get_head_checksum(conn) == checksum:
+                        logger.info("其他进程已完成迁移，跳过")
+                        return True
+                    
+                    self._apply_pending_migrations(conn, checksum)
             
             logger.info("数据库迁移完成")
             return True
@@ -226,6 +601,27 @@ class DatabaseMigration:
             logger.error(f"数据库迁移失败: {e}")
             return False
     
+    def _apply_pending_migrations(self, conn, checksum):
+        """执行待执行的迁移并记录迁移目录校验和（调用方需持有迁移锁）"""
+        # 初始化迁移表
+        self.init_migrations_table(conn)
+        
+        # 找出需要执行的迁移
+        pending_migrations = self.get_pending_migrations(self.get_executed_migrations(conn))
+        
+        if pending_migrations:
+            logger.info(f"发现 {len(pending_migrations)} 个待执行的迁移")
+            
+            # 按顺序在同一连接上执行迁移
+            for migration in pending_migrations:
+                self.execute_migration(migration, conn)
+        else:
+            logger.info("没有待执行的迁移")
+        
+        versions = self.load_manifest()['versions']
+        head_version = versions[-1] if versions else None
+        self.save_head(checksum, head_version, conn)
+    
     def create_migration_file(self, version, name, description, sql_statements):
         """创建迁移文件"""
         migration_data = {
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+MySQL连接池模块
+提供有界连接池、借出健康检查、空闲连接淘汰和连接池指标
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+import mysql.connector
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(Exception):
+    """等待可用连接超时"""
+    pass
+
+
+class PooledConnection:
+    """池化连接代理，close() 时将连接归还连接池而不是断开"""
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self._closed = False
+
+    def close(self):
+        """归还连接"""
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.release(self._connection)
+        self._connection = None
+
+    def __getattr__(self, name):
+        if self._closed:
+            raise mysql.connector.errors.OperationalError("连接已归还连接池")
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ConnectionPool:
+    """有界MySQL连接池"""
+
+    def __init__(self, mysql_config, pool_size=10, checkout_timeout=10,
+                 idle_timeout=300, ping_interval=30, max_lifetime=3600):
+        self.mysql_config = mysql_config
+        self.pool_size = pool_size  # 最大连接数（含借出与空闲）
+        self.checkout_timeout = checkout_timeout  # 等待可用连接的最长时间（秒）
+        self.idle_timeout = idle_timeout  # 空闲超过该时间的连接被淘汰（秒）
+        self.ping_interval = ping_interval  # 空闲超过该时间的连接借出前先 ping（秒）
+        self.max_lifetime = max_lifetime  # 连接最长存活时间（秒），避免被服务端 wait_timeout 断开
+
+        # 空闲连接栈 [(connection, last_used_at)]，后进先出以复用最热的连接
+        self._idle = []
+        self._created_at = {}  # id(connection) -> 建立时间，在锁内读写
+        self._in_use = 0
+        self._waiters = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+        # 指标
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'evicted_idle': 0,
+            'evicted_lifetime': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0
+        }
+
+    def _connect(self):
+        """建立新的物理连接"""
+        connection = mysql.connector.connect(**self.mysql_config)
+        with self._cond:
+            self._stats['created'] += 1
+            self._created_at[id(connection)] = time.monotonic()
+        return connection
+
+    def _discard(self, connection):
+        """断开物理连接"""
+        with self._cond:
+            self._created_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _evict_idle_locked(self, now):
+        """淘汰空闲超时或超过最大存活时间的连接，需持有锁"""
+        evicted = []
+        kept = []
+        for connection, last_used in self._idle:
+            created = self._created_at.get(id(connection), now)
+            if now - last_used > self.idle_timeout:
+                self._stats['evicted_idle'] += 1
+                evicted.append(connection)
+            elif now - created > self.max_lifetime:
+                self._stats['evicted_lifetime'] += 1
+                evicted.append(connection)
+            else:
+                kept.append((connection, last_used))
+        self._idle = kept
+        return evicted
+
+    def _is_healthy(self, connection, last_used, now):
+        """借出前的健康检查，刚用过的连接跳过 ping"""
+        if now - last_used < self.ping_interval:
+            return True
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logger.warning(f"连接池健康检查失败，丢弃连接: {e}")
+            return False
+
+    def acquire(self, timeout=None):
+        """借出一个连接，连接池已满时等待"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        while True:
+            connection = None
+            last_used = None
+            create_new = False
+
+            with self._cond:
+                if self._closed:
+                    raise PoolExhaustedError("连接池已关闭")
+
+                evicted = self._evict_idle_locked(time.monotonic())
+
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    self._in_use += 1
+                elif self._in_use + len(self._idle) < self.pool_size:
+                    self._in_use += 1
+                    create_new = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        waited = time.monotonic() - start
+                        raise PoolExhaustedError(f"等待数据库连接超时（{waited:.2f} 秒）")
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+
+            for stale in evicted:
+                self._discard(stale)
+
+            if connection is None and not create_new:
+                continue
+
+            try:
+                if create_new:
+                    connection = self._connect()
+                elif not self._is_healthy(connection, last_used, time.monotonic()):
+                    with self._cond:
+                        self._stats['health_check_failures'] += 1
+                    self._discard(connection)
+                    connection = self._connect()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._stats['checkouts'] += 1
+                self._stats['total_wait_seconds'] += waited
+                if waited > self._stats['max_wait_seconds']:
+                    self._stats['max_wait_seconds'] = waited
+            return PooledConnection(self, connection)
+
+    def release(self, connection):
+        """归还连接，未提交的事务会被回滚"""
+        healthy = True
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy and not self._closed:
+                self._idle.append((connection, time.monotonic()))
+                connection = None
+            self._cond.notify()
+
+        if connection is not None:
+            self._discard(connection)
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器方式借出连接，退出时自动归还"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self):
+        """关闭连接池并断开所有空闲连接"""
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._cond.notify_all()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def get_stats(self):
+        """获取连接池指标"""
+        with self._cond:
+            checkouts = self._stats['checkouts']
+            return {
+                'pool_size': self.pool_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiters': self._waiters,
+                'avg_wait_ms': round(self._stats['total_wait_seconds'] * 1000 / checkouts, 3) if checkouts else 0.0,
+                'max_wait_ms': round(self._stats['max_wait_seconds'] * 1000, 3),
+                **{k: v for k, v in self._stats.items() if k not in ('total_wait_seconds', 'max_wait_seconds')}
+            }
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+数据库就绪探测模块
+先用 TCP 连接探测端口，端口可达后再做完整的 MySQL 认证握手；
+失败时按带抖动的指数退避重试，直到总时限
+"""
+
+import time
+import random
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def tcp_probe(host, port, timeout=1.0):
+    """探测端口是否接受 TCP 连接，不进行 MySQL 握手"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class DatabaseReadiness:
+    """等待 MySQL 可用，并记录就绪耗时"""
+
+    def __init__(self, mysql_config, deadline_seconds=120, initial_delay=0.1,
+                 max_delay=2.0, connect_timeout=5):
+        self.mysql_config = mysql_config
+        self.deadline_seconds = deadline_seconds  # 总等待时限（秒）
+        self.initial_delay = initial_delay  # 首次重试延迟（秒）
+        self.max_delay = max_delay  # 单次重试延迟上限（秒）
+        self.connect_timeout = connect_timeout  # 单次连接/握手超时（秒）
+
+        # 指标
+        self.stats = {
+            'ready': False,
+            'tcp_probes': 0,
+            'connect_attempts': 0,
+            'time_to_tcp': None,
+            'time_to_ready': None,
+            'last_error': None
+        }
+
+    def _backoff(self, attempt, remaining):
+        """全抖动指数退避，不超过剩余时间"""
+        delay = random.uniform(0, min(self.max_delay, self.initial_delay * (2 ** attempt)))
+        return max(0.0, min(delay, remaining))
+
+    def _connect(self, timeout):
+        """完整的 MySQL 认证握手（不指定数据库，数据库可能尚未创建）"""
+        import mysql.connector
+
+        config_without_db = self.mysql_config.copy()
+        config_without_db.pop('database', None)
+        config_without_db['connection_timeout'] = max(1, int(timeout))
+        connection = mysql.connector.connect(**config_without_db)
+        connection.close()
+
+    def wait(self):
+        """阻塞直到数据库可用或超过总时限，返回是否就绪"""
+        host = self.mysql_config.get('host', 'localhost')
+        port = int(self.mysql_config.get('port', 3306))
+        start = time.monotonic()
+        deadline = start + self.deadline_seconds
+        attempt = 0
+        tcp_ready = False
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            timeout = min(self.connect_timeout, remaining)
+
+            if not tcp_ready:
+                # 端口未开放时不必发起认证握手
+                self.stats['tcp_probes'] += 1
+                tcp_ready = tcp_probe(host, port, timeout)
+                if tcp_ready:
+                    self.stats['time_to_tcp'] = round(time.monotonic() - start, 3)
+                    logger.info(f"数据库端口已开放: {host}:{port}（{self.stats['time_to_tcp']} 秒）")
+                    # 端口刚开放时直接进行握手，不再退避
+                    continue
+                self.stats['last_error'] = f"{host}:{port} 端口不可达"
+            else:
+                self.stats['connect_attempts'] += 1
+                try:
+                    self._connect(timeout)
+                    self.stats['ready'] = True
+                    self.stats['time_to_ready'] = round(time.monotonic() - start, 3)
+                    logger.info(f"数据库服务已就绪，耗时 {self.stats['time_to_ready']} 秒"
+                                f"（TCP 探测 {self.stats['tcp_probes']} 次，握手 {self.stats['connect_attempts']} 次）")
+                    return True
+                except Exception as e:
+                    self.stats['last_error'] = str(e)
+                    # 握手失败可能是服务正在重启，下一轮重新从 TCP 探测开始
+                    tcp_ready = False
+
+            delay = self._backoff(attempt, deadline - time.monotonic())
+            attempt += 1
+            logger.info(f"数据库未就绪，{delay:.2f} 秒后重试: {self.stats['last_error']}")
+            time.sleep(delay)
+
+        logger.error(f"等待数据库超时（{self.deadline_seconds} 秒）: {self.stats['last_error']}")
+        return False
+
+    def get_stats(self):
+        """获取探测指标"""
+        return dict(self.stats)
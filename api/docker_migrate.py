@@ -6,9 +6,9 @@ Docker环境数据库迁移脚本
 
 import os
 import sys
-import time
 import logging
 from database_migration import DatabaseMigration
+from db_readiness import DatabaseReadiness
 
 # 配置日志
 logging.basicConfig(
@@ -17,34 +17,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def wait_for_database(mysql_config, max_attempts=30, delay=2):
-    """等待数据库服务可用"""
+def wait_for_database(mysql_config, deadline_seconds=None):
+    """等待数据库服务可用：先探测 TCP 端口，再做认证握手，按带抖动的指数退避重试"""
     logger.info("等待数据库服务启动...")
     
-    import mysql.connector
-    from mysql.connector import Error
-    
-    for attempt in range(max_attempts):
-        try:
-            # 尝试连接到MySQL服务器（不指定数据库）
-            config_without_db = mysql_config.copy()
-            config_without_db.pop('database', None)
-            
-            connection = mysql.connector.connect(**config_without_db)
-            connection.close()
-            
-            logger.info("数据库服务已就绪")
-            return True
-            
-        except Error as e:
-            if attempt < max_attempts - 1:
-                logger.info(f"数据库未就绪，等待 {delay} 秒... (尝试 {attempt + 1}/{max_attempts})")
-                time.sleep(delay)
-            else:
-                logger.error(f"数据库连接超时: {e}")
-                return False
-    
-    return False
+    readiness = DatabaseReadiness(
+        mysql_config,
+        deadline_seconds=deadline_seconds or float(os.getenv('DB_WAIT_TIMEOUT', 120)),
+        max_delay=float(os.getenv('DB_WAIT_MAX_DELAY', 2))
+    )
+    return readiness.wait()
 
 def run_docker_migration():
     """在Docker环境中运行迁移"""
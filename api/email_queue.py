@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+邮件异步发送队列模块
+邮件入队后立即返回，由后台线程发送，失败按指数退避重试，多次失败后进入死信列表
+"""
+
+import time
+import heapq
+import atexit
+import random
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EmailDispatchQueue:
+    """邮件发送队列"""
+
+    def __init__(self, send_func, workers=2, max_queue_size=1000, max_attempts=4,
+                 base_delay=2.0, max_delay=60.0, dead_letter_size=200, on_dead_letter=None):
+        self.send_func = send_func  # 发送函数 send_func(to_email, message)，失败时抛出异常
+        self.workers = workers  # 发送线程数
+        self.max_queue_size = max_queue_size  # 待发送邮件上限
+        self.max_attempts = max_attempts  # 最大发送次数（含首次）
+        self.base_delay = base_delay  # 首次重试延迟（秒）
+        self.max_delay = max_delay  # 重试延迟上限（秒）
+        self.on_dead_letter = on_dead_letter  # 邮件进入死信列表时的回调 on_dead_letter(item)
+
+        # 待发送堆 [(next_attempt_at, seq, item)]，按计划发送时间排序
+        self.pending = []
+        self.seq = itertools.count()
+        self.in_progress = 0
+        self.dead_letters = deque(maxlen=dead_letter_size)
+
+        self.cond = threading.Condition(threading.Lock())
+        self.threads = []
+        self.stopping = False
+
+        # 指标
+        self.stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'sent': 0,
+            'retries': 0,
+            'dead_lettered': 0
+        }
+
+        atexit.register(self.stop)
+
+    def start(self):
+        """启动发送线程（首次入队时自动调用，避免在 fork 前创建线程）"""
+        with self.cond:
+            if self.threads:
+                return
+            self.stopping = False
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"email-sender-{i + 1}",
+                    daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def enqueue(self, to_email, message):
+        """邮件入队，队列已满时返回 False"""
+        if not self.threads:
+            self.start()
+
+        item = {
+            'to_email': to_email,
+            'message': message,
+            'attempts': 0,
+            'last_error': None,
+            'enqueued_at': datetime.now()
+        }
+        with self.cond:
+            if len(self.pending) + self.in_progress >= self.max_queue_size:
+                self.stats['rejected'] += 1
+                return False
+            heapq.heappush(self.pending, (time.monotonic(), next(self.seq), item))
+            self.stats['enqueued'] += 1
+            self.cond.notify()
+        return True
+
+    def _retry_delay(self, attempts):
+        """指数退避延迟，带随机抖动"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _worker_loop(self):
+        """发送线程主循环"""
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopping and not self.pending:
+                        return
+                    if self.pending:
+                        wait_seconds = self.pending[0][0] - time.monotonic()
+                        # 停止时不再等待退避，立即尝试剩余邮件
+                        if wait_seconds <= 0 or self.stopping:
+                            break
+                        self.cond.wait(wait_seconds)
+                    else:
+                        self.cond.wait()
+                _, _, item = heapq.heappop(self.pending)
+                self.in_progress += 1
+
+            self._deliver(item)
+
+    def _deliver(self, item):
+        """发送单封邮件并处理重试"""
+        item['attempts'] += 1
+        try:
+            self.send_func(item['to_email'], item['message'])
+        except Exception as e:
+            item['last_error'] = str(e)
+            with self.cond:
+                self.in_progress -= 1
+                if item['attempts'] < self.max_attempts and not self.stopping:
+                    delay = self._retry_delay(item['attempts'])
+                    heapq.heappush(self.pending, (time.monotonic() + delay, next(self.seq), item))
+                    self.stats['retries'] += 1
+                    self.cond.notify()
+                    logger.warning(f"邮件发送失败，{delay:.1f} 秒后重试: {item['to_email']}, 错误: {e}")
+                    return
+                self.dead_letters.append(item)
+                self.stats['dead_lettered'] += 1
+            logger.error(f"邮件发送失败 {item['attempts']} 次，已放入死信列表: {item['to_email']}, 错误: {e}")
+            if self.on_dead_letter:
+                try:
+                    self.on_dead_letter(item)
+                except Exception:
+                    logger.exception("死信回调异常")
+            return
+
+        with self.cond:
+            self.in_progress -= 1
+            self.stats['sent'] += 1
+        logger.info(f"邮件发送成功: {item['to_email']}（第 {item['attempts']} 次尝试）")
+
+    def stop(self, timeout=10):
+        """停止发送线程，尽量发送完剩余邮件"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            threads = self.threads
+            self.threads = []
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def get_dead_letters(self):
+        """获取死信列表"""
+        with self.cond:
+            return [
+                {
+                    'to_email': item['to_email'],
+                    'attempts': item['attempts'],
+                    'last_error': item['last_error'],
+                    'enqueued_at': item['enqueued_at'].isoformat()
+                }
+                for item in self.dead_letters
+            ]
+
+    def get_stats(self):
+        """获取队列指标"""
+        with self.cond:
+            return {
+                'pending': len(self.pending),
+                'in_progress': self.in_progress,
+                'dead_letters': len(self.dead_letters),
+                **self.stats
+            }
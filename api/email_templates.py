@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+邮件模板模块
+验证码邮件模板在启动时编译一次，发送时只替换验证码，MIME 头部与不变的正文片段预先序列化；
+输出与按 CRLF 换行序列化的 MIME 对象一致（sendmail 对 bytes 不做换行转换）
+"""
+
+import base64
+import random
+import sys
+from email import policy
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import logging
+
+logger = logging.getLogger(__name__)
+
+CODE_PLACEHOLDER = '{verification_code}'
+EXPIRY_PLACEHOLDER = '{expiry_minutes}'
+
+# base64 每行编码 57 字节输入（76 个字符输出），与 email 包的编码方式一致
+BASE64_LINE_BYTES = 57
+
+CRLF = '\r\n'
+
+# MIMEText/MIMEMultipart 使用 compat32 策略，按 CRLF 换行序列化（policy.SMTP 无法编码其中的非 ASCII 头部）
+SMTP_POLICY = policy.compat32.clone(linesep=CRLF)
+
+
+def to_crlf(text):
+    """把文本中的换行统一为 CRLF"""
+    return text.replace('\r\n', '\n').replace('\n', CRLF)
+
+
+def encode_base64_lines(data):
+    """base64 编码，每行以 CRLF 结尾"""
+    return base64.encodebytes(data).replace(b'\n', b'\r\n')
+
+VERIFICATION_TEXT_TEMPLATE = """
+You are registering for a Joyful platform account.
+
+Your verification code is: {verification_code}
+
+This code will expire in {expiry_minutes} minutes.
+Please do not share this code with anyone.
+
+If you did not request this verification, please ignore this email.
+
+Best regards,
+Joyful Team
+""".strip()
+
+VERIFICATION_HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Joyful Registration Verification</title>
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }
+        .content { background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }
+        .code { background: #fff; border: 2px dashed #667eea; padding: 20px; text-align: center; margin: 20px 0; border-radius: 8px; }
+        .code-number { font-size: 32px; font-weight: bold; color: #667eea; letter-spacing: 8px; }
+        .footer { text-align: center; color: #666; margin-top: 20px; font-size: 14px; }
+        .warning { background: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 20px 0; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>🎨 Joyful Platform</h1>
+            <h2>Registration Verification</h2>
+        </div>
+        <div class="content">
+            <p>Hello!</p>
+            <p>You are registering for a <strong>Joyful</strong> platform account.</p>
+            
+            <div class="code">
+                <p>Your verification code is:</p>
+                <div class="code-number">{verification_code}</div>
+            </div>
+            
+            <div class="warning">
+                <p><strong>⚠️ Important:</strong></p>
+                <ul>
+                    <li>This code will expire in <strong>{expiry_minutes} minutes</strong></li>
+                    <li>Please do not share this code with anyone</li>
+                    <li>If you did not request this verification, please ignore this email</li>
+                </ul>
+            </div>
+            
+            <p>Thank you for choosing Joyful!</p>
+            
+            <div class="footer">
+                <p>Best regards,<br><strong>Joyful Team</strong></p>
+                <p><small>This is an automated email. Please do not reply to this message.</small></p>
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+""".strip()
+
+
+class CompiledPart:
+    """编译后的邮件正文部分：正文被验证码占位符分为前后两段
+
+    纯 ASCII 正文按 7bit 原样输出；含非 ASCII 字符时按 utf-8 + base64 输出，
+    验证码之前和之后按整行对齐的片段预先编码，发送时只编码验证码附近的一行左右。
+    """
+
+    def __init__(self, subtype, template, code_length):
+        self.subtype = subtype
+        self.prefix, self.suffix = template.split(CODE_PLACEHOLDER)
+        self.code_length = code_length
+        self.is_ascii = template.isascii()
+
+        charset = 'us-ascii' if self.is_ascii else 'utf-8'
+        encoding = '7bit' if self.is_ascii else 'base64'
+        self.headers = (
+            f'Content-Type: text/{subtype}; charset="{charset}"{CRLF}'
+            f'MIME-Version: 1.0{CRLF}'
+            f'Content-Transfer-Encoding: {encoding}{CRLF}{CRLF}'
+        ).encode('ascii')
+
+        if self.is_ascii:
+            self.prefix_bytes = to_crlf(self.prefix).encode('ascii')
+            self.suffix_bytes = to_crlf(self.suffix).encode('ascii')
+            return
+
+        # base64 按 57 字节一行编码：验证码前取整行预编码，验证码所在行补齐到整行，余下部分预编码
+        prefix_bytes = self.prefix.encode('utf-8')
+        suffix_bytes = self.suffix.encode('utf-8')
+        head_length = len(prefix_bytes) - len(prefix_bytes) % BASE64_LINE_BYTES
+        self.encoded_head = encode_base64_lines(prefix_bytes[:head_length])
+        self.middle_prefix = prefix_bytes[head_length:]
+        middle_length = len(self.middle_prefix) + code_length
+        fill = -middle_length % BASE64_LINE_BYTES
+        if fill > len(suffix_bytes):
+            fill = len(suffix_bytes)
+        self.middle_suffix = suffix_bytes[:fill]
+        self.encoded_tail = encode_base64_lines(suffix_bytes[fill:])
+
+    def render(self, code):
+        """替换验证码，返回正文字符串"""
+        return self.prefix + code + self.suffix
+
+    def encode(self, code):
+        """返回替换验证码后的 MIME 部分（头部 + 已编码正文）"""
+        if self.is_ascii:
+            return self.headers + self.prefix_bytes + code.encode('ascii') + self.suffix_bytes
+        if len(code) != self.code_length:
+            return self.headers + encode_base64_lines(self.render(code).encode('utf-8'))
+        middle = encode_base64_lines(self.middle_prefix + code.encode('ascii') + self.middle_suffix)
+        return self.headers + self.encoded_head + middle + self.encoded_tail
+
+
+class VerificationEmailTemplate:
+    """验证码邮件模板，创建时编译，build_message() 每封邮件只做拼接"""
+
+    def __init__(self, sender, subject, expiry_minutes, code_length=6):
+        self.sender = sender
+        self.subject = subject
+        text_template = VERIFICATION_TEXT_TEMPLATE.replace(EXPIRY_PLACEHOLDER, str(expiry_minutes))
+        html_template = VERIFICATION_HTML_TEMPLATE.replace(EXPIRY_PLACEHOLDER, str(expiry_minutes))
+        self.text_part = CompiledPart('plain', text_template, code_length)
+        self.html_part = CompiledPart('html', html_template, code_length)
+
+        # 边界格式与 email 包一致，base64 与纯文本正文中不会出现以 "--===" 开头的行
+        token = random.randrange(sys.maxsize)
+        boundary = f"{'=' * 15}{token:019d}=="
+        self.boundary = boundary
+        self.header_prefix = (
+            f'Content-Type: multipart/alternative;{CRLF}'
+            f' boundary="{boundary}"{CRLF}'
+            f'MIME-Version: 1.0{CRLF}'
+            f'Subject: {subject}{CRLF}'
+            f'From: {sender}{CRLF}'
+            'To: '
+        ).encode('ascii')
+        self.delimiter = f'{CRLF}--{boundary}{CRLF}'.encode('ascii')
+        self.closing = f'{CRLF}--{boundary}--{CRLF}'.encode('ascii')
+
+    def render(self, code):
+        """返回 (纯文本正文, HTML正文)"""
+        return self.text_part.render(code), self.html_part.render(code)
+
+    def can_build_fast(self, to_email, code):
+        """收件人与验证码均为单行 ASCII 时可直接拼接，否则需要 email 包做头部编码"""
+        return (to_email.isascii() and code.isascii()
+                and '\n' not in to_email and '\r' not in to_email)
+
+    def build_message(self, to_email, code):
+        """返回序列化后的邮件（bytes），可直接交给 SMTP sendmail"""
+        if not self.can_build_fast(to_email, code):
+            return self.build_mime(to_email, code).as_bytes(policy=SMTP_POLICY)
+        return b''.join((
+            self.header_prefix, to_email.encode('ascii'), b'\r\n',
+            self.delimiter, self.text_part.encode(code),
+            self.delimiter, self.html_part.encode(code),
+            self.closing
+        ))
+
+    def build_mime(self, to_email, code):
+        """按原方式构建 MIMEMultipart 对象（非 ASCII 收件人与基准对比使用）"""
+        text_content, html_content = self.render(code)
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = self.subject
+        msg["From"] = self.sender
+        msg["To"] = to_email
+        msg.attach(MIMEText(text_content, "plain"))
+        msg.attach(MIMEText(html_content, "html"))
+        return msg
@@ -4,32 +4,61 @@
 提供邮箱验证码发送和验证功能
 """
 
-import smtplib
-import ssl
+import os
 import random
 import string
 import time
-import threading
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
 import logging
+from email_templates import VerificationEmailTemplate
+from email_queue import EmailDispatchQueue
+from smtp_pool import SMTPConnectionPool
+from code_store import (
+    MemoryCodeStore, SQLiteCodeStore, MySQLCodeStore, RedisCodeStore, CodeExpirer,
+    VERIFY_OK, VERIFY_NOT_FOUND, VERIFY_EXPIRED, VERIFY_TOO_MANY_ATTEMPTS
+)
 
 logger = logging.getLogger(__name__)
 
+
+def create_code_store(mysql_config=None):
+    """根据环境变量创建验证码存储
+
+    VERIFICATION_CODE_STORE: memory（默认，单进程）、sqlite（同主机多进程）、
+    mysql（多主机共享，使用传入的 mysql_config，即应用的 MYSQL_CONFIG）、redis（多主机共享，TTL 自动过期）
+    """
+    backend = os.getenv('VERIFICATION_CODE_STORE', 'memory').lower()
+    
+    if backend == 'sqlite':
+        db_path = os.getenv('VERIFICATION_CODE_SQLITE_PATH',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'verification_codes.db'))
+        return SQLiteCodeStore(db_path)
+    
+    if backend == 'mysql':
+        from db_pool import ConnectionPool
+        if not mysql_config:
+            raise ValueError("VERIFICATION_CODE_STORE=mysql 需要传入数据库配置")
+        pool = ConnectionPool(mysql_config, pool_size=int(os.getenv('VERIFICATION_CODE_MYSQL_POOL_SIZE', 4)))
+        return MySQLCodeStore(pool.acquire)
+    
+    if backend == 'redis':
+        return RedisCodeStore(os.getenv('VERIFICATION_CODE_REDIS_URL', 'redis://localhost:6379/0'))
+    
+    return MemoryCodeStore(shards=max(1, int(os.getenv('VERIFICATION_CODE_SHARDS', 16))))
+
 class EmailVerificationService:
     """邮箱验证服务"""
     
-    def __init__(self):
+    def __init__(self, mysql_config=None):
         # 邮箱服务器配置
         self.smtp_server = "smtppro.zoho.com"
         self.port = 465  # SSL端口
         self.username = "system@joyful.cloud"
         self.password = "Uzfzj7-n"
         
-        # 验证码存储 {email: {code: str, expires_at: datetime, attempts: int}}
-        self.verification_codes = {}
-        self.lock = threading.Lock()  # 线程锁，确保多用户并发安全
+        # 验证码存储，发送间隔与尝试次数在存储内原子更新
+        self.code_store = create_code_store(mysql_config)
+        # 后台过期清理（首次发送验证码时启动，避免在 fork 前创建线程）
+        self.code_expirer = CodeExpirer(self.code_store)
         
         # 配置参数
         self.code_length = 6  # 验证码长度
@@ -37,155 +66,111 @@ class EmailVerificationService:
         self.max_attempts = 3  # 最大验证尝试次数
         self.send_interval_seconds = 60  # 发送间隔（秒）
         
+        # 邮件模板在启动时编译一次
+        self.email_template = VerificationEmailTemplate(
+            sender=f"Joyful System <{self.username}>",
+            subject="Joyful Registration Service - Verification Code",
+            expiry_minutes=self.code_expiry_minutes,
+            code_length=self.code_length
+        )
+        
+        # SMTP会话池：复用已认证的连接，避免每封邮件重新握手和登录
+        self.smtp_pool = SMTPConnectionPool(
+            self.smtp_server, self.port, self.username, self.password,
+            use_ssl=True, pool_size=2
+        )
+        
+        # 异步发送队列：验证码保存并入队后立即返回，由后台线程发送
+        self.async_delivery = True
+        self.dispatch_queue = EmailDispatchQueue(
+            self.deliver_verification_email,
+            on_dead_letter=self._on_delivery_failed
+        )
+        
     def generate_verification_code(self):
         """生成6位数字验证码"""
         return ''.join(random.choices(string.digits, k=self.code_length))
     
     def create_email_content(self, verification_code):
-        """创建邮件内容"""
-        # 邮件正文（英文）
-        text_content = f"""
-You are registering for a Joyful platform account.
-
-Your verification code is: {verification_code}
-
-This code will expire in {self.code_expiry_minutes} minutes.
-Please do not share this code with anyone.
-
-If you did not request this verification, please ignore this email.
-
-Best regards,
-Joyful Team
-        """.strip()
-        
-        # HTML格式邮件正文
-        html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Joyful Registration Verification</title>
-    <style>
-        body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-        .content {{ background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }}
-        .code {{ background: #fff; border: 2px dashed #667eea; padding: 20px; text-align: center; margin: 20px 0; border-radius: 8px; }}
-        .code-number {{ font-size: 32px; font-weight: bold; color: #667eea; letter-spacing: 8px; }}
-        .footer {{ text-align: center; color: #666; margin-top: 20px; font-size: 14px; }}
-        .warning {{ background: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🎨 Joyful Platform</h1>
-            <h2>Registration Verification</h2>
-        </div>
-        <div class="content">
-            <p>Hello!</p>
-            <p>You are registering for a <strong>Joyful</strong> platform account.</p>
-            
-            <div class="code">
-                <p>Your verification code is:</p>
-                <div class="code-number">{verification_code}</div>
-            </div>
-            
-            <div class="warning">
-                <p><strong>⚠️ Important:</strong></p>
-                <ul>
-                    <li>This code will expire in <strong>{self.code_expiry_minutes} minutes</strong></li>
-                    <li>Please do not share this code with anyone</li>
-                    <li>If you did not request this verification, please ignore this email</li>
-                </ul>
-            </div>
-            
-            <p>Thank you for choosing Joyful!</p>
-            
-            <div class="footer">
-                <p>Best regards,<br><strong>Joyful Team</strong></p>
-                <p><small>This is an automated email. Please do not reply to this message.</small></p>
-            </div>
-        </div>
-    </div>
-</body>
-</html>
-        """.strip()
-        
-        return text_content, html_content
+        """创建邮件内容，返回 (纯文本正文, HTML正文)"""
+        return self.email_template.render(verification_code)
     
     def send_verification_email(self, to_email, verification_code):
         """发送验证邮件"""
         try:
-            # 创建邮件
-            msg = MIMEMultipart("alternative")
-            msg["Subject"] = "Joyful Registration Service - Verification Code"
-            msg["From"] = f"Joyful System <{self.username}>"
-            msg["To"] = to_email
-            
-            # 创建邮件内容
-            text_content, html_content = self.create_email_content(verification_code)
-            
-            # 添加文本和HTML部分
-            text_part = MIMEText(text_content, "plain")
-            html_part = MIMEText(html_content, "html")
-            
-            msg.attach(text_part)
-            msg.attach(html_part)
-            
-            # 创建SSL连接并发送邮件
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(self.smtp_server, self.port, context=context) as server:
-                server.login(self.username, self.password)
-                server.send_message(msg)
-                
-            logger.info(f"验证邮件发送成功: {to_email}")
+            self.deliver_verification_email(to_email, verification_code)
             return True
-            
         except Exception as e:
             logger.error(f"发送验证邮件失败: {to_email}, 错误: {e}")
             return False
     
+    def deliver_verification_email(self, to_email, verification_code):
+        """发送验证邮件，失败时抛出异常（供发送队列重试）"""
+        # 模板已预编译，只替换验证码并拼接预先序列化的 MIME 头部与正文片段
+        data = self.email_template.build_message(to_email, verification_code)
+        
+        # 通过会话池发送邮件
+        self.smtp_pool.sendmail(self.username, [to_email], data)
+        
+        logger.info(f"验证邮件发送成功: {to_email}")
+    
+    def _on_delivery_failed(self, item):
+        """异步发送最终失败：删除对应验证码，允许用户立即重新获取"""
+        self.code_store.delete(item['to_email'], item['message'])
+    
     def can_send_code(self, email):
         """检查是否可以发送验证码（防止频繁发送）"""
-        with self.lock:
-            if email not in self.verification_codes:
-                return True, "可以发送"
-            
-            last_send_time = self.verification_codes[email].get('last_send_time')
-            if last_send_time:
-                time_diff = (datetime.now() - last_send_time).total_seconds()
-                if time_diff < self.send_interval_seconds:
-                    remaining = self.send_interval_seconds - int(time_diff)
-                    return False, f"请等待 {remaining} 秒后再试"
-            
+        code_info = self.code_store.get(email)
+        if not code_info:
             return True, "可以发送"
+        
+        time_diff = time.time() - code_info['last_send_time']
+        if time_diff < self.send_interval_seconds:
+            remaining = self.send_interval_seconds - int(time_diff)
+            return False, f"请等待 {remaining} 秒后再试"
+        
+        return True, "可以发送"
     
-    def send_verification_code(self, email):
-        """发送验证码"""
-        # 检查发送频率限制
-        can_send, message = self.can_send_code(email)
-        if not can_send:
+    def _reserve_code(self, email, verification_code):
+        """检查发送频率并保存验证码（原子操作），返回失败结果或 None"""
+        try:
+            saved, remaining = self.code_store.put_code(
+                email, verification_code,
+                self.code_expiry_minutes * 60, self.send_interval_seconds
+            )
+        except Exception as e:
+            logger.error(f"保存验证码失败: {email}, 错误: {e}")
             return {
                 'success': False,
-                'message': message,
+                'message': 'Failed to send verification email',
+                'code': 'SEND_FAILED'
+            }
+        
+        if not saved:
+            return {
+                'success': False,
+                'message': f"请等待 {remaining} 秒后再试",
                 'code': 'RATE_LIMITED'
             }
+        return None
+    
+    def send_verification_code(self, email):
+        """发送验证码"""
+        self.code_expirer.start()
         
         # 生成验证码
         verification_code = self.generate_verification_code()
         
+        # 检查发送频率限制并保存验证码
+        failure = self._reserve_code(email, verification_code)
+        if failure:
+            return failure
+        
+        if self.async_delivery:
+            return self._queue_verification_code(email, verification_code)
+        
         # 发送邮件
         if self.send_verification_email(email, verification_code):
-            # 保存验证码信息
-            with self.lock:
-                self.verification_codes[email] = {
-                    'code': verification_code,
-                    'expires_at': datetime.now() + timedelta(minutes=self.code_expiry_minutes),
-                    'attempts': 0,
-                    'last_send_time': datetime.now()
-                }
-            
             logger.info(f"验证码已发送: {email}, 验证码: {verification_code}")
             
             return {
@@ -194,101 +179,91 @@ Joyful Team
                 'expires_in_minutes': self.code_expiry_minutes
             }
         else:
+            self.code_store.delete(email, verification_code)
             return {
                 'success': False,
                 'message': 'Failed to send verification email',
                 'code': 'SEND_FAILED'
             }
     
+    def _queue_verification_code(self, email, verification_code):
+        """将已保存验证码的邮件放入发送队列"""
+        if not self.dispatch_queue.enqueue(email, verification_code):
+            self.code_store.delete(email, verification_code)
+            logger.error(f"邮件发送队列已满: {email}")
+            return {
+                'success': False,
+                'message': 'Email service is busy, please try again later',
+                'code': 'SEND_FAILED'
+            }
+        
+        logger.info(f"验证码已入队发送: {email}")
+        
+        return {
+            'success': True,
+            'message': f'Verification code sent to {email}',
+            'expires_in_minutes': self.code_expiry_minutes
+        }
+    
     def verify_code(self, email, input_code):
         """验证验证码"""
-        with self.lock:
-            if email not in self.verification_codes:
-                return {
-                    'success': False,
-                    'message': 'No verification code found for this email',
-                    'code': 'CODE_NOT_FOUND'
-                }
-            
-            code_info = self.verification_codes[email]
-            
-            # 检查是否过期
-            if datetime.now() > code_info['expires_at']:
-                del self.verification_codes[email]
-                return {
-                    'success': False,
-                    'message': 'Verification code has expired',
-                    'code': 'CODE_EXPIRED'
-                }
-            
-            # 检查尝试次数
-            if code_info['attempts'] >= self.max_attempts:
-                del self.verification_codes[email]
-                return {
-                    'success': False,
-                    'message': f'Too many failed attempts. Please request a new code.',
-                    'code': 'TOO_MANY_ATTEMPTS'
-                }
-            
-            # 验证码校验
-            if input_code == code_info['code']:
-                # 验证成功，删除验证码
-                del self.verification_codes[email]
-                logger.info(f"验证码验证成功: {email}")
-                return {
-                    'success': True,
-                    'message': 'Verification successful'
-                }
-            else:
-                # 验证失败，增加尝试次数
-                code_info['attempts'] += 1
-                remaining_attempts = self.max_attempts - code_info['attempts']
-                
-                logger.warning(f"验证码验证失败: {email}, 剩余尝试次数: {remaining_attempts}")
-                
-                return {
-                    'success': False,
-                    'message': f'Invalid verification code. {remaining_attempts} attempts remaining.',
-                    'code': 'INVALID_CODE',
-                    'remaining_attempts': remaining_attempts
-                }
+        status, remaining_attempts = self.code_store.verify(email, input_code, self.max_attempts)
+        
+        if status == VERIFY_NOT_FOUND:
+            return {
+                'success': False,
+                'message': 'No verification code found for this email',
+                'code': 'CODE_NOT_FOUND'
+            }
+        
+        if status == VERIFY_EXPIRED:
+            return {
+                'success': False,
+                'message': 'Verification code has expired',
+                'code': 'CODE_EXPIRED'
+            }
+        
+        if status == VERIFY_TOO_MANY_ATTEMPTS:
+            return {
+                'success': False,
+                'message': f'Too many failed attempts. Please request a new code.',
+                'code': 'TOO_MANY_ATTEMPTS'
+            }
+        
+        if status == VERIFY_OK:
+            logger.info(f"验证码验证成功: {email}")
+            return {
+                'success': True,
+                'message': 'Verification successful'
+            }
+        
+        logger.warning(f"验证码验证失败: {email}, 剩余尝试次数: {remaining_attempts}")
+        
+        return {
+            'success': False,
+            'message': f'Invalid verification code. {remaining_attempts} attempts remaining.',
+            'code': 'INVALID_CODE',
+            'remaining_attempts': remaining_attempts
+        }
     
     def cleanup_expired_codes(self):
         """清理过期的验证码（可以定期调用）"""
-        with self.lock:
-            current_time = datetime.now()
-            expired_emails = [
-                email for email, info in self.verification_codes.items()
-                if current_time > info['expires_at']
-            ]
-            
-            for email in expired_emails:
-                del self.verification_codes[email]
-            
-            if expired_emails:
-                logger.info(f"清理了 {len(expired_emails)} 个过期验证码")
+        removed = self.code_store.cleanup_expired()
+        if removed:
+            logger.info(f"清理了 {removed} 个过期验证码")
+        return removed
     
     def get_verification_status(self, email):
         """获取验证码状态"""
-        with self.lock:
-            if email not in self.verification_codes:
-                return None
-            
-            code_info = self.verification_codes[email]
-            current_time = datetime.now()
-            
-            if current_time > code_info['expires_at']:
-                del self.verification_codes[email]
-                return None
-            
-            remaining_seconds = int((code_info['expires_at'] - current_time).total_seconds())
-            
-            return {
-                'exists': True,
-                'expires_in_seconds': remaining_seconds,
-                'attempts_used': code_info['attempts'],
-                'max_attempts': self.max_attempts
-            }
-
-# 全局邮箱验证服务实例
-email_service = EmailVerificationService()
+        code_info = self.code_store.get(email)
+        if not code_info:
+            return None
+        
+        remaining_seconds = int(code_info['expires_at'] - time.time())
+        
+        return {
+            'exists': True,
+            'expires_in_seconds': remaining_seconds,
+            'attempts_used': code_info['attempts'],
+            'max_attempts': self.max_attempts
+        }
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+图片生成任务队列模块
+提供有界任务队列、后台工作线程池和按用户轮转的公平调度；
+生成器提供异步流水线时，由单个调度线程提交任务，等待上游期间不占用线程
+"""
+
+import time
+import uuid
+import threading
+from collections import deque, OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """任务队列已满或用户排队任务过多"""
+    pass
+
+
+class GenerationJobQueue:
+    """图片生成任务队列"""
+
+    def __init__(self, generator, workers=4, max_queue_size=100,
+                 max_jobs_per_user=3, job_ttl_seconds=600, max_inflight=200):
+        self.generator = generator
+        self.workers = workers  # 工作线程数，即同时进行的上游生成任务数（同步模式）
+        # 异步模式：一个调度线程提交到生成器的事件循环，同时进行的任务数上限为 max_inflight
+        self.async_dispatch = getattr(generator, 'async_pipeline', None) is not None
+        self.max_inflight = max_inflight
+        self.dispatched = 0
+        self.max_queue_size = max_queue_size  # 排队任务上限，超出返回 429
+        self.max_jobs_per_user = max_jobs_per_user  # 单个用户排队+执行中的任务上限
+        self.job_ttl_seconds = job_ttl_seconds  # 已完成任务结果的保留时间
+
+        # 任务表 {job_id: job}，按创建顺序排列便于过期清理
+        self.jobs = OrderedDict()
+        # 每个用户的排队任务 {user_key: deque[job_id]}
+        self.user_queues = {}
+        # 有排队任务的用户轮转顺序
+        self.user_rotation = deque()
+        # 每个用户未完成的任务数
+        self.user_active = {}
+        self.queued_count = 0
+
+        self.cond = threading.Condition(threading.Lock())
+        self.threads = []
+        self.stopping = False
+
+        # 指标
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'succeeded': 0,
+            'failed': 0
+        }
+
+    def start(self):
+        """启动工作线程（首次提交时自动调用，避免在 fork 前创建线程）"""
+        with self.cond:
+            if self.threads:
+                return
+            self.stopping = False
+            thread_count = 1 if self.async_dispatch else self.workers
+            for i in range(thread_count):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"generation-worker-{i + 1}",
+                    daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+        if self.async_dispatch:
+            logger.info(f"图片生成调度线程已启动，最多同时进行 {self.max_inflight} 个任务")
+        else:
+            logger.info(f"图片生成工作线程已启动: {self.workers} 个")
+
+    def stop(self, timeout=None):
+        """停止工作线程，执行中的任务会继续完成"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            threads = self.threads
+            self.threads = []
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, user_key, prompt, size, n, response_format='url'):
+        """提交生成任务，返回任务快照"""
+        self.start()
+        now = time.time()
+
+        with self.cond:
+            self._expire_jobs_locked(now)
+
+            if self.queued_count >= self.max_queue_size:
+                self.stats['rejected'] += 1
+                raise QueueFullError("生成队列已满，请稍后再试")
+            if self.user_active.get(user_key, 0) >= self.max_jobs_per_user:
+                self.stats['rejected'] += 1
+                raise QueueFullError("您有太多正在进行的生成任务，请稍后再试")
+
+            job_id = uuid.uuid4().hex
+            job = {
+                'job_id': job_id,
+                'user_key': user_key,
+                'prompt': prompt,
+                'size': size,
+                'n': n,
+                'response_format': response_format,
+                'status': 'queued',
+                'task_id': None,
+                'result': None,
+                'error': None,
+                'created_at': now,
+                'started_at': None,
+                'finished_at': None
+            }
+            self.jobs[job_id] = job
+
+            if user_key not in self.user_queues:
+                self.user_queues[user_key] = deque()
+                self.user_rotation.append(user_key)
+            self.user_queues[user_key].append(job_id)
+            self.user_active[user_key] = self.user_active.get(user_key, 0) + 1
+            self.queued_count += 1
+            self.stats['submitted'] += 1
+
+            self.cond.notify()
+            return self._snapshot_locked(job)
+
+    def get_job(self, job_id):
+        """获取任务快照，不存在或已过期时返回 None"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if not job:
+                return None
+            return self._snapshot_locked(job)
+
+    def _snapshot_locked(self, job):
+        """生成对外返回的任务信息，需持有锁"""
+        snapshot = {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'task_id': job['task_id']
+        }
+        if job['status'] == 'queued':
+            snapshot['queue_position'] = self._queue_position_locked(job)
+        if job['result'] is not None:
+            snapshot['result'] = job['result']
+        if job['error'] is not None:
+            snapshot['error'] = job['error']
+        return snapshot
+
+    def _queue_position_locked(self, job):
+        """按轮转顺序计算排队位置（从 1 开始），需持有锁"""
+        user_key = job['user_key']
+        user_queue = self.user_queues.get(user_key)
+        if not user_queue:
+            return 0
+        rounds = user_queue.index(job['job_id'])
+        ahead = rounds
+        before_user = True
+        for other_key in self.user_rotation:
+            if other_key == user_key:
+                before_user = False
+                continue
+            pending = len(self.user_queues[other_key])
+            ahead += min(pending, rounds + 1 if before_user else rounds)
+        return ahead + 1
+
+    def _next_job_locked(self):
+        """按用户轮转取出下一个任务，需持有锁"""
+        while self.user_rotation:
+            user_key = self.user_rotation.popleft()
+            user_queue = self.user_queues[user_key]
+            job_id = user_queue.popleft()
+            if user_queue:
+                self.user_rotation.append(user_key)
+            else:
+                del self.user_queues[user_key]
+            self.queued_count -= 1
+            return self.jobs.get(job_id)
+        return None
+
+    def _expire_jobs_locked(self, now):
+        """清理已完成且超过保留时间的任务，需持有锁"""
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job['finished_at'] and now - job['finished_at'] > self.job_ttl_seconds
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _worker_loop(self):
+        """工作线程主循环"""
+        while True:
+            with self.cond:
+                while not self.stopping and (not self.user_rotation or self._dispatch_full_locked()):
+                    self.cond.wait()
+                if self.stopping:
+                    return
+                job = self._next_job_locked()
+                if job is None:
+                    continue
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                if self.async_dispatch:
+                    self.dispatched += 1
+
+            if self.async_dispatch:
+                self._dispatch_job(job)
+            else:
+                self._run_job(job)
+
+    def _dispatch_full_locked(self):
+        """异步模式下进行中的任务是否已达上限，需持有锁"""
+        return self.async_dispatch and self.dispatched >= self.max_inflight
+
+    def _task_created_callback(self, job):
+        """上游任务创建后记录 task_id 的回调"""
+        def on_task_created(task_id):
+            with self.cond:
+                job['task_id'] = task_id
+        return on_task_created
+
+    def _run_job(self, job):
+        """在工作线程中执行单个生成任务"""
+        result = None
+        error = None
+        try:
+            result = self.generator.generate(
+                job['prompt'], job['size'], job['n'],
+                job['response_format'], self._task_created_callback(job)
+            )
+        except Exception as e:
+            logger.exception(f"生成任务执行异常: {job['job_id']}")
+            error = f"生成任务执行异常: {str(e)}"
+        self._finish_job(job, result, error)
+
+    def _dispatch_job(self, job):
+        """把生成任务提交到生成器的事件循环，完成后在回调中结束任务"""
+        try:
+            future = self.generator.generate_future(
+                job['prompt'], job['size'], job['n'],
+                job['response_format'], self._task_created_callback(job)
+            )
+        except Exception as e:
+            logger.exception(f"生成任务提交异常: {job['job_id']}")
+            self._on_dispatched_done(job, None, f"生成任务提交异常: {str(e)}")
+            return
+
+        def on_done(future):
+            try:
+                self._on_dispatched_done(job, future.result(), None)
+            except Exception as e:
+                logger.error(f"生成任务执行异常: {job['job_id']}: {e}")
+                self._on_dispatched_done(job, None, f"生成任务执行异常: {str(e)}")
+
+        future.add_done_callback(on_done)
+
+    def _on_dispatched_done(self, job, result, error):
+        """异步任务结束，释放进行中的名额"""
+        self._finish_job(job, result, error)
+        with self.cond:
+            self.dispatched -= 1
+            self.cond.notify()
+
+    def _finish_job(self, job, result, error):
+        """记录任务结果"""
+        if error is None and not result.get('success'):
+            error = result.get('error', '图片生成失败')
+
+        with self.cond:
+            job['finished_at'] = time.time()
+            user_key = job['user_key']
+            self.user_active[user_key] -= 1
+            if self.user_active[user_key] <= 0:
+                del self.user_active[user_key]
+            if error is None:
+                job['status'] = 'succeeded'
+                job['result'] = result
+                self.stats['succeeded'] += 1
+            else:
+                job['status'] = 'failed'
+                job['error'] = error
+                self.stats['failed'] += 1
+            # 结果已在任务表中，释放提示词等请求数据
+            job['prompt'] = None
+
+        duration = job['finished_at'] - job['started_at']
+        logger.info(f"生成任务结束: {job['job_id']}, 状态: {job['status']}, 耗时: {duration:.2f} 秒")
+
+    def get_stats(self):
+        """获取队列指标"""
+        with self.cond:
+            running = sum(1 for job in self.jobs.values() if job['status'] == 'running')
+            return {
+                'workers': 1 if self.async_dispatch else self.workers,
+                'async_dispatch': self.async_dispatch,
+                'max_inflight': self.max_inflight if self.async_dispatch else None,
+                'queued': self.queued_count,
+                'running': running,
+                'max_queue_size': self.max_queue_size,
+                'active_users': len(self.user_active),
+                **self.stats
+            }
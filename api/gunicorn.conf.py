@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+gunicorn 生产服务配置
+监听地址、工作进程、线程、keep-alive 与优雅退出时间均从环境变量读取
+"""
+
+import os
+
+# 监听地址，与 app.py 的 API_HOST / API_PORT 一致
+bind = f"{os.getenv('API_HOST', '0.0.0.0')}:{int(os.getenv('API_PORT', 81))}"
+
+# 多线程工作进程：生成任务大部分时间在等待上游接口，线程比进程更省内存
+worker_class = 'gthread'
+# 工作进程数。生成任务表与验证码（默认 memory 存储）都在进程内，建议保持 1 个进程、用 API_THREADS 扩展并发；
+# 多于 1 个进程时启动检查见 on_starting
+workers = int(os.getenv('API_WORKERS', 1))
+threads = int(os.getenv('API_THREADS', 16))
+
+# 连接与超时
+keepalive = int(os.getenv('API_KEEPALIVE', 5))  # keep-alive 连接空闲保持时间（秒）
+timeout = int(os.getenv('API_TIMEOUT', 120))  # 工作进程无响应超过该时间会被重启（秒）
+graceful_timeout = int(os.getenv('API_GRACEFUL_TIMEOUT', 30))  # 收到退出信号后等待处理中请求的时间（秒）
+
+# 预加载：迁移检查、连接池与缓存等模块初始化只在主进程执行一次，工作进程 fork 后共享；
+# 未设置 JWT_SECRET_KEY 时随机生成的密钥也因此在所有工作进程中一致。
+# 后台线程均在首次使用时才启动，不会在 fork 前创建
+preload_app = os.getenv('API_PRELOAD', 'True').lower() in ('true', '1', 'yes')
+
+# 日志输出到标准输出，由容器收集
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'INFO').lower()
+
+
+def on_starting(server):
+    """多进程启动检查：验证码使用进程内存储时拒绝启动；生成任务表等无法跨进程共享的状态输出醒目警告"""
+    if workers <= 1:
+        return
+    if os.getenv('VERIFICATION_CODE_STORE', 'memory').lower() == 'memory':
+        raise RuntimeError(
+            f"API_WORKERS={workers} 时不能使用进程内验证码存储：在一个进程发送的验证码，在其他进程校验时不存在。"
+            "请设置 VERIFICATION_CODE_STORE=sqlite/mysql/redis，或使用 API_WORKERS=1 并调大 API_THREADS"
+        )
+    server.log.error(
+        f"API_WORKERS={workers}：生成任务表只保存在创建任务的工作进程内，"
+        "落到其他进程的 /api/status/<job_id> 轮询会返回 404（任务不存在），单用户排队上限也按进程计算。"
+        "除非不使用图片生成，请改用 API_WORKERS=1 并调大 API_THREADS"
+    )
+    if os.getenv('RATE_LIMIT_BACKEND', 'local').lower() == 'local':
+        server.log.warning(
+            f"API_WORKERS={workers}：限流使用进程内令牌桶，实际限额为配置值的 {workers} 倍，请设置 RATE_LIMIT_BACKEND=redis"
+        )
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+生成图片存储模块
+保存生成结果的原始字节，通过短ID供 /api/images/<id> 读取
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import mimetypes
+import threading
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def compute_image_id(data):
+    """计算图片ID（内容的 sha256）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_valid_image_id(image_id):
+    """校验图片ID格式，防止路径穿越"""
+    return len(image_id) == 64 and all(c in '0123456789abcdef' for c in image_id)
+
+
+class ImageStore:
+    """内存图片存储，按内容 sha256 寻址，超出容量时淘汰最久未访问的图片"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes  # 存储容量上限（字节）
+
+        # {image_id: (data, content_type)}，按访问顺序排列
+        self.images = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        # 指标
+        self.stats = {
+            'stored': 0,
+            'hits': 0,
+            'misses': 0,
+            'evicted': 0
+        }
+
+    @staticmethod
+    def compute_id(data):
+        """计算图片ID（内容的 sha256）"""
+        return compute_image_id(data)
+
+    def put(self, data, content_type='image/png'):
+        """保存图片并返回图片ID，相同内容只保存一份"""
+        image_id = self.compute_id(data)
+
+        with self.lock:
+            if image_id in self.images:
+                self.images.move_to_end(image_id)
+                return image_id
+
+            self.images[image_id] = (data, content_type)
+            self.total_bytes += len(data)
+            self.stats['stored'] += 1
+
+            # 淘汰最久未访问的图片
+            while self.total_bytes > self.max_bytes and len(self.images) > 1:
+                _, (evicted_data, _) = self.images.popitem(last=False)
+                self.total_bytes -= len(evicted_data)
+                self.stats['evicted'] += 1
+
+        return image_id
+
+    def get(self, image_id):
+        """读取图片，返回 {'data', 'path', 'content_type', 'size'}，不存在时返回 None"""
+        with self.lock:
+            entry = self.images.get(image_id)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.images.move_to_end(image_id)
+            self.stats['hits'] += 1
+            data, content_type = entry
+            return {
+                'data': data,
+                'path': None,
+                'content_type': content_type,
+                'size': len(data)
+            }
+
+    def get_stats(self):
+        """获取存储指标"""
+        with self.lock:
+            return {
+                'backend': 'memory',
+                'images': len(self.images),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                **self.stats
+            }
+
+
+class DiskImageStore:
+    """磁盘图片存储
+
+    按内容 sha256 寻址，文件位于 <root>/<id[0:2]>/<id[2:4]>/<id>.<ext>。
+    写入先落临时文件再原子重命名；读取只返回文件路径，由 send_file 走 sendfile 发送。
+    超出容量或超过 TTL 未访问的图片按 LRU 淘汰。
+    """
+
+    # 访问时间写回文件 mtime 的最小间隔（秒），重启后据此恢复 LRU 顺序
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, root_dir, max_bytes=1024 * 1024 * 1024, ttl_seconds=72 * 3600):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes  # 存储容量上限（字节）
+        self.ttl_seconds = ttl_seconds  # 超过该时间未访问的图片被淘汰
+
+        # LRU 索引 {image_id: {'path', 'size', 'last_access', 'touched_at'}}，按访问顺序排列
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        # 指标
+        self.stats = {
+            'stored': 0,
+            'deduplicated': 0,
+            'hits': 0,
+            'misses': 0,
+            'evicted_size': 0,
+            'evicted_ttl': 0
+        }
+
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._load_index()
+
+    def _shard_dir(self, image_id):
+        """图片所在的分片目录"""
+        return os.path.join(self.root_dir, image_id[0:2], image_id[2:4])
+
+    def _load_index(self):
+        """启动时扫描目录重建 LRU 索引"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root_dir):
+            for filename in filenames:
+                image_id, ext = os.path.splitext(filename)
+                path = os.path.join(dirpath, filename)
+                if not is_valid_image_id(image_id):
+                    # 清理上次异常退出留下的临时文件
+                    if filename.startswith('.tmp-'):
+                        try:
+                            os.unlink(path)
+                        except OSError:
+                            pass
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, image_id, path, st.st_size))
+
+        entries.sort()
+        for mtime, image_id, path, size in entries:
+            self.index[image_id] = {
+                'path': path,
+                'size': size,
+                'last_access': mtime,
+                'touched_at': mtime
+            }
+            self.total_bytes += size
+
+        if entries:
+            logger.info(f"图片存储索引已加载: {len(entries)} 张, {self.total_bytes} 字节")
+
+        self._evict_locked(time.time())
+
+    def _remove_locked(self, image_id):
+        """删除图片文件与索引项，需持有锁"""
+        entry = self.index.pop(image_id)
+        self.total_bytes -= entry['size']
+        try:
+            os.unlink(entry['path'])
+        except OSError:
+            pass
+
+    def _evict_locked(self, now):
+        """从 LRU 头部淘汰过期和超出容量的图片，需持有锁"""
+        while self.index:
+            image_id, entry = next(iter(self.index.items()))
+            if now - entry['last_access'] > self.ttl_seconds:
+                self.stats['evicted_ttl'] += 1
+            elif self.total_bytes > self.max_bytes and len(self.index) > 1:
+                self.stats['evicted_size'] += 1
+            else:
+                break
+            self._remove_locked(image_id)
+
+    def _adopt_locked(self, image_id):
+        """收录其他进程写入的图片文件，需持有锁"""
+        shard_dir = self._shard_dir(image_id)
+        try:
+            filenames = os.listdir(shard_dir)
+        except OSError:
+            return None
+        for filename in filenames:
+            if filename.startswith(image_id):
+                path = os.path.join(shard_dir, filename)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                now = time.time()
+                entry = {'path': path, 'size': size, 'last_access': now, 'touched_at': now}
+                self.index[image_id] = entry
+                self.total_bytes += size
+                return entry
+        return None
+
+    def put(self, data, content_type='image/png'):
+        """保存图片并返回图片ID，相同内容只保存一份"""
+        image_id = compute_image_id(data)
+        now = time.time()
+
+        with self.lock:
+            entry = self.index.get(image_id) or self._adopt_locked(image_id)
+            if entry is not None:
+                entry['last_access'] = now
+                self.index.move_to_end(image_id)
+                self.stats['deduplicated'] += 1
+                return image_id
+
+        ext = mimetypes.guess_extension(content_type) or '.bin'
+        shard_dir = self._shard_dir(image_id)
+        path = os.path.join(shard_dir, image_id + ext)
+        os.makedirs(shard_dir, exist_ok=True)
+
+        # 原子写入：先写同目录临时文件，再重命名
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=shard_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            if image_id not in self.index:
+                self.index[image_id] = {
+                    'path': path,
+                    'size': len(data),
+                    'last_access': now,
+                    'touched_at': now
+                }
+                self.total_bytes += len(data)
+                self.stats['stored'] += 1
+            self.index.move_to_end(image_id)
+            self._evict_locked(now)
+
+        return image_id
+
+    def get(self, image_id):
+        """读取图片，返回 {'data', 'path', 'content_type', 'size'}，不存在时返回 None"""
+        if not is_valid_image_id(image_id):
+            return None
+
+        now = time.time()
+        touch_path = None
+
+        with self.lock:
+            entry = self.index.get(image_id) or self._adopt_locked(image_id)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            if now - entry['last_access'] > self.ttl_seconds:
+                self._remove_locked(image_id)
+                self.stats['evicted_ttl'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            entry['last_access'] = now
+            self.index.move_to_end(image_id)
+            if now - entry['touched_at'] > self.TOUCH_INTERVAL:
+                entry['touched_at'] = now
+                touch_path = entry['path']
+            self.stats['hits'] += 1
+            path = entry['path']
+            size = entry['size']
+
+        if touch_path:
+            try:
+                os.utime(touch_path, (now, now))
+            except OSError:
+                pass
+
+        if not os.path.exists(path):
+            # 文件已被其他进程淘汰
+            with self.lock:
+                if image_id in self.index:
+                    entry = self.index.pop(image_id)
+                    self.total_bytes -= entry['size']
+            return None
+
+        return {
+            'data': None,
+            'path': path,
+            'content_type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'size': size
+        }
+
+    def get_stats(self):
+        """获取存储指标"""
+        with self.lock:
+            return {
+                'backend': 'disk',
+                'images': len(self.index),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                **self.stats
+            }
@@ -30,7 +30,7 @@ def migrate(args):
     mysql_config = load_mysql_config()
     migration_manager = DatabaseMigration(mysql_config)
     
-    success = migration_manager.run_migrations()
+    success = migration_manager.run_migrations(force=getattr(args, 'force', False))
     if success:
         print("✅ 数据库迁移完成")
     else:
@@ -46,7 +46,6 @@ def status(args):
     
     try:
         executed_migrations = migration_manager.get_executed_migrations()
-        available_migrations = migration_manager.get_available_migrations()
         
         print(f"\n已执行的迁移 ({len(executed_migrations)}):")
         if executed_migrations:
@@ -55,10 +54,7 @@ def status(args):
         else:
             print("  (无)")
         
-        pending_migrations = [
-            m for m in available_migrations 
-            if m['version'] not in executed_migrations
-        ]
+        pending_migrations = migration_manager.get_pending_migrations(executed_migrations)
         
         print(f"\n待执行的迁移 ({len(pending_migrations)}):")
         if pending_migrations:
@@ -168,6 +164,7 @@ def main():
     
     # migrate命令
     migrate_parser = subparsers.add_parser('migrate', help='运行数据库迁移')
+    migrate_parser.add_argument('--force', action='store_true', help='忽略迁移目录校验和，逐个比对版本')
     
     # status命令
     status_parser = subparsers.add_parser('status', help='显示迁移状态')
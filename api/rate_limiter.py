@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+令牌桶限流模块
+按客户端IP、邮箱域名与全局维度限制请求频率，桶状态可放在进程内或 Redis 中共享
+"""
+
+import time
+import threading
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate(spec):
+    """解析 "次数/秒数" 格式的限流配置，返回 (桶容量, 每秒补充令牌数)；空值或 0 表示不限流"""
+    spec = (spec or '').strip()
+    if not spec or spec == '0':
+        return None
+    count, _, period = spec.partition('/')
+    capacity = float(count)
+    seconds = float(period) if period else 1.0
+    if capacity <= 0 or seconds <= 0:
+        raise ValueError(f"无效的限流配置: {spec}")
+    return capacity, capacity / seconds
+
+
+class LocalBucketBackend:
+    """进程内令牌桶后端，超出 max_keys 时淘汰最久未访问的桶"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys  # 最多保留的桶数量，限制内存占用
+        # {key: [tokens, updated_at]}，按访问顺序排列
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        """尝试从桶中取出 cost 个令牌，返回 (是否允许, 需等待秒数)"""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = [capacity, now]
+                self.buckets[key] = bucket
+                # 被淘汰的桶相当于已补满，只会放宽而不会误拒
+                while len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            return False, (cost - bucket[0]) / refill_rate
+
+    def size(self):
+        with self.lock:
+            return len(self.buckets)
+
+
+class RedisBucketBackend:
+    """Redis 令牌桶后端，多个工作进程共享同一组桶；桶在补满所需时间后自动过期"""
+
+    # KEYS[1]=桶键；ARGV=容量, 每秒补充令牌数, 消耗令牌数。使用 Redis 服务器时间，避免各主机时钟不一致
+    CONSUME_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + (now - tonumber(state[2])) * rate)
+end
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+    def __init__(self, redis_url, key_prefix='joyful:ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError("使用 Redis 限流后端需要安装 redis: pip install redis")
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+        self.key_prefix = key_prefix
+        self.consume_script = self.client.register_script(self.CONSUME_SCRIPT)
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        allowed, retry_after = self.consume_script(
+            keys=[self.key_prefix + key], args=[capacity, refill_rate, cost]
+        )
+        return bool(int(allowed)), float(retry_after)
+
+    def size(self):
+        return None
+
+
+class RateLimitRejection:
+    """限流拒绝信息"""
+
+    def __init__(self, rule, retry_after):
+        self.rule = rule  # 触发限流的规则名
+        self.retry_after = retry_after  # 建议等待秒数
+
+    @property
+    def retry_after_seconds(self):
+        return max(1, int(self.retry_after + 0.999))
+
+
+class RateLimiter:
+    """多维度令牌桶限流器，后端异常时放行请求（不因限流组件故障拒绝服务）"""
+
+    def __init__(self, backend, rules):
+        self.backend = backend
+        # {规则名: (桶容量, 每秒补充令牌数)}，值为 None 的规则不生效
+        self.rules = {name: rate for name, rate in rules.items() if rate}
+        self.lock = threading.Lock()
+
+        # 指标
+        self.stats = {
+            'allowed': 0,
+            'rejected': 0,
+            'errors': 0
+        }
+        self.rejected_by_rule = {name: 0 for name in self.rules}
+
+    def check(self, checks):
+        """依次检查 [(规则名, 桶标识)]，全部通过返回 None，否则返回 RateLimitRejection
+
+        应把范围最小的规则放在前面：被单个IP拒绝的请求不会消耗域名与全局桶的令牌。
+        """
+        for rule, key in checks:
+            rate = self.rules.get(rule)
+            if rate is None or not key:
+                continue
+            capacity, refill_rate = rate
+            try:
+                allowed, retry_after = self.backend.consume(f"{rule}:{key}", capacity, refill_rate)
+            except Exception as e:
+                logger.warning(f"限流检查失败，放行请求: {e}")
+                with self.lock:
+                    self.stats['errors'] += 1
+                continue
+            if not allowed:
+                with self.lock:
+                    self.stats['rejected'] += 1
+                    self.rejected_by_rule[rule] += 1
+                return RateLimitRejection(rule, retry_after)
+
+        with self.lock:
+            self.stats['allowed'] += 1
+        return None
+
+    def get_stats(self):
+        """获取限流指标"""
+        with self.lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'buckets': self.backend.size(),
+                'evictions': getattr(self.backend, 'evictions', None),
+                'rejected_by_rule': dict(self.rejected_by_rule),
+                **self.stats
+            }
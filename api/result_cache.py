@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+生成结果缓存模块
+相同提示词、尺寸、数量和模型的请求直接返回已生成的结果，不再调用上游
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt):
+    """规范化提示词：Unicode NFC 并合并空白"""
+    return ' '.join(unicodedata.normalize('NFC', prompt).split())
+
+
+def make_cache_key(prompt, size, n, model):
+    """根据规范化的请求参数生成缓存键"""
+    raw = json.dumps([model, normalize_prompt(prompt), size, n], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """两级结果缓存：进程内 LRU 内存层 + SQLite 持久层（多进程共享）"""
+
+    def __init__(self, ttl_seconds=86400, max_memory_items=1000, db_path=None):
+        self.ttl_seconds = ttl_seconds  # 缓存有效期（秒）
+        self.max_memory_items = max_memory_items  # 内存层最大条目数
+        self.db_path = db_path  # 持久层 SQLite 文件，为空时只使用内存层
+
+        # 内存层 {key: (expires_at, value)}，按访问顺序排列
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        # 指标
+        self.stats = {
+            'memory_hits': 0,
+            'persistent_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'errors': 0
+        }
+
+        if self.db_path:
+            self._init_db()
+
+    def _get_db(self):
+        """每个线程使用独立的 SQLite 连接"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+    def _init_db(self):
+        """初始化持久层表结构"""
+        conn = self._get_db()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS result_cache (
+                cache_key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('DELETE FROM result_cache WHERE expires_at < ?', (time.time(),))
+        conn.commit()
+
+    def _memory_set_locked(self, key, expires_at, value):
+        """写入内存层并按 LRU 淘汰，需持有锁"""
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """读取缓存，未命中或已过期时返回 None"""
+        now = time.time()
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return value
+                del self.memory[key]
+
+        if self.db_path:
+            try:
+                row = self._get_db().execute(
+                    'SELECT value, expires_at FROM result_cache WHERE cache_key = ? AND expires_at > ?',
+                    (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"读取结果缓存失败: {e}")
+                row = None
+                with self.lock:
+                    self.stats['errors'] += 1
+
+            if row:
+                value = json.loads(row[0])
+                with self.lock:
+                    self._memory_set_locked(key, row[1], value)
+                    self.stats['persistent_hits'] += 1
+                return value
+
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, key, value):
+        """写入缓存"""
+        expires_at = time.time() + self.ttl_seconds
+
+        with self.lock:
+            self._memory_set_locked(key, expires_at, value)
+            self.stats['stores'] += 1
+
+        if self.db_path:
+            try:
+                conn = self._get_db()
+                conn.execute(
+                    'REPLACE INTO result_cache (cache_key, value, expires_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"写入结果缓存失败: {e}")
+                with self.lock:
+                    self.stats['errors'] += 1
+
+    def delete(self, key):
+        """删除缓存条目"""
+        with self.lock:
+            self.memory.pop(key, None)
+        if self.db_path:
+            try:
+                conn = self._get_db()
+                conn.execute('DELETE FROM result_cache WHERE cache_key = ?', (key,))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"删除结果缓存失败: {e}")
+
+    def get_stats(self):
+        """获取缓存指标"""
+        with self.lock:
+            hits = self.stats['memory_hits'] + self.stats['persistent_hits']
+            total = hits + self.stats['misses']
+            return {
+                'memory_items': len(self.memory),
+                'persistent': bool(self.db_path),
+                'hit_rate': round(hits / total, 4) if total else 0.0,
+                **self.stats
+            }
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+并发请求合并模块
+相同键的并发调用只执行一次，其余调用等待并共享同一结果
+"""
+
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """一次进行中的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """单飞（single-flight）调用合并"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+        # 指标
+        self.stats = {
+            'executed': 0,
+            'coalesced': 0
+        }
+
+    def do(self, key, fn):
+        """执行 fn()，同一 key 已有进行中的调用时等待其结果
+
+        返回 (result, shared)，shared 表示结果来自其他调用者发起的执行。
+        执行者抛出的异常会传递给所有等待者。
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                self.stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            if call.waiters:
+                logger.info(f"合并了 {call.waiters} 个相同的并发请求")
+            call.done.set()
+
+        return call.result, False
+
+    def get_stats(self):
+        """获取合并指标"""
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                **self.stats
+            }
+
+
+class AsyncSingleFlight:
+    """协程版单飞调用合并，只能在同一个事件循环中使用"""
+
+    def __init__(self):
+        # {key: asyncio.Task}，任务结束时自动移除
+        self.calls = {}
+
+        # 指标
+        self.stats = {
+            'executed': 0,
+            'coalesced': 0
+        }
+
+    async def do(self, key, coro_fn):
+        """执行 await coro_fn()，同一 key 已有进行中的调用时等待其结果
+
+        返回 (result, shared)。调用者被取消不会取消共享的上游执行。
+        """
+        task = self.calls.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(coro_fn())
+        self.calls[key] = task
+        self.stats['executed'] += 1
+        task.add_done_callback(lambda _: self.calls.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def get_stats(self):
+        """获取合并指标"""
+        return {
+            'in_flight': len(self.calls),
+            **self.stats
+        }
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+SMTP连接池模块
+保持少量已认证的SMTP会话，跨邮件复用，断线自动重连，空闲时 NOOP 保活
+"""
+
+import ssl
+import time
+import smtplib
+import itertools
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPSession:
+    """一个已认证的SMTP会话及其吞吐指标"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, server):
+        self.id = next(self._ids)
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.send_seconds = 0.0
+        self.failures = 0
+
+    def get_stats(self):
+        age = time.monotonic() - self.created_at
+        return {
+            'id': self.id,
+            'age_seconds': round(age, 1),
+            'idle_seconds': round(time.monotonic() - self.last_used, 1),
+            'messages_sent': self.messages_sent,
+            'bytes_sent': self.bytes_sent,
+            'failures': self.failures,
+            'messages_per_minute': round(self.messages_sent * 60 / age, 2) if age > 0 else 0.0,
+            'avg_send_ms': round(self.send_seconds * 1000 / self.messages_sent, 2) if self.messages_sent else 0.0
+        }
+
+
+class SMTPConnectionPool:
+    """SMTP会话池"""
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=True,
+                 pool_size=2, keepalive_seconds=30, max_idle_seconds=240,
+                 max_messages_per_session=200, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl  # True 使用 SMTP_SSL，False 使用明文 SMTP（本地测试服务器）
+        self.pool_size = pool_size  # 最大会话数
+        self.keepalive_seconds = keepalive_seconds  # 空闲超过该时间的会话借出前先 NOOP
+        self.max_idle_seconds = max_idle_seconds  # 空闲超过该时间的会话直接关闭（服务端通常会主动断开）
+        self.max_messages_per_session = max_messages_per_session  # 单个会话最多发送的邮件数，避免触发服务商限制
+        self.timeout = timeout
+
+        self.idle = []
+        self.sessions = {}  # {session_id: SMTPSession}，包括借出中的会话
+        self.semaphore = threading.BoundedSemaphore(pool_size)
+        self.lock = threading.Lock()
+
+        # 指标
+        self.stats = {
+            'connects': 0,
+            'reconnects': 0,
+            'keepalive_noops': 0,
+            'messages_sent': 0
+        }
+
+    def _connect(self):
+        """建立并认证新的SMTP会话"""
+        if self.use_ssl:
+            context = ssl.create_default_context()
+            server = smtplib.SMTP_SSL(self.host, self.port, context=context, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.username:
+            server.login(self.username, self.password)
+
+        session = SMTPSession(server)
+        with self.lock:
+            self.sessions[session.id] = session
+            self.stats['connects'] += 1
+        logger.info(f"SMTP会话已建立: #{session.id} {self.host}:{self.port}")
+        return session
+
+    def _close(self, session, quit=True):
+        """关闭会话"""
+        with self.lock:
+            self.sessions.pop(session.id, None)
+        try:
+            if quit:
+                session.server.quit()
+            else:
+                session.server.close()
+        except Exception:
+            try:
+                session.server.close()
+            except Exception:
+                pass
+
+    def _acquire(self):
+        """借出一个可用会话，必要时保活或重连"""
+        while True:
+            with self.lock:
+                session = self.idle.pop() if self.idle else None
+            if session is None:
+                return self._connect()
+
+            idle_seconds = time.monotonic() - session.last_used
+            if idle_seconds > self.max_idle_seconds or session.messages_sent >= self.max_messages_per_session:
+                self._close(session)
+                continue
+            if idle_seconds > self.keepalive_seconds:
+                try:
+                    code, _ = session.server.noop()
+                    with self.lock:
+                        self.stats['keepalive_noops'] += 1
+                    if code != 250:
+                        raise smtplib.SMTPServerDisconnected(f"NOOP 返回 {code}")
+                except (smtplib.SMTPException, OSError) as e:
+                    logger.info(f"SMTP会话 #{session.id} 已失效，重新连接: {e}")
+                    self._close(session, quit=False)
+                    continue
+            return session
+
+    def _reset_or_close(self, session):
+        """RSET 成功时归还会话，否则关闭"""
+        try:
+            code, _ = session.server.rset()
+            if code == 250:
+                self._release(session)
+                return
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._close(session, quit=False)
+
+    def _release(self, session):
+        """归还会话"""
+        session.last_used = time.monotonic()
+        with self.lock:
+            self.idle.append(session)
+
+    @staticmethod
+    def _is_stale_session_error(error):
+        """是否为会话已被服务端关闭导致的失败，可重连后重试
+
+        NOOP 保活只在借出时进行，空闲时间未超过 keepalive_seconds 但已超过服务端超时的会话，
+        首次发送会遇到连接断开，或服务端在关闭前返回的 421
+        """
+        if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPHeloError, ConnectionError,
+                              ssl.SSLEOFError, ssl.SSLZeroReturnError)):
+            return True
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return bool(error.recipients) and all(code == 421 for code, _ in error.recipients.values())
+        return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421
+
+    def sendmail(self, from_addr, to_addrs, data):
+        """通过池中的会话发送已序列化的邮件，连接断开时重连并重试一次"""
+        self.semaphore.acquire()
+        try:
+            session = self._acquire()
+            for attempt in range(2):
+                start = time.monotonic()
+                try:
+                    session.server.sendmail(from_addr, to_addrs, data)
+                except Exception as e:
+                    session.failures += 1
+                    if self._is_stale_session_error(e):
+                        self._close(session, quit=False)
+                        if attempt == 1:
+                            raise
+                        logger.info(f"SMTP会话 #{session.id} 已被服务端关闭，重新连接后重试: {e}")
+                        with self.lock:
+                            self.stats['reconnects'] += 1
+                        session = self._connect()
+                        continue
+                    if isinstance(e, smtplib.SMTPRecipientsRefused):
+                        # 收件人全部被拒：smtplib 已发送 RSET，再次 RSET 确认会话正常后归还，否则丢弃
+                        self._reset_or_close(session)
+                    elif isinstance(e, OSError):
+                        # 超时、SSL 错误或事务中途的失败响应（SMTPException 均为 OSError 子类）：会话状态不可靠，直接丢弃
+                        self._close(session, quit=False)
+                    else:
+                        # 其他错误（如邮件内容编码失败）未影响连接：RSET 成功后归还，否则丢弃
+                        self._reset_or_close(session)
+                    raise
+
+                session.send_seconds += time.monotonic() - start
+                session.messages_sent += 1
+                session.bytes_sent += len(data)
+                with self.lock:
+                    self.stats['messages_sent'] += 1
+                self._release(session)
+                return
+        finally:
+            self.semaphore.release()
+
+    def close(self):
+        """关闭所有空闲会话"""
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for session in idle:
+            self._close(session)
+
+    def get_stats(self):
+        """获取连接池与每个会话的吞吐指标"""
+        with self.lock:
+            return {
+                'pool_size': self.pool_size,
+                'idle': len(self.idle),
+                'sessions': [session.get_stats() for session in self.sessions.values()],
+                **self.stats
+            }
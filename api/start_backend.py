@@ -6,6 +6,7 @@
 import os
 import sys
 import subprocess
+import importlib.util
 from pathlib import Path
 
 def load_environment():
@@ -106,15 +107,27 @@ def start_backend():
         print(f"⚠️  数据库迁移检查失败: {e}")
         print("将尝试使用传统初始化方式...")
     
-    print("📍 监听地址: http://0.0.0.0:81")
+    host = os.getenv('API_HOST', '0.0.0.0')
+    port = int(os.getenv('API_PORT', 81))
+    print(f"📍 监听地址: http://{host}:{port}")
     print("🔍 日志级别: INFO")
     print("📄 日志文件: api_server.log")
     print("⏸️  按 Ctrl+C 停止服务\n")
     
+    # 使用 gunicorn 多线程服务启动（配置见 gunicorn.conf.py），gunicorn 仅支持类 Unix 系统
+    use_gunicorn = os.name == 'posix' and importlib.util.find_spec('gunicorn') is not None
+    
     try:
-        # 启动Flask应用
-        from app import app
-        app.run(host='0.0.0.0', port=81, debug=True)
+        if use_gunicorn:
+            print(f"⚙️  gunicorn: {os.getenv('API_WORKERS', 1)} 个进程 × {os.getenv('API_THREADS', 16)} 个线程")
+            subprocess.run([
+                sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'
+            ], cwd=Path(__file__).parent, check=True)
+        else:
+            # Windows 或未安装 gunicorn 时退回 Flask 开发服务器
+            print("⚠️  未找到 gunicorn，使用 Flask 开发服务器")
+            from app import app
+            app.run(host=host, port=port, debug=False)
         
     except KeyboardInterrupt:
         print("\n\n👋 服务已停止")
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+接口与用户数据库测试
+/api/status 对未知任务返回 404、/api/generate 排队超限返回 429 且按登录用户区分，
+use_trial 以单条条件 UPDATE 原子扣减试用次数并在同一事务写入使用记录
+"""
+
+import os
+import sys
+import threading
+import importlib
+
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from generation_queue import GenerationJobQueue
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """导入 app 模块：跳过启动时的数据库迁移，日志与图片写到临时目录，其余依赖（连接池等）均在首次使用时才连接"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(tmp_path_factory.mktemp('app'))
+        mp.setenv('IMAGE_STORE_DIR', '')
+        mp.setenv('RESULT_CACHE_ENABLED', 'False')
+        mp.setenv('USAGE_LOG_ASYNC', 'False')
+        import database_migration
+        mp.setattr(database_migration.DatabaseMigration, 'run_migrations', lambda self, force=False: True)
+        yield importlib.import_module('app')
+
+
+class BlockingGenerator:
+    """同步生成器：release 之前所有任务都停在 generate 中"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def generate(self, prompt, size, n, response_format, on_task_created=None):
+        self.release.wait(5)
+        return {'success': True, 'images': [], 'task_status': 'SUCCEEDED'}
+
+
+@pytest.fixture
+def job_queue(app_module, monkeypatch):
+    """替换全局生成队列，避免请求上游接口"""
+    generator = BlockingGenerator()
+    queue = GenerationJobQueue(generator, workers=1, max_jobs_per_user=1)
+    monkeypatch.setattr(app_module, 'generation_queue', queue)
+    yield queue
+    generator.release.set()
+    queue.stop(timeout=1)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def auth_header(app_module, user_id):
+    from flask_jwt_extended import create_access_token
+    with app_module.app.app_context():
+        return {'Authorization': f"Bearer {create_access_token(identity=str(user_id))}"}
+
+
+def test_status_returns_404_for_unknown_job(client, job_queue):
+    response = client.get(f"/api/status/{'0' * 32}")
+    assert response.status_code == 404
+    assert response.get_json()['success'] is False
+
+
+def test_status_reports_submitted_job(client, job_queue):
+    response = client.post('/api/generate', json={'prompt': 'a cat'})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    status = client.get(f"/api/status/{job_id}")
+    assert status.status_code == 200
+    assert status.get_json()['job_id'] == job_id
+    assert status.get_json()['status'] in ('queued', 'running')
+
+
+def test_generate_returns_429_when_user_has_too_many_jobs(client, job_queue):
+    assert client.post('/api/generate', json={'prompt': 'a cat'}).status_code == 202
+    response = client.post('/api/generate', json={'prompt': 'a dog'})
+    assert response.status_code == 429
+    assert response.get_json()['success'] is False
+
+
+def test_generate_keys_jobs_by_logged_in_user(app_module, client, job_queue):
+    for user_id in (1, 2):
+        response = client.post('/api/generate', json={'prompt': 'a cat'}, headers=auth_header(app_module, user_id))
+        assert response.status_code == 202
+    response = client.post('/api/generate', json={'prompt': 'a dog'}, headers=auth_header(app_module, 1))
+    assert response.status_code == 429
+
+
+class FakeUsersDB:
+    """只实现 use_trial 用到的语句：条件 UPDATE 原子执行，usage_logs 在提交时才写入"""
+
+    def __init__(self, users):
+        self.users = users  # {user_id: {'demo_count': n, 'role': role}}
+        self.usage_logs = []
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return FakeUsersConnection(self)
+
+
+class FakeUsersConnection:
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pending = []
+
+    def cursor(self):
+        return FakeUsersCursor(self)
+
+    def commit(self):
+        with self.db.lock:
+            self.db.usage_logs.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+class FakeUsersCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.lastrowid = None
+        self.result = None
+
+    def execute(self, sql, params):
+        db = self.conn.db
+        sql = ' '.join(sql.split())
+        if sql.startswith('UPDATE users SET demo_count = LAST_INSERT_ID(demo_count - 1)'):
+            with db.lock:
+                user = db.users.get(params[0])
+                if user and user['demo_count'] > 0 and user['role'] != 'admin':
+                    user['demo_count'] -= 1
+                    self.rowcount, self.lastrowid = 1, user['demo_count']
+                else:
+                    self.rowcount = 0
+        elif sql.startswith('SELECT role FROM users'):
+            user = db.users.get(params[0])
+            self.result = (user['role'],) if user else None
+        elif sql.startswith('INSERT INTO usage_logs'):
+            self.conn.pending.append(params)
+        else:
+            raise AssertionError(f"unexpected SQL: {sql}")
+
+    def fetchone(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def users_db(app_module):
+    fake = FakeUsersDB({
+        1: {'demo_count': 3, 'role': 'user'},
+        2: {'demo_count': 0, 'role': 'admin'}
+    })
+    user_db = app_module.UserDatabase.__new__(app_module.UserDatabase)
+    user_db.get_connection = fake.connect
+    user_db.usage_recorder = None
+    user_db.user_cache = app_module.create_user_cache()
+    return user_db, fake
+
+
+def test_use_trial_decrements_atomically_under_concurrency(users_db):
+    user_db, fake = users_db
+    results = []
+    errors = []
+    barrier = threading.Barrier(10)
+
+    def use():
+        barrier.wait()
+        try:
+            results.append(user_db.use_trial(1)['remaining_trials'])
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=use) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [0, 1, 2]
+    assert errors == ["试用次数已用完"] * 7
+    assert fake.users[1]['demo_count'] == 0
+    assert fake.usage_logs == [(1, 'image_generation')] * 3
+
+
+def test_use_trial_does_not_decrement_admin(users_db):
+    user_db, fake = users_db
+    result = user_db.use_trial(2)
+    assert result == {'success': True, 'remaining_trials': 999999, 'is_admin': True}
+    assert fake.users[2]['demo_count'] == 0
+    assert fake.usage_logs == [(2, 'image_generation')]
+
+
+def test_use_trial_unknown_user(users_db):
+    user_db, fake = users_db
+    with pytest.raises(ValueError, match="用户不存在"):
+        user_db.use_trial(99)
+    assert fake.usage_logs == []
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+分批迁移断点续跑测试
+DDL 隐式提交，进程在 DDL 生效后、断点推进前中断时，重新运行不能因对象已存在而失败
+"""
+
+import os
+import re
+import sys
+import json
+
+import pytest
+from mysql.connector import Error
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_migration import DatabaseMigration
+
+MIGRATION = {
+    'version': '900',
+    'name': 'add_nickname',
+    'sql': [
+        {'type': 'ddl', 'sql': 'ALTER TABLE users ADD COLUMN nickname VARCHAR(50) NULL'},
+        {'type': 'backfill', 'table': 'users', 'set': "nickname = ''", 'batch_size': 10, 'sleep_ms': 0}
+    ]
+}
+
+
+class Crash(Exception):
+    """模拟进程在两条语句之间被终止"""
+
+
+class FakeMySQL:
+    """只实现分批迁移用到的语句：断点行在提交后才持久化，DDL 立即生效并隐式提交"""
+
+    def __init__(self):
+        self.columns = {'id'}
+        self.rows = {}  # 已提交的迁移记录 {version: (status, checkpoint)}
+        self.pending = {}
+        self.ddl_runs = 0
+        self.crash_after_ddl = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.rows.update(self.pending)
+        self.pending = {}
+
+    def rollback(self):
+        self.pending = {}
+
+
+class FakeCursor:
+
+    def __init__(self, db):
+        self.db = db
+        self.result = None
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        db = self.db
+        if db.crash_after_ddl and db.ddl_runs:
+            db.crash_after_ddl = False
+            raise Crash()
+        column = re.match(r'ALTER TABLE users ADD COLUMN (\w+)', sql)
+        if column:
+            db.commit()
+            db.ddl_runs += 1
+            if column.group(1) in db.columns:
+                raise Error(msg=f"Duplicate column name '{column.group(1)}'", errno=1060)
+            db.columns.add(column.group(1))
+        elif 'SELECT checkpoint' in sql:
+            status, checkpoint = db.rows.get(params[0], (None, None))
+            self.result = (checkpoint,) if status == 'running' else None
+        elif "'running'" in sql:
+            db.pending[params[0]] = ('running', params[2])
+        elif "'completed'" in sql:
+            db.pending[params[0]] = ('completed', None)
+        elif sql.startswith('SELECT MIN'):
+            self.result = (None, None)
+        else:
+            raise AssertionError(f"unexpected SQL: {sql}")
+
+    def fetchone(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def make_migration():
+    return DatabaseMigration({'host': 'localhost', 'database': 'joyful'})
+
+
+def test_resume_after_ddl_step_skips_applied_ddl():
+    db = FakeMySQL()
+    db.crash_after_ddl = True
+    migration = make_migration()
+
+    with pytest.raises(Crash):
+        migration.execute_migration(MIGRATION, conn=db)
+    assert 'nickname' in db.columns
+    assert json.loads(db.rows['900'][1]) == {'step': 0, 'ddl_started': True}
+
+    migration.execute_migration(MIGRATION, conn=db)
+    assert db.ddl_runs == 2
+    assert db.rows['900'] == ('completed', None)
+
+
+def test_ddl_error_on_first_run_is_not_skipped():
+    db = FakeMySQL()
+    db.columns.add('nickname')
+
+    with pytest.raises(Error):
+        make_migration().execute_migration(MIGRATION, conn=db)
+    assert db.rows['900'][0] == 'running'
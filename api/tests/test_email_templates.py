@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+验证码邮件模板测试
+预编译拼接的邮件必须与 email.policy.SMTP 序列化结果一致，且不含裸 LF（SMTP 要求 CRLF）
+"""
+
+import os
+import re
+import sys
+from email import policy, message_from_bytes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_templates import VerificationEmailTemplate
+
+BARE_LF = re.compile(b'(?<!\r)\n')
+
+
+def make_template():
+    return VerificationEmailTemplate(
+        sender='Joyful System <system@joyful.cloud>',
+        subject='Joyful Registration Service - Verification Code',
+        expiry_minutes=10
+    )
+
+
+def reference_bytes(template, to_email, code):
+    msg = template.build_mime(to_email, code)
+    msg.set_boundary(template.boundary)
+    return msg.as_bytes(policy=policy.SMTP)
+
+
+def test_build_message_has_no_bare_lf():
+    template = make_template()
+    for code in ('123456', '000000', '12345678'):
+        data = template.build_message('user@example.com', code)
+        assert BARE_LF.search(data) is None
+        assert data.endswith(b'\r\n')
+
+
+def test_build_message_matches_smtp_policy():
+    template = make_template()
+    for code in ('123456', '987654', '1234'):
+        assert template.build_message('user@example.com', code) == reference_bytes(template, 'user@example.com', code)
+
+
+def test_non_ascii_recipient_falls_back_to_crlf_mime():
+    template = make_template()
+    data = template.build_message('用户@example.com', '123456')
+    assert BARE_LF.search(data) is None
+
+
+def test_build_message_decodes_to_rendered_bodies():
+    template = make_template()
+    msg = message_from_bytes(template.build_message('user@example.com', '424242'))
+    text_part, html_part = msg.get_payload()
+    text_content, html_content = template.render('424242')
+    assert text_part.get_payload(decode=True).decode('utf-8').replace('\r\n', '\n') == text_content
+    assert html_part.get_payload(decode=True).decode('utf-8') == html_content
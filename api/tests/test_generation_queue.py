@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+图片生成任务队列测试
+按用户轮转的公平调度、排队位置，以及单用户/队列上限触发的 QueueFullError（接口返回 429）
+"""
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generation_queue import GenerationJobQueue, QueueFullError
+
+
+class BlockingGenerator:
+    """同步生成器：记录执行顺序，release 之前所有任务都停在 generate 中"""
+
+    def __init__(self):
+        self.started = []
+        self.running = threading.Event()
+        self.release = threading.Event()
+
+    def generate(self, prompt, size, n, response_format, on_task_created=None):
+        self.started.append(prompt)
+        self.running.set()
+        self.release.wait(5)
+        return {'success': True, 'images': [], 'task_status': 'SUCCEEDED'}
+
+
+@pytest.fixture
+def generator():
+    generator = BlockingGenerator()
+    yield generator
+    generator.release.set()
+
+
+def make_queue(generator, **kwargs):
+    queue = GenerationJobQueue(generator, workers=1, **kwargs)
+    return queue
+
+
+def occupy_worker(queue, generator):
+    """提交一个占住唯一工作线程的任务，之后提交的任务都处于排队状态"""
+    job = queue.submit('user:gate', 'gate', '1024*1024', 1)
+    assert generator.running.wait(5)
+    return job
+
+
+def wait_finished(queue, job_ids, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(queue.get_job(job_id)['status'] in ('succeeded', 'failed') for job_id in job_ids):
+            return
+        time.sleep(0.01)
+    raise AssertionError("任务未在时限内完成")
+
+
+def test_jobs_are_scheduled_round_robin_across_users(generator):
+    queue = make_queue(generator)
+    try:
+        gate = occupy_worker(queue, generator)
+        jobs = {}
+        for prompt in ('a1', 'a2', 'a3'):
+            jobs[prompt] = queue.submit('user:a', prompt, '1024*1024', 1)
+        for prompt in ('b1', 'b2'):
+            jobs[prompt] = queue.submit('user:b', prompt, '1024*1024', 1)
+
+        positions = {prompt: queue.get_job(job['job_id'])['queue_position'] for prompt, job in jobs.items()}
+        assert positions == {'a1': 1, 'b1': 2, 'a2': 3, 'b2': 4, 'a3': 5}
+
+        generator.release.set()
+        wait_finished(queue, [gate['job_id']] + [job['job_id'] for job in jobs.values()])
+        assert generator.started == ['gate', 'a1', 'b1', 'a2', 'b2', 'a3']
+        assert queue.get_job(jobs['a3']['job_id'])['result']['success'] is True
+    finally:
+        queue.stop(timeout=1)
+
+
+def test_per_user_limit_rejects_only_that_user(generator):
+    queue = make_queue(generator, max_jobs_per_user=2)
+    try:
+        gate = occupy_worker(queue, generator)
+        first = queue.submit('user:a', 'a1', '1024*1024', 1)
+        queue.submit('user:a', 'a2', '1024*1024', 1)
+        with pytest.raises(QueueFullError):
+            queue.submit('user:a', 'a3', '1024*1024', 1)
+        queue.submit('user:b', 'b1', '1024*1024', 1)
+        assert queue.get_stats()['rejected'] == 1
+
+        # 任务完成后释放名额
+        generator.release.set()
+        wait_finished(queue, [gate['job_id'], first['job_id']])
+        queue.submit('user:a', 'a4', '1024*1024', 1)
+    finally:
+        queue.stop(timeout=1)
+
+
+def test_full_queue_rejects_new_jobs(generator):
+    queue = make_queue(generator, max_queue_size=2)
+    try:
+        occupy_worker(queue, generator)
+        queue.submit('user:a', 'a1', '1024*1024', 1)
+        queue.submit('user:b', 'b1', '1024*1024', 1)
+        with pytest.raises(QueueFullError):
+            queue.submit('user:c', 'c1', '1024*1024', 1)
+    finally:
+        queue.stop(timeout=1)
+
+
+def test_unknown_job_returns_none(generator):
+    queue = make_queue(generator)
+    assert queue.get_job('0' * 32) is None
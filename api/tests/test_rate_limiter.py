@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+令牌桶限流测试
+桶容量耗尽后按补充速率恢复，补充不超过容量；多维度检查时被拒绝的请求不消耗后续桶的令牌
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limiter
+from rate_limiter import LocalBucketBackend, RateLimiter, parse_rate
+
+
+class FakeClock:
+    """替换 rate_limiter 模块中的 time，手动推进单调时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', clock)
+    return clock
+
+
+def test_parse_rate():
+    assert parse_rate('5/60') == (5.0, 5.0 / 60)
+    assert parse_rate('10') == (10.0, 10.0)
+    assert parse_rate('') is None
+    with pytest.raises(ValueError):
+        parse_rate('-1/60')
+
+
+def test_bucket_refills_at_configured_rate(clock):
+    backend = LocalBucketBackend()
+    capacity, rate = parse_rate('5/60')
+
+    for _ in range(5):
+        assert backend.consume('ip', capacity, rate) == (True, 0.0)
+    allowed, retry_after = backend.consume('ip', capacity, rate)
+    assert not allowed
+    assert retry_after == pytest.approx(12.0)
+
+    clock.advance(11.9)
+    assert not backend.consume('ip', capacity, rate)[0]
+    clock.advance(0.2)
+    assert backend.consume('ip', capacity, rate)[0]
+    assert not backend.consume('ip', capacity, rate)[0]
+
+
+def test_refill_is_capped_at_capacity(clock):
+    backend = LocalBucketBackend()
+    capacity, rate = parse_rate('5/60')
+    backend.consume('ip', capacity, rate)
+
+    clock.advance(3600)
+    results = [backend.consume('ip', capacity, rate)[0] for _ in range(6)]
+    assert results == [True] * 5 + [False]
+
+
+def test_rejected_request_does_not_consume_later_buckets(clock):
+    limiter = RateLimiter(LocalBucketBackend(), {
+        'send_code_ip': parse_rate('1/60'),
+        'send_code_global': parse_rate('2/60')
+    })
+    checks = lambda ip: [('send_code_ip', ip), ('send_code_global', 'all')]
+
+    assert limiter.check(checks('1.1.1.1')) is None
+    rejection = limiter.check(checks('1.1.1.1'))
+    assert rejection.rule == 'send_code_ip'
+    assert rejection.retry_after_seconds == 60
+    # 上一个请求在IP桶被拒，全局桶仍剩一个令牌
+    assert limiter.check(checks('2.2.2.2')) is None
+    assert limiter.check(checks('3.3.3.3')).rule == 'send_code_global'
+
+    clock.advance(30)
+    assert limiter.check(checks('4.4.4.4')) is None
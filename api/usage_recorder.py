@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+使用记录异步写入模块
+在内存中缓冲 usage_logs 事件，由后台线程批量写入数据库；
+批量写入失败时逐条重试，多次失败的单条记录被丢弃，不会阻塞其他记录
+"""
+
+import time
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UsageRecorder:
+    """usage_logs 批量异步写入器"""
+
+    INSERT_SQL = 'INSERT INTO usage_logs (user_id, demo_type, used_at) VALUES (%s, %s, %s)'
+
+    def __init__(self, get_connection, batch_size=200, flush_interval=1.0, max_buffer=10000, max_attempts=3):
+        self.get_connection = get_connection  # 返回数据库连接的函数（连接 close() 时归还连接池）
+        self.batch_size = batch_size  # 缓冲达到该条数时立即写入
+        self.flush_interval = flush_interval  # 最长写入间隔（秒）
+        self.max_buffer = max_buffer  # 缓冲上限，超出的事件被丢弃
+        self.max_attempts = max_attempts  # 单条记录最多写入次数，超出后丢弃
+
+        # 缓冲项为 (记录, 已失败次数)
+        self.buffer = deque()
+        self.cond = threading.Condition(threading.Lock())
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.stopping = False
+
+        # 指标
+        self.stats = {
+            'recorded': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'flushed_rows': 0,
+            'flush_failures': 0,
+            'row_retries': 0,
+            'dead_lettered': 0,
+            'last_flush_ms': 0.0
+        }
+
+        atexit.register(self.stop)
+
+    def start(self):
+        """启动后台写入线程（首次记录时自动调用，避免在 fork 前创建线程）"""
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name='usage-recorder', daemon=True)
+            self.thread.start()
+
+    def record(self, user_id, demo_type):
+        """记录一次使用事件，不阻塞调用方"""
+        if self.thread is None:
+            self.start()
+
+        with self.cond:
+            if len(self.buffer) >= self.max_buffer:
+                self.stats['dropped'] += 1
+                return False
+            self.buffer.append(((user_id, demo_type, datetime.now()), 0))
+            self.stats['recorded'] += 1
+            if len(self.buffer) >= self.batch_size:
+                self.cond.notify()
+        return True
+
+    def _run(self):
+        """后台线程：按条数或时间触发写入"""
+        while True:
+            with self.cond:
+                if not self.stopping and len(self.buffer) < self.batch_size:
+                    self.cond.wait(self.flush_interval)
+                stopping = self.stopping
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        """将缓冲中的事件写入数据库"""
+        with self.flush_lock:
+            while True:
+                with self.cond:
+                    if not self.buffer:
+                        return
+                    batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+
+                start = time.monotonic()
+                try:
+                    with self.get_connection() as conn:
+                        cursor = conn.cursor()
+                        # mysql-connector 会将 INSERT 的 executemany 合并为单条多行 INSERT
+                        cursor.executemany(self.INSERT_SQL, [row for row, _ in batch])
+                        conn.commit()
+                        cursor.close()
+                except Exception as e:
+                    logger.error(f"批量写入使用记录失败，改为逐条写入: {e}")
+                    with self.cond:
+                        self.stats['flush_failures'] += 1
+                    retry = self._insert_rows(batch)
+                    if retry:
+                        self._requeue(retry)
+                        return
+                    continue
+
+                with self.cond:
+                    self.stats['flushes'] += 1
+                    self.stats['flushed_rows'] += len(batch)
+                    self.stats['last_flush_ms'] = round((time.monotonic() - start) * 1000, 3)
+
+    def _insert_rows(self, batch):
+        """逐条写入批量失败的记录，返回需要稍后重试的记录
+
+        单条失败的记录累计失败次数，达到 max_attempts 后丢弃（记录到错误日志）；
+        无法获取连接时整批原样返回，不计入失败次数。
+        """
+        retry = []
+        written = 0
+        index = 0
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                for index, (row, attempts) in enumerate(batch):
+                    try:
+                        cursor.execute(self.INSERT_SQL, row)
+                        conn.commit()
+                        written += 1
+                        continue
+                    except Exception as e:
+                        conn.rollback()
+                        error = e
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        logger.error(f"使用记录写入失败 {attempts} 次，已丢弃: {row}: {error}")
+                        with self.cond:
+                            self.stats['dead_lettered'] += 1
+                    else:
+                        retry.append((row, attempts))
+                        with self.cond:
+                            self.stats['row_retries'] += 1
+                index = len(batch)
+                cursor.close()
+        except Exception as e:
+            # 无法获取连接或连接中途断开：尚未处理的记录原样放回
+            logger.error(f"逐条写入使用记录中断，稍后重试: {e}")
+            retry.extend(batch[index:])
+
+        with self.cond:
+            self.stats['flushed_rows'] += written
+        return retry
+
+    def _requeue(self, batch):
+        """把待重试的记录放回缓冲头部，超出容量的部分丢弃"""
+        with self.cond:
+            room = self.max_buffer - len(self.buffer)
+            if room < len(batch):
+                self.stats['dropped'] += len(batch) - max(room, 0)
+                batch = batch[:max(room, 0)]
+            self.buffer.extendleft(reversed(batch))
+
+    def stop(self, timeout=10):
+        """停止后台线程并写入剩余事件"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            thread.join(timeout)
+        else:
+            self.flush()
+
+    def get_stats(self):
+        """获取写入指标"""
+        with self.cond:
+            return {
+                'buffered': len(self.buffer),
+                'max_buffer': self.max_buffer,
+                **self.stats
+            }
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+用户信息缓存模块
+按用户ID缓存用户记录，减少JWT接口对数据库的读取；
+每个键带版本号，失效时版本号递增，读库前取得的版本号已变化时不回填，避免旧数据在失效后被写回
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCacheBackend:
+    """进程内 TTL + LRU 缓存后端"""
+
+    def __init__(self, max_items=10000):
+        self.max_items = max_items  # 最大条目数
+        # {key: (expires_at, value)}，按访问顺序排列
+        self.items = OrderedDict()
+        # {key: version}，只记录发生过失效的键，按失效顺序排列
+        self.versions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def version(self, key):
+        with self.lock:
+            return self.versions.get(key, 0)
+
+    def set(self, key, value, ttl, version=None):
+        """写入缓存；指定 version 且该键已失效过（版本号变化）时不写入，返回是否写入"""
+        with self.lock:
+            if version is not None and self.versions.get(key, 0) != version:
+                return False
+            self.items[key] = (time.monotonic() + ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+            self.versions[key] = self.versions.get(key, 0) + 1
+            self.versions.move_to_end(key)
+            while len(self.versions) > self.max_items:
+                self.versions.popitem(last=False)
+
+    def size(self):
+        with self.lock:
+            return len(self.items)
+
+
+class RedisCacheBackend:
+    """Redis 共享缓存后端，多个工作进程共享同一份缓存与失效"""
+
+    # KEYS[1]=缓存键, KEYS[2]=版本键；ARGV=值, 过期秒数, 读库前的版本号。版本号一致时才写入
+    SET_IF_VERSION_SCRIPT = """
+local current = redis.call('GET', KEYS[2]) or '0'
+if current ~= ARGV[3] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+    # KEYS[1]=缓存键, KEYS[2]=版本键；ARGV=版本键过期秒数
+    INVALIDATE_SCRIPT = """
+redis.call('DEL', KEYS[1])
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+    def __init__(self, redis_url, key_prefix='joyful:user:', version_ttl=3600):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError("使用 Redis 缓存后端需要安装 redis: pip install redis")
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+        self.key_prefix = key_prefix
+        self.version_ttl = version_ttl  # 版本键保留时间（秒），需远大于一次读库耗时
+        self.set_if_version_script = self.client.register_script(self.SET_IF_VERSION_SCRIPT)
+        self.invalidate_script = self.client.register_script(self.INVALIDATE_SCRIPT)
+
+    def _version_key(self, key):
+        return f"{self.key_prefix}v:{key}"
+
+    def get(self, key):
+        raw = self.client.get(self.key_prefix + key)
+        return json.loads(raw) if raw else None
+
+    def version(self, key):
+        raw = self.client.get(self._version_key(key))
+        return int(raw) if raw else 0
+
+    def set(self, key, value, ttl, version=None):
+        if version is None:
+            self.client.set(self.key_prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+            return True
+        written = self.set_if_version_script(
+            keys=[self.key_prefix + key, self._version_key(key)],
+            args=[json.dumps(value), max(int(ttl), 1), str(version)]
+        )
+        return bool(int(written))
+
+    def delete(self, key):
+        self.invalidate_script(
+            keys=[self.key_prefix + key, self._version_key(key)],
+            args=[self.version_ttl]
+        )
+
+    def size(self):
+        return None
+
+
+class UserCache:
+    """用户信息缓存，缓存后端异常时退化为直接读库"""
+
+    def __init__(self, backend, ttl_seconds=60):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds  # 缓存有效期（秒）
+        self.lock = threading.Lock()
+
+        # 指标
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'stale_sets_skipped': 0,
+            'errors': 0
+        }
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get(self, user_id):
+        """读取缓存的用户信息，未命中时返回 None"""
+        try:
+            user = self.backend.get(str(user_id))
+        except Exception as e:
+            logger.warning(f"读取用户缓存失败: {e}")
+            self._count('errors')
+            return None
+        self._count('hits' if user is not None else 'misses')
+        return dict(user) if user is not None else None
+
+    def version(self, user_id):
+        """读库前调用，取得用户缓存的当前版本号；后端异常时返回 None（之后不回填缓存）"""
+        try:
+            return self.backend.version(str(user_id))
+        except Exception as e:
+            logger.warning(f"读取用户缓存版本失败: {e}")
+            self._count('errors')
+            return None
+
+    def set(self, user, version):
+        """回填用户信息；version 为读库前取得的版本号，期间发生过失效时不写入"""
+        if version is None:
+            return
+        try:
+            if not self.backend.set(str(user['id']), dict(user), self.ttl_seconds, version=version):
+                self._count('stale_sets_skipped')
+        except Exception as e:
+            logger.warning(f"写入用户缓存失败: {e}")
+            self._count('errors')
+
+    def invalidate(self, user_id):
+        """使用户缓存失效"""
+        try:
+            self.backend.delete(str(user_id))
+            self._count('invalidations')
+        except Exception as e:
+            logger.warning(f"删除用户缓存失败: {e}")
+            self._count('errors')
+
+    def get_stats(self):
+        """获取缓存指标"""
+        with self.lock:
+            total = self.stats['hits'] + self.stats['misses']
+            return {
+                'backend': type(self.backend).__name__,
+                'size': self.backend.size(),
+                'hit_rate': round(self.stats['hits'] / total, 4) if total else 0.0,
+                **self.stats
+            }
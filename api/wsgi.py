@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+"""
+WSGI入口
+供 gunicorn 等生产服务器加载: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import app
+
+application = app
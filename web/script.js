@@ -338,6 +338,15 @@ async function handleGenerate() {
     }
 }
 
+// Build request headers carrying the login token, so the backend queues jobs per user instead of per proxy IP
+function getAuthHeaders(extraHeaders = {}) {
+    const token = window.AuthUtils ? window.AuthUtils.getToken() : null;
+    return {
+        ...extraHeaders,
+        ...(token && { 'Authorization': `Bearer ${token}` })
+    };
+}
+
 // Call backend API to generate image
 async function generateImageAPI() {
     const requestData = {
@@ -349,9 +358,9 @@ async function generateImageAPI() {
     try {
         const response = await fetch(`${API_BASE_URL}/generate`, {
             method: 'POST',
-            headers: {
+            headers: getAuthHeaders({
                 'Content-Type': 'application/json',
-            },
+            }),
             body: JSON.stringify(requestData)
         });
         
@@ -361,6 +370,11 @@ async function generateImageAPI() {
             throw new Error(data.error || `HTTP error! status: ${response.status}`);
         }
         
+        // 后端立即返回任务ID，轮询任务状态直到完成
+        if (data.job_id) {
+            return await pollGenerationJob(data.job_id);
+        }
+        
         return data;
     } catch (error) {
         if (error.name === 'TypeError' && error.message.includes('fetch')) {
@@ -370,6 +384,37 @@ async function generateImageAPI() {
     }
 }
 
+// Poll generation job status until it finishes
+async function pollGenerationJob(jobId) {
+    const pollInterval = 1500;
+    const maxWaitMs = 15 * 60 * 1000;
+    const deadline = Date.now() + maxWaitMs;
+    
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, pollInterval));
+        
+        const response = await fetch(`${API_BASE_URL}/status/${jobId}`, {
+            headers: getAuthHeaders()
+        });
+        const data = await response.json();
+        
+        // Job is unknown or its result has expired on the server; polling again will not help
+        if (response.status === 404) {
+            throw new Error(data.error || 'Generation job not found or expired. Please try again.');
+        }
+        
+        if (!response.ok) {
+            throw new Error(data.error || `HTTP error! status: ${response.status}`);
+        }
+        
+        if (data.status === 'succeeded' || data.status === 'failed') {
+            return data;
+        }
+    }
+    
+    throw new Error('Generation is taking too long. Please try again later.');
+}
+
 // Update generate button appearance
 function updateGenerateButton() {
     if (isGenerating) {
@@ -415,6 +460,14 @@ function updateProgress(progress) {
     }
 }
 
+// Resolve image source: streamed image URL, or inline base64 for older responses
+function getImageSrc(img) {
+    if (img.base64) {
+        return img.base64;
+    }
+    return `${API_BASE_URL}/images/${img.image_id}`;
+}
+
 // Show generated images with double-click zoom functionality
 function showGeneratedImages(images) {
     previewArea.style.display = 'none';
@@ -457,19 +510,22 @@ function showGeneratedImages(images) {
     const imageGrid = document.createElement('div');
     imageGrid.className = 'image-grid';
     
-    imageGrid.innerHTML = images.map((img, index) => `
+    imageGrid.innerHTML = images.map((img, index) => {
+        const src = getImageSrc(img);
+        return `
         <div class="image-item" data-image-index="${index}">
-            <img src="${img.base64}" alt="Generated ${index + 1}" data-image-src="${img.base64}">
+            <img src="${src}" alt="Generated ${index + 1}" data-image-src="${src}">
             <div class="image-actions">
-                <button class="action-btn download-btn" data-download-src="${img.base64}" data-download-index="${index}">
+                <button class="action-btn download-btn" data-download-src="${src}" data-download-index="${index}">
                     <i class="fas fa-download"></i>
                 </button>
-                <button class="action-btn copy-btn" data-copy-src="${img.base64}">
+                <button class="action-btn copy-btn" data-copy-src="${src}">
                     <i class="fas fa-copy"></i>
                 </button>
             </div>
         </div>
-    `).join('');
+    `;
+    }).join('');
     
     imageGroup.appendChild(imageGrid);
     
@@ -559,7 +615,7 @@ function viewImageFullSize(base64Data) {
 function downloadImageData(base64Data, index = 0) {
     try {
         const link = document.createElement('a');
-        link.href = base64Data;
+        link.href = base64Data.startsWith('data:') ? base64Data : `${base64Data}?download=1`;
         link.download = `generated-image-${index + 1}-${Date.now()}.png`;
         document.body.appendChild(link);
         link.click();
@@ -609,6 +665,14 @@ async function copyImageData(base64Data) {
 
 // Safari专用复制方法
 async function copyImageDataSafari(base64Data) {
+    // 非base64图片：以Promise形式传入ClipboardItem，保持用户交互上下文
+    if (!base64Data.startsWith('data:')) {
+        await navigator.clipboard.write([
+            new ClipboardItem({ 'image/png': fetch(base64Data).then(response => response.blob()) })
+        ]);
+        return;
+    }
+    
     // 直接从base64数据创建blob，避免fetch异步操作
     const base64Response = base64Data.split(',')[1];
     const mimeMatch = base64Data.match(/data:([^;]+);/);